@@ -1,8 +1,23 @@
+import sys
+
 import pytest
 
 pytest_plugins = ("pytest_jupyter.jupyter_server", )
 
 
+@pytest.fixture(autouse=True)
+def _runtime_files_in_tmp_path(tmp_path, monkeypatch):
+    # The extension writes cache.db and its other runtime files relative to
+    # the working directory; keep every test's copies out of the checkout.
+    monkeypatch.chdir(tmp_path)
+    yield
+    # Write what the test queued into its own cache.db, not the next test's.
+    handlers = sys.modules.get("jlab_ext_example.handlers")
+    if handlers is not None:
+        handlers.BKT_WRITER.flush()
+        handlers.TEACHING_WRITER.flush()
+
+
 @pytest.fixture
 def jp_server_config(jp_server_config):
     return {"ServerApp": {"jpserver_extensions": {"jlab_ext_example": True}}}
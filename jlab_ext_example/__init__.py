@@ -1,5 +1,6 @@
 from ._version import __version__
-from .handlers import setup_handlers
+from .handlers import recover_bkt_writes, recover_teaching_writes, setup_handlers
+from .migrations import run_migrations
 
 
 def _jupyter_labextension_paths():
@@ -18,6 +19,14 @@ def _load_jupyter_server_extension(server_app):
     server_app: jupyterlab.labapp.LabApp
         JupyterLab application instance
     """
+    version = run_migrations()
+    server_app.log.info(f"cache.db schema at version {version}")
+    recovered = recover_bkt_writes()
+    if recovered:
+        server_app.log.info(f"Replayed {recovered} BKT writes from the redo log")
+    recovered = recover_teaching_writes()
+    if recovered:
+        server_app.log.info(f"Replayed {recovered} teaching-state checkpoints")
     setup_handlers(server_app.web_app)
     name = "jlab_ext_example"
     server_app.log.info(f"Registered {name} server extension")
@@ -0,0 +1,184 @@
+"""
+Chat Memory Module
+
+Bounded conversation memory for the per-user chat bot. It replaces
+langchain's ConversationBufferMemory, which pasted the whole dialogue into
+every system prompt, so prompt size grew linearly with turns and total tokens
+over a 40-minute video grew quadratically.
+
+SummarizingMemory keeps the last `max_recent` exchanges verbatim. Older
+exchanges are folded into a running summary by a `summarize(summary, turns)`
+callable that runs on a background executor, so a turn never waits on it.
+Exchanges are folded in batches: a refresh starts once `summary_batch` of
+them are waiting, or sooner if the history no longer fits the budget, so a
+long conversation costs one summary call per `summary_batch` exchanges
+rather than one per exchange. Until a refresh lands, the not-yet-folded
+exchanges are still rendered verbatim (budget permitting), so nothing
+silently disappears from context.
+
+The rendered history is capped at `token_budget` estimated tokens
+(characters / CHARS_PER_TOKEN; the Gemini tokenizer is not available
+locally and this is only a budget, not a bill). The interface mirrors the
+two langchain methods the bot used: save_context() and
+load_memory_variables().
+"""
+
+import threading
+from typing import Callable, List, Optional, Tuple
+
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def format_turns(turns: List[Tuple[str, str]]) -> str:
+    """Render exchanges the way ConversationBufferMemory did."""
+    return "\n".join(f"Human: {human}\nAI: {ai}" for human, ai in turns)
+
+
+def _assemble(summary: str, pending, recent) -> str:
+    parts = []
+    if summary:
+        parts.append(f"Summary of the earlier conversation: {summary}")
+    if pending or recent:
+        parts.append(format_turns(list(pending) + list(recent)))
+    return "\n".join(parts)
+
+
+class SummarizingMemory:
+    """Last-N verbatim exchanges plus an asynchronously refreshed summary."""
+
+    def __init__(
+        self,
+        max_recent: int = 6,
+        token_budget: int = 2000,
+        summarize: Optional[Callable[[str, List[Tuple[str, str]]], str]] = None,
+        executor=None,
+        summary_batch: int = 4,
+    ):
+        self.max_recent = max_recent
+        self.token_budget = token_budget
+        self.summary_batch = summary_batch
+        self.summarize = summarize
+        self.executor = executor
+        self.summary = ""
+        self._recent: List[Tuple[str, str]] = []
+        # Exchanges pushed out of _recent but not yet folded into summary.
+        self._pending: List[Tuple[str, str]] = []
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self.summary_refreshes = 0
+        self.summary_failures = 0
+
+    def save_context(self, inputs: dict, outputs: dict) -> None:
+        with self._lock:
+            self._recent.append((inputs["input"], outputs["output"]))
+            overflow = len(self._recent) - self.max_recent
+            if overflow > 0:
+                self._pending.extend(self._recent[:overflow])
+                del self._recent[:overflow]
+        self._maybe_refresh()
+
+    def load_memory_variables(self, _inputs: dict) -> dict:
+        return {"history": self.render()}
+
+    def render(self) -> str:
+        """History text for the prompt, trimmed to the token budget.
+
+        Trimming order, least valuable first: pending exchanges (oldest
+        first; they are about to be summarized anyway), then recent
+        exchanges (oldest first, always keeping the latest), then the tail
+        of the summary.
+        """
+        with self._lock:
+            summary = self.summary
+            pending = list(self._pending)
+            recent = list(self._recent)
+
+        def assemble():
+            return _assemble(summary, pending, recent)
+
+        text = assemble()
+        while estimate_tokens(text) > self.token_budget and pending:
+            pending.pop(0)
+            text = assemble()
+        while estimate_tokens(text) > self.token_budget and len(recent) > 1:
+            recent.pop(0)
+            text = assemble()
+        if estimate_tokens(text) > self.token_budget and summary:
+            spare = self.token_budget * CHARS_PER_TOKEN - len(text) + len(summary)
+            summary = summary[: max(spare, 0)]
+            text = assemble()
+        return text
+
+    def _maybe_refresh(self) -> None:
+        if self.summarize is None:
+            return
+        with self._lock:
+            if self._refreshing or not self._pending:
+                return
+            if len(self._pending) < self.summary_batch and (
+                estimate_tokens(_assemble(self.summary, self._pending, self._recent))
+                <= self.token_budget
+            ):
+                return
+            self._refreshing = True
+            summary = self.summary
+            batch = list(self._pending)
+        if self.executor is None:
+            self._refresh(summary, batch)
+        else:
+            self.executor.submit(self._refresh, summary, batch)
+
+    def _refresh(self, summary: str, batch: List[Tuple[str, str]]) -> None:
+        try:
+            new_summary = self.summarize(summary, batch)
+        except Exception as exc:
+            # Keep the batch pending; the next save_context() retries it.
+            print(f"⚠️  Chat memory summary refresh failed: {exc}")
+            with self._lock:
+                self.summary_failures += 1
+                self._refreshing = False
+            return
+        with self._lock:
+            if new_summary:
+                self.summary = new_summary
+                del self._pending[: len(batch)]
+                self.summary_refreshes += 1
+            self._refreshing = False
+        if new_summary:
+            # More exchanges may have overflowed while the LLM call ran.
+            self._maybe_refresh()
+
+    def to_dict(self) -> dict:
+        """The conversation state, as JSON-serializable data."""
+        with self._lock:
+            return {
+                "summary": self.summary,
+                "recent": [list(turn) for turn in self._recent],
+                "pending": [list(turn) for turn in self._pending],
+                "summary_refreshes": self.summary_refreshes,
+                "summary_failures": self.summary_failures,
+            }
+
+    def restore(self, state: dict) -> None:
+        """Load state saved by to_dict(). Pending exchanges are re-summarized."""
+        with self._lock:
+            self.summary = state.get("summary", "")
+            self._recent = [tuple(turn) for turn in state.get("recent", [])]
+            self._pending = [tuple(turn) for turn in state.get("pending", [])]
+            self.summary_refreshes = state.get("summary_refreshes", 0)
+            self.summary_failures = state.get("summary_failures", 0)
+        self._maybe_refresh()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "recent_turns": len(self._recent),
+                "pending_turns": len(self._pending),
+                "summary_tokens": estimate_tokens(self.summary),
+                "summary_refreshes": self.summary_refreshes,
+                "summary_failures": self.summary_failures,
+            }
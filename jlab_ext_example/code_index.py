@@ -0,0 +1,222 @@
+"""
+Code Index Module
+
+Lookup tables over one segment's code block, for picking the code line(s) a
+knowledge item is about (handlers._find_code_line_indices). Knowledge items
+name functions and variables in single quotes, and each quoted term scores a
+line as:
+
+  * CALL (`filter(`)        — the strongest signal the line does that action
+  * DEFINITION (`x = ...`)  — where a variable is created (vs merely used)
+  * MENTION (`x` anywhere)  — a weak signal; the variable is referenced
+
+A single `=` after the term is a definition, but `==`, `>=`, `<=` are not
+(`species == "Dog"` mentions `species`, it does not define it).
+
+term_score() applies those rules to one line with regexes. CodeSegmentIndex
+tokenizes a block once and keeps, per identifier, the lines it is called,
+defined and mentioned on, so scoring a plain identifier against every line
+is a few dict lookups. Other terms (`aes(median)`, `labels = ...`) fall back
+to term_score() over the lines, once per term and index. handlers.py builds
+an index per segment when get_all_code() loads a video's *_code.json.
+
+The index also blanks the block for fill-in-blanks (blank()): every
+occurrence of each term outside string literals and comments becomes `___`,
+matched token by token so `labels=dollar_format()` still matches the term
+`labels = dollar_format()`. A term that is a call with empty parentheses
+(`n()`) blanks just the function name. Whole terms are blanked, the longest
+first, so `aes(median)` is one blank rather than `aes(___)`. Lines are never
+added, removed or reordered, so line i of the result lines up with line i
+of the source.
+"""
+
+import functools
+import re
+from typing import Dict, List, Set, Tuple
+
+CALL_WEIGHT = 3
+DEFINITION_WEIGHT = 2
+MENTION_WEIGHT = 1
+
+BLANK = "___"
+
+_TOKEN_RE = re.compile(r"\w+")
+_CALL_AFTER_RE = re.compile(r"\s*\(")
+_DEFINITION_AFTER_RE = re.compile(r"\s*(?:=(?!=)|<-)")
+_EMPTY_CALL_RE = re.compile(r"([\w.]+)\s*\(\s*\)")
+
+# Characters of an identifier: R names may contain dots (`is.na`), while in
+# Python a dot is attribute access (`df.groupby`).
+_NAME_CHARS = {"r": r"[\w.]", "python": r"\w"}
+
+
+@functools.lru_cache(maxsize=1024)
+def _term_patterns(term: str):
+    escaped = re.escape(term)
+    return (
+        re.compile(rf"\b{escaped}\s*\("),
+        re.compile(rf"\b{escaped}\s*(?:=(?!=)|<-)"),
+        re.compile(rf"\b{escaped}\b"),
+    )
+
+
+def term_score(term: str, line: str) -> int:
+    """Score one quoted term against one code line (call > definition > mention)."""
+    if not term:
+        return 0
+    call, definition, mention = _term_patterns(term)
+    if call.search(line):
+        return CALL_WEIGHT
+    if definition.search(line):
+        return DEFINITION_WEIGHT
+    if mention.search(line):
+        return MENTION_WEIGHT
+    return 0
+
+
+class CodeSegmentIndex:
+    """One code block from a *_code.json, split and tokenized.
+
+    `block` is stored with literal `\\n` separators and its first and last
+    lines are the ``` fences, which are dropped.
+    """
+
+    def __init__(self, block: str):
+        self.source = block
+        self.block_lines: List[str] = block.split("\\n")
+        self.lines: List[str] = self.block_lines[1:-1]
+        fence = self.block_lines[0].strip("`").strip().lower()
+        self.language = "python" if fence in ("python", "py") else "r"
+        self.paren_balance: List[int] = [
+            line.count("(") - line.count(")") for line in self.lines
+        ]
+        self.identifiers: List[Set[str]] = []
+        # identifier -> indices of the lines it is called/defined/mentioned on.
+        self.calls: Dict[str, List[int]] = {}
+        self.definitions: Dict[str, List[int]] = {}
+        self.mentions: Dict[str, List[int]] = {}
+        for i, line in enumerate(self.lines):
+            tokens = set()
+            for match in _TOKEN_RE.finditer(line):
+                name = match.group()
+                if _CALL_AFTER_RE.match(line, match.end()):
+                    _add(self.calls, name, i)
+                elif _DEFINITION_AFTER_RE.match(line, match.end()):
+                    _add(self.definitions, name, i)
+                tokens.add(name)
+            for name in tokens:
+                self.mentions.setdefault(name, []).append(i)
+            self.identifiers.append(tokens)
+        self._scores: Dict[str, Dict[int, int]] = {}
+        # Spans of string literals and comments, per block line.
+        self._literals = [_literal_spans(line) for line in self.block_lines]
+        self._blanked: Dict[tuple, tuple] = {}
+
+    def term_lines(self, term: str) -> Dict[int, int]:
+        """{line index: term_score} for every line `term` scores on."""
+        scores = self._scores.get(term)
+        if scores is None:
+            if not term:
+                scores = {}
+            elif _TOKEN_RE.fullmatch(term):
+                scores = dict.fromkeys(self.mentions.get(term, ()), MENTION_WEIGHT)
+                scores.update(
+                    dict.fromkeys(self.definitions.get(term, ()), DEFINITION_WEIGHT)
+                )
+                scores.update(dict.fromkeys(self.calls.get(term, ()), CALL_WEIGHT))
+            else:
+                scores = {}
+                for i, line in enumerate(self.lines):
+                    score = term_score(term, line)
+                    if score:
+                        scores[i] = score
+            self._scores[term] = scores
+        return scores
+
+    def blank(self, terms) -> Tuple[str, List[str]]:
+        """Blank every occurrence of `terms` in the block.
+
+        Returns the fenced block with newline separators, and the terms
+        that occur nowhere in its code.
+        """
+        key = tuple(terms)
+        result = self._blanked.get(key)
+        if result is None:
+            result = self._blank(key)
+            self._blanked[key] = result
+        return result
+
+    def _blank(self, terms) -> Tuple[str, List[str]]:
+        patterns = []
+        unique = {t.strip() for t in terms if t.strip()}
+        for term in sorted(unique, key=lambda t: (-len(t), t)):
+            pattern = self._term_pattern(term)
+            if pattern is not None:
+                patterns.append((term, pattern))
+        placed = set()
+        # The opening fence is not code.
+        lines = self.block_lines[:1]
+        for i, line in enumerate(self.block_lines[1:], 1):
+            literals = self._literals[i]
+            taken: List[Tuple[int, int]] = []
+            for term, pattern in patterns:
+                for match in pattern.finditer(line):
+                    start, end = match.span(1)
+                    if _inside(start, literals) or any(
+                        start < e and s < end for s, e in taken
+                    ):
+                        continue
+                    taken.append((start, end))
+                    placed.add(term)
+            for start, end in sorted(taken, reverse=True):
+                line = line[:start] + BLANK + line[end:]
+            lines.append(line)
+        missing = [
+            t for t in dict.fromkeys(t.strip() for t in terms) if t and t not in placed
+        ]
+        return "\n".join(lines), missing
+
+    def _term_pattern(self, term: str):
+        name = _NAME_CHARS[self.language]
+        tokens = re.findall(rf"{name}+|\S", term)
+        if not tokens:
+            return None
+        empty_call = _EMPTY_CALL_RE.fullmatch(term)
+        if empty_call:
+            tokens = re.findall(rf"{name}+|\S", empty_call.group(1))
+        body = r"\s*".join(re.escape(token) for token in tokens)
+        before = rf"(?<!{name})" if re.match(name, tokens[0]) else ""
+        after = rf"(?!{name})" if re.match(name, tokens[-1][-1]) else ""
+        if empty_call:
+            after += r"(?=\s*\()"
+        return re.compile(rf"{before}({body}){after}")
+
+
+def _literal_spans(line: str) -> List[Tuple[int, int]]:
+    """[start, end) of each string literal and comment in one line."""
+    spans = []
+    i, n = 0, len(line)
+    while i < n:
+        c = line[i]
+        if c in "\"'":
+            j = i + 1
+            while j < n and line[j] != c:
+                j += 2 if line[j] == "\\" else 1
+            spans.append((i, min(j + 1, n)))
+            i = j + 1
+        elif c == "#":
+            spans.append((i, n))
+            break
+        else:
+            i += 1
+    return spans
+
+
+def _inside(position: int, spans) -> bool:
+    return any(start <= position < end for start, end in spans)
+
+
+def _add(positions: Dict[str, List[int]], name: str, i: int) -> None:
+    lines = positions.setdefault(name, [])
+    if not lines or lines[-1] != i:
+        lines.append(i)
@@ -0,0 +1,106 @@
+"""
+Content Bundle Module
+
+Read side of the pre-warmed, per-video content bundle built offline by
+tools/precompute_content.py. Each study video has one read-only file,
+content_bundle/{video_id}.json, holding every user-independent artifact the
+teaching pipeline would otherwise generate lazily on first request:
+
+    {
+      "format": 1,
+      "version": "2026-10-18T12:00:00Z",   # build label, for the logs
+      "video_id": "...",
+      "model": "gemini-...",
+      "segments": [...],                   # get_video_segment()
+      "knowledge": {"<segment_index>": [...]},
+      "code_with_blanks": {"<segment_index>": "..."},
+      "modeling_cards": {"<segment_index>": {"interaction": "...",
+                                            "prompt": "...",
+                                            "card": {...}}}
+    }
+
+The runtime consults the bundle before cache.db. A file with an unknown
+`format` is ignored (and everything falls back to lazy generation), so an
+old package never misreads a newer bundle. Set TUTORLY_CONTENT_BUNDLE=0 to
+bypass it, which is what the precompute tool itself does.
+"""
+
+import copy
+import json
+import os
+import threading
+from typing import Optional
+
+BUNDLE_FORMAT = 1
+BUNDLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "content_bundle")
+
+_bundles: dict = {}
+_lock = threading.Lock()
+
+
+def is_bundle_enabled() -> bool:
+    return os.environ.get("TUTORLY_CONTENT_BUNDLE", "1").lower() not in ("0", "false", "no")
+
+
+def bundle_path(video_id: str, bundle_dir: str = BUNDLE_DIR) -> str:
+    return os.path.join(bundle_dir, f"{video_id}.json")
+
+
+def load_bundle(video_id: str) -> Optional[dict]:
+    """Return the bundle for a video, or None if absent/disabled/unreadable."""
+    if not is_bundle_enabled() or not video_id:
+        return None
+    with _lock:
+        if video_id in _bundles:
+            return _bundles[video_id]
+    try:
+        with open(bundle_path(video_id), "r") as f:
+            bundle = json.load(f)
+    except FileNotFoundError:
+        bundle = None
+    except (OSError, ValueError) as exc:
+        print(f"⚠️  Ignoring unreadable content bundle for {video_id}: {exc}")
+        bundle = None
+    if bundle is not None and bundle.get("format") != BUNDLE_FORMAT:
+        print(
+            f"⚠️  Ignoring content bundle for {video_id}: format "
+            f"{bundle.get('format')!r}, expected {BUNDLE_FORMAT}"
+        )
+        bundle = None
+    with _lock:
+        _bundles[video_id] = bundle
+    return bundle
+
+
+def get_segments(video_id: str) -> Optional[list]:
+    bundle = load_bundle(video_id)
+    if bundle and bundle.get("segments"):
+        # Callers annotate segments in place; never hand out the cached copy.
+        return copy.deepcopy(bundle["segments"])
+    return None
+
+
+def get_knowledge(video_id: str, segment_index) -> Optional[list]:
+    bundle = load_bundle(video_id)
+    if bundle:
+        knowledge = bundle.get("knowledge", {}).get(str(segment_index))
+        return list(knowledge) if knowledge else None
+    return None
+
+
+def get_code_with_blanks(video_id: str, segment_index) -> Optional[str]:
+    bundle = load_bundle(video_id)
+    if bundle:
+        return bundle.get("code_with_blanks", {}).get(str(segment_index)) or None
+    return None
+
+
+def get_modeling_card(video_id: str, segment_index, prompt: str) -> Optional[dict]:
+    """The precomputed card, only if it was built from exactly this prompt."""
+    bundle = load_bundle(video_id)
+    if not bundle:
+        return None
+    entry = bundle.get("modeling_cards", {}).get(str(segment_index))
+    if entry and entry.get("prompt") == prompt and entry.get("card"):
+        return dict(entry["card"])
+    return None
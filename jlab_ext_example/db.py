@@ -0,0 +1,118 @@
+"""
+Database Access Module
+
+Single entry point for cache.db. Every handler used to open its own
+sqlite3.connect("cache.db") per query, in the default rollback-journal mode
+(so readers and the writer blocked each other across participants'
+servers), and some early-return paths leaked the connection.
+
+Here each thread keeps one long-lived connection per database file,
+configured once with:
+
+  * journal_mode=WAL     readers never block the writer and vice versa;
+  * synchronous=NORMAL   fsync at checkpoints only, which is safe under WAL
+                         (a power loss can drop the last commits, never
+                         corrupt the file);
+  * busy_timeout         wait for another process' write lock instead of
+                         raising "database is locked";
+  * cached_statements    sqlite3's per-connection prepared-statement cache,
+                         which only pays off because connections persist.
+
+Use query_one / query_all for reads, execute for a single write, and
+`with transaction() as conn:` for several statements that must commit
+together. The path defaults to TUTORLY_DB_PATH, or cache.db in the server's
+working directory. Query and transaction times are recorded as the
+tutorly_db_seconds histogram (see metrics.py).
+"""
+
+import contextlib
+import os
+import sqlite3
+import threading
+import time
+
+from jlab_ext_example import metrics
+
+DB_PATH = os.environ.get("TUTORLY_DB_PATH", "cache.db")
+BUSY_TIMEOUT_SECONDS = 30
+STATEMENT_CACHE_SIZE = 256
+
+_local = threading.local()
+
+
+def connection(path: str = None) -> sqlite3.Connection:
+    """This thread's connection to `path` (default DB_PATH)."""
+    key = os.path.abspath(path or DB_PATH)
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(key)
+    if conn is None:
+        conn = sqlite3.connect(
+            key,
+            timeout=BUSY_TIMEOUT_SECONDS,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_SECONDS * 1000}")
+        conns[key] = conn
+    return conn
+
+
+@contextlib.contextmanager
+def transaction(path: str = None, immediate: bool = False):
+    """Commit on success, roll back on any exception.
+
+    `immediate=True` takes the write lock up front, for read-modify-write
+    sequences that must not interleave with another writer.
+    """
+    conn = connection(path)
+    started = time.perf_counter()
+    if immediate:
+        conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+    finally:
+        _observe("transaction", path, started)
+
+
+def _observe(op: str, path: str, started: float) -> None:
+    metrics.observe(
+        "tutorly_db_seconds",
+        time.perf_counter() - started,
+        op=op,
+        db=os.path.basename(path or DB_PATH),
+    )
+
+
+def query_one(sql: str, params=(), path: str = None):
+    started = time.perf_counter()
+    row = connection(path).execute(sql, params).fetchone()
+    _observe("query", path, started)
+    return row
+
+
+def query_all(sql: str, params=(), path: str = None):
+    started = time.perf_counter()
+    rows = connection(path).execute(sql, params).fetchall()
+    _observe("query", path, started)
+    return rows
+
+
+def execute(sql: str, params=(), path: str = None) -> int:
+    """Run one write statement and commit. Returns the affected row count."""
+    with transaction(path) as conn:
+        return conn.execute(sql, params).rowcount
+
+
+def close_thread_connections() -> None:
+    """Close this thread's connections (tests, tools that chdir)."""
+    for conn in getattr(_local, "conns", {}).values():
+        conn.close()
+    _local.conns = {}
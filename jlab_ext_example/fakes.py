@@ -0,0 +1,283 @@
+"""
+Fake Backends Module
+
+In-process stand-ins for the two network services the server talks to, so
+the handlers, firebase_logger and the load/regression benchmarks can run
+offline and deterministically:
+
+  * FakeGenaiClient: the slice of google-genai's Client the handlers use
+    (models.generate_content, aio.models.generate_content and
+    aio.models.generate_content_stream). Replies are canned per prompt
+    type, recognised by a marker in the system instruction, and arrive
+    after a fixed, configurable latency.
+  * FakeRTDB: an in-memory Realtime Database with the reference() API
+    firebase_logger uses: child, get, set, push, update (multi-path),
+    delete and transaction. Follows RTDB semantics for nulls: writing None
+    deletes, and empty objects do not exist.
+
+Selected by environment variable at import time:
+
+    TUTORLY_LLM_BACKEND=fake          handlers use FakeGenaiClient
+    TUTORLY_FAKE_LLM_LATENCY_MS=800   per-call latency (default 0)
+    TUTORLY_FAKE_LLM_RESPONSES=f.json {prompt type: reply} overrides
+    TUTORLY_FIREBASE_BACKEND=fake     firebase_logger uses FakeRTDB
+"""
+
+import asyncio
+import copy
+import json
+import os
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+from typing import Dict, Optional
+
+# (prompt type, marker in the system instruction), checked in order. Calls
+# that match nothing are "json" when JSON output was requested, else "chat".
+PROMPT_TYPES = [
+    ("articulation-score", "notices_pattern"),
+    ("segment-summary", "corresponds to each given learning goal"),
+    ("knowledge", "Procedural knowledge:"),
+    ("methods", "Cognitive Apprenticeship methods"),
+    ("code-with-blank", "code with blanks"),
+    ("conversation-summary", "running summary of a tutoring conversation"),
+]
+
+CANNED_RESPONSES = {
+    "articulation-score": json.dumps(
+        {"notices_pattern": 0.8, "plausible_cause": 0.6, "proposes_check": 0.4}
+    ),
+    "segment-summary": (
+        "[('Introduction', 'The author introduces the dataset and the goal.'), "
+        "('Visualize the data', 'The author draws a bar chart of the counts.'), "
+        "('Interpret the chart', 'The author explains which groups dominate.')]"
+    ),
+    "knowledge": json.dumps(
+        [
+            "Procedural knowledge: To count the rows per group, one need to "
+            "&use 'count' on the grouping column&, and consider sorting with 'sort = TRUE'.",
+            "Declarative knowledge: The bar chart shows that a few groups hold most rows.",
+        ]
+    ),
+    "methods": json.dumps(
+        [
+            {
+                "knowledge": "Procedural knowledge: To count the rows per group, "
+                "one need to use 'count' on the grouping column.",
+                "method": ["Scaffolding", "Coaching"],
+            }
+        ]
+    ),
+    "code-with-blank": "```r\npets %>%\n  ___(species, sort = TRUE)\n```",
+    "conversation-summary": "The student asked about counting and answered one question.",
+    # One object carrying the keys of every JSON card the handlers request
+    # (multiple-choice, task-intent, expert-reading), so any of them parses.
+    "json": json.dumps(
+        {
+            "question": "Which function counts rows per group?",
+            "choices": ["count", "filter", "arrange", "select"],
+            "correct answer": "count",
+            "rationale": "count() tallies rows for each value of a column.",
+            "task_goal": "Find which groups are most common.",
+            "approach": "Count rows per group and sort them.",
+            "where_to_look": "The longest bars.",
+            "what_to_compare": "Bar lengths across groups.",
+            "what_to_notice": "A few groups dominate.",
+        }
+    ),
+    "chat": "Good question! Try counting the rows per group and look at the largest ones.",
+}
+
+
+def classify_prompt(system_instruction: str, response_mime_type: Optional[str]) -> str:
+    for prompt_type, marker in PROMPT_TYPES:
+        if marker in (system_instruction or ""):
+            return prompt_type
+    return "json" if response_mime_type == "application/json" else "chat"
+
+
+class _Models:
+    def __init__(self, client):
+        self._client = client
+
+    def generate_content(self, model, contents, config):
+        text = self._client._reply(config)
+        if self._client.latency:
+            time.sleep(self._client.latency)
+        return SimpleNamespace(text=text)
+
+
+class _AsyncModels:
+    def __init__(self, client):
+        self._client = client
+
+    async def generate_content(self, model, contents, config):
+        text = self._client._reply(config)
+        if self._client.latency:
+            await asyncio.sleep(self._client.latency)
+        return SimpleNamespace(text=text)
+
+    async def generate_content_stream(self, model, contents, config):
+        text = self._client._reply(config)
+        words = text.split(" ")
+        chunks = [w + " " for w in words[:-1]] + [words[-1]]
+        delay = self._client.latency / len(chunks)
+
+        async def stream():
+            for chunk in chunks:
+                if delay:
+                    await asyncio.sleep(delay)
+                yield SimpleNamespace(text=chunk)
+
+        return stream()
+
+
+class FakeGenaiClient:
+    """Deterministic google-genai Client replacement."""
+
+    def __init__(self, latency: float = 0.0, responses: Optional[Dict[str, str]] = None):
+        self.latency = latency
+        self.responses = dict(CANNED_RESPONSES)
+        self.responses.update(responses or {})
+        self.calls: Counter = Counter()
+        self._lock = threading.Lock()
+        self.models = _Models(self)
+        self.aio = SimpleNamespace(models=_AsyncModels(self))
+
+    @classmethod
+    def from_env(cls) -> "FakeGenaiClient":
+        responses = None
+        path = os.environ.get("TUTORLY_FAKE_LLM_RESPONSES")
+        if path:
+            with open(path) as f:
+                responses = json.load(f)
+        latency_ms = float(os.environ.get("TUTORLY_FAKE_LLM_LATENCY_MS", "0"))
+        return cls(latency=latency_ms / 1000, responses=responses)
+
+    def _reply(self, config) -> str:
+        prompt_type = classify_prompt(
+            getattr(config, "system_instruction", None),
+            getattr(config, "response_mime_type", None),
+        )
+        with self._lock:
+            self.calls[prompt_type] += 1
+        return self.responses[prompt_type]
+
+
+def _split_path(path: str) -> list:
+    return [part for part in (path or "").split("/") if part]
+
+
+def _prune(value):
+    """RTDB stores no nulls and no empty objects."""
+    if isinstance(value, dict):
+        pruned = {}
+        for key, child in value.items():
+            child = _prune(child)
+            if child is not None:
+                pruned[str(key)] = child
+        return pruned or None
+    if isinstance(value, (list, tuple)):
+        return _prune({str(i): child for i, child in enumerate(value)})
+    return value
+
+
+class FakeReference:
+    def __init__(self, rtdb: "FakeRTDB", parts: list):
+        self._rtdb = rtdb
+        self._parts = parts
+
+    @property
+    def key(self) -> Optional[str]:
+        return self._parts[-1] if self._parts else None
+
+    @property
+    def path(self) -> str:
+        return "/" + "/".join(self._parts)
+
+    def child(self, path: str) -> "FakeReference":
+        return FakeReference(self._rtdb, self._parts + _split_path(path))
+
+    def get(self):
+        with self._rtdb._lock:
+            return copy.deepcopy(self._rtdb._get(self._parts))
+
+    def set(self, value) -> None:
+        with self._rtdb._lock:
+            self._rtdb._set(self._parts, value)
+
+    def delete(self) -> None:
+        self.set(None)
+
+    def push(self, value="") -> "FakeReference":
+        from jlab_ext_example.firebase_logger import generate_push_id
+
+        ref = self.child(generate_push_id())
+        if value is not None:
+            ref.set(value)
+        return ref
+
+    def update(self, value: dict) -> None:
+        """Multi-path update: every key is a path relative to this node."""
+        paths = [_split_path(key) for key in value]
+        for i, a in enumerate(paths):
+            for b in paths[i + 1 :]:
+                shorter = min(len(a), len(b))
+                if a[:shorter] == b[:shorter]:
+                    raise ValueError("update() paths must not overlap")
+        with self._rtdb._lock:
+            for parts, child in zip(paths, value.values()):
+                self._rtdb._set(self._parts + parts, child)
+
+    def transaction(self, transaction_update):
+        with self._rtdb._lock:
+            new_value = transaction_update(copy.deepcopy(self._rtdb._get(self._parts)))
+            self._rtdb._set(self._parts, new_value)
+            return copy.deepcopy(self._rtdb._get(self._parts))
+
+
+class FakeRTDB:
+    """In-memory Realtime Database; reference() mirrors firebase_admin.db."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._root = None
+        self.writes = 0
+
+    def reference(self, path: str = "/") -> FakeReference:
+        return FakeReference(self, _split_path(path))
+
+    def _get(self, parts: list):
+        node = self._root
+        for part in parts:
+            if not isinstance(node, dict) or part not in node:
+                return None
+            node = node[part]
+        return node
+
+    def _set(self, parts: list, value) -> None:
+        self.writes += 1
+        value = _prune(copy.deepcopy(value))
+        if not parts:
+            self._root = value
+            return
+        if not isinstance(self._root, dict):
+            self._root = {}
+        trail = [self._root]
+        for part in parts[:-1]:
+            node = trail[-1]
+            if not isinstance(node.get(part), dict):
+                node[part] = {}
+            trail.append(node[part])
+        if value is None:
+            trail[-1].pop(parts[-1], None)
+        else:
+            trail[-1][parts[-1]] = value
+        # Drop ancestors the write left empty.
+        for depth in range(len(parts) - 1, 0, -1):
+            if trail[depth]:
+                break
+            trail[depth - 1].pop(parts[depth - 1], None)
+        if not self._root:
+            self._root = None
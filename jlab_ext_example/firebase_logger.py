@@ -8,19 +8,74 @@ This module provides comprehensive logging to Firebase Realtime Database for:
 - User interactions and session data
 
 All data is logged with timestamps and user IDs for analytics.
+
+Writes are asynchronous and durable. The log_* functions only append the
+event to a local outbox (see outbox.py); a background replayer groups
+outbox events into one multi-path update() of the database root every
+FIREBASE_BATCH_INTERVAL seconds or FIREBASE_BATCH_EVENTS events, and
+advances the outbox watermark once Firebase has accepted them. If Firebase
+is unreachable, or failed to initialize, the replayer backs off (up to
+FIREBASE_RETRY_MAX_SECONDS) and retries; nothing is lost, including across
+a restart. push() ids are generated client-side, at append time, with the
+same time-ordered scheme as the SDK, so a replayed event rewrites the same
+keys and the records keep their chronological order.
+
+The outbox is capped at FIREBASE_OUTBOX_MAX_EVENTS unsent events; past that,
+only session and BKT events are kept and the rest are dropped and counted.
+flush() drains the outbox; it runs at interpreter exit.
+
+Importing this module only checks the configuration. firebase_admin, which
+is slow to import, is loaded and initialized on first use: by the sender
+thread, or by a call that reads from the database.
 """
 
 import os
 import json
 import time
+import atexit
+import random
+import threading
 from datetime import datetime
 from typing import Dict, Any, Optional, List
-import firebase_admin
-from firebase_admin import credentials, db
+
+from jlab_ext_example import metrics, outbox
 
 # Global Firebase app instance
 _firebase_app = None
+_init_lock = threading.Lock()
+# firebase_admin.db, or fakes.FakeRTDB with TUTORLY_FIREBASE_BACKEND=fake.
+_rtdb = None
 _firebase_enabled = False
+# Credentials are present, even if initialization has not succeeded yet;
+# events are then kept in the outbox until it does.
+_firebase_configured = False
+
+FIREBASE_BATCH_EVENTS = int(os.environ.get("TUTORLY_FIREBASE_BATCH_EVENTS", "100"))
+FIREBASE_BATCH_INTERVAL = int(os.environ.get("TUTORLY_FIREBASE_BATCH_MS", "200")) / 1000
+FIREBASE_OUTBOX_MAX_EVENTS = int(
+    os.environ.get("TUTORLY_FIREBASE_OUTBOX_MAX_EVENTS", "500000")
+)
+FIREBASE_RETRY_MAX_SECONDS = 60.0
+
+
+def _credentials_configured() -> bool:
+    """Check the Firebase environment variables without importing the SDK."""
+    cred_path = os.environ.get("FIREBASE_CREDENTIALS_PATH")
+    database_url = os.environ.get("FIREBASE_DATABASE_URL")
+
+    if not cred_path or not database_url:
+        print(
+            "⚠️  Firebase credentials not configured. Logging to Firebase disabled."
+        )
+        print(
+            "   Set FIREBASE_CREDENTIALS_PATH and FIREBASE_DATABASE_URL environment variables."
+        )
+        return False
+
+    if not os.path.exists(cred_path):
+        print(f"⚠️  Firebase credentials file not found: {cred_path}")
+        return False
+    return True
 
 
 def initialize_firebase():
@@ -34,44 +89,49 @@ def initialize_firebase():
     Returns:
         bool: True if successfully initialized, False otherwise
     """
-    global _firebase_app, _firebase_enabled
+    global _firebase_app, _firebase_enabled, _firebase_configured, _rtdb
 
-    if _firebase_app is not None:
-        return True
+    with _init_lock:
+        if _firebase_app is not None:
+            return True
 
-    try:
-        cred_path = os.environ.get("FIREBASE_CREDENTIALS_PATH")
-        database_url = os.environ.get("FIREBASE_DATABASE_URL")
+        if os.environ.get("TUTORLY_FIREBASE_BACKEND") == "fake":
+            from jlab_ext_example import fakes
 
-        if not cred_path or not database_url:
-            print(
-                "⚠️  Firebase credentials not configured. Logging to Firebase disabled."
-            )
-            print(
-                "   Set FIREBASE_CREDENTIALS_PATH and FIREBASE_DATABASE_URL environment variables."
-            )
+            _rtdb = _firebase_app = fakes.FakeRTDB()
+            _firebase_configured = _firebase_enabled = True
+            print("🧪 TUTORLY_FIREBASE_BACKEND=fake: logging to an in-memory RTDB")
+            return True
+
+        if not _credentials_configured():
             _firebase_enabled = False
             return False
+        _firebase_configured = True
+
+        try:
+            import firebase_admin
+            from firebase_admin import credentials, db
+
+            # Initialize Firebase app
+            cred = credentials.Certificate(os.environ["FIREBASE_CREDENTIALS_PATH"])
+            _firebase_app = firebase_admin.initialize_app(
+                cred, {"databaseURL": os.environ["FIREBASE_DATABASE_URL"]}
+            )
+            _rtdb = db
 
-        if not os.path.exists(cred_path):
-            print(f"⚠️  Firebase credentials file not found: {cred_path}")
+            _firebase_enabled = True
+            print("✅ Firebase initialized successfully")
+            return True
+
+        except Exception as e:
+            print(f"❌ Failed to initialize Firebase: {str(e)}")
             _firebase_enabled = False
             return False
 
-        # Initialize Firebase app
-        cred = credentials.Certificate(cred_path)
-        _firebase_app = firebase_admin.initialize_app(
-            cred, {"databaseURL": database_url}
-        )
-
-        _firebase_enabled = True
-        print("✅ Firebase initialized successfully")
-        return True
 
-    except Exception as e:
-        print(f"❌ Failed to initialize Firebase: {str(e)}")
-        _firebase_enabled = False
-        return False
+def _ensure_firebase() -> bool:
+    """Initialize Firebase on first use. True once it is ready."""
+    return _firebase_enabled or (_firebase_configured and initialize_firebase())
 
 
 def is_firebase_enabled() -> bool:
@@ -99,7 +159,7 @@ def assign_condition_balanced(user_id: str, conditions: list):
     Returns the assigned condition string, or None if Firebase is
     unavailable (caller should fall back to hash-based assignment).
     """
-    if not _firebase_enabled:
+    if not _ensure_firebase():
         return None
 
     import random
@@ -124,7 +184,7 @@ def assign_condition_balanced(user_id: str, conditions: list):
         return data
 
     try:
-        ref = db.reference("condition_assignment")
+        ref = _rtdb.reference("condition_assignment")
         result = ref.transaction(_transaction)
         # transaction() returns the committed snapshot value.
         if isinstance(result, dict):
@@ -148,6 +208,197 @@ def get_timestamp() -> str:
     return datetime.utcnow().isoformat() + "Z"
 
 
+# ---------------------------------------------------------------------------
+# Outbox replayer
+# ---------------------------------------------------------------------------
+
+_PUSH_CHARS = "-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz"
+_push_id_lock = threading.Lock()
+_last_push_time = 0
+_last_rand_chars: List[int] = []
+
+
+def generate_push_id() -> str:
+    """A push() key: 8 timestamp characters then 12 random ones.
+
+    Keys sort chronologically; within one millisecond the random part is
+    incremented instead of redrawn, so they still sort in creation order.
+    """
+    global _last_push_time, _last_rand_chars
+    with _push_id_lock:
+        now = int(time.time() * 1000)
+        if now == _last_push_time:
+            for i in range(11, -1, -1):
+                if _last_rand_chars[i] != 63:
+                    _last_rand_chars[i] += 1
+                    break
+                _last_rand_chars[i] = 0
+        else:
+            _last_rand_chars = [random.randrange(64) for _ in range(12)]
+        _last_push_time = now
+        time_chars = []
+        for _ in range(8):
+            time_chars.append(_PUSH_CHARS[now % 64])
+            now //= 64
+        return "".join(reversed(time_chars)) + "".join(
+            _PUSH_CHARS[c] for c in _last_rand_chars
+        )
+
+
+_outbox = None
+_outbox_lock = threading.Lock()
+_drain_lock = threading.Lock()
+_sender_thread = None
+_wake = threading.Event()
+_stats_lock = threading.Lock()
+_stats = {"enqueued": 0, "sent": 0, "batches": 0, "dropped": 0, "failed": 0}
+
+
+def _count(name: str, n: int = 1) -> None:
+    with _stats_lock:
+        _stats[name] += n
+
+
+def get_outbox() -> "outbox.Outbox":
+    global _outbox
+    if _outbox is None:
+        with _outbox_lock:
+            if _outbox is None:
+                _outbox = outbox.Outbox()
+    return _outbox
+
+
+def _start_sender() -> None:
+    global _sender_thread
+    if _sender_thread is None:
+        with _outbox_lock:
+            if _sender_thread is None:
+                _sender_thread = threading.Thread(
+                    target=_sender_loop, name="tutorly-firebase-sender", daemon=True
+                )
+                _sender_thread.start()
+
+
+def _enqueue(writes: Dict[str, Any], critical: bool = False) -> None:
+    """Append one event, {path: value} writes sent together, to the outbox."""
+    started = time.perf_counter()
+    box = get_outbox()
+    if not critical and box.pending() >= FIREBASE_OUTBOX_MAX_EVENTS:
+        _count("dropped")
+        with _stats_lock:
+            dropped = _stats["dropped"]
+        if dropped == 1 or dropped % 1000 == 0:
+            print(f"⚠️  Firebase outbox full; {dropped} events dropped so far")
+        return
+    box.append(writes)
+    _count("enqueued")
+    _start_sender()
+    if box.pending() >= FIREBASE_BATCH_EVENTS:
+        _wake.set()
+    metrics.observe("tutorly_firebase_enqueue_seconds", time.perf_counter() - started)
+
+
+def _push(path: str, value: Dict[str, Any], critical: bool = False) -> None:
+    """Asynchronous equivalent of db.reference(path).push(value)."""
+    _enqueue({f"{path}/{generate_push_id()}": value}, critical)
+
+
+def _overlaps(path: str, batch: Dict[str, Any]) -> bool:
+    # A multi-path update may not write a path and one of its ancestors.
+    for other in batch:
+        if other != path and (
+            other.startswith(path + "/") or path.startswith(other + "/")
+        ):
+            return True
+    return False
+
+
+def _rtdb_update(writes: Dict[str, Any]) -> None:
+    _rtdb.reference("/").update(writes)
+
+
+def drain(send=None) -> int:
+    """Send outbox events until it is empty. Returns the number sent.
+
+    `send(writes)` defaults to a multi-path update of the database root.
+    Raises whatever `send` raises; the failed batch stays in the outbox.
+    """
+    send = send or _rtdb_update
+    box = get_outbox()
+    total = 0
+    with _drain_lock:
+        while True:
+            rows = box.next_batch(FIREBASE_BATCH_EVENTS)
+            if not rows:
+                return total
+            batch: Dict[str, Any] = {}
+            last_id = None
+            events = 0
+            for row_id, writes in rows:
+                if any(_overlaps(path, batch) for path in writes):
+                    break
+                batch.update(writes)
+                last_id = row_id
+                events += 1
+            try:
+                with metrics.timer("tutorly_firebase_send_seconds"):
+                    send(batch)
+            except Exception:
+                _count("failed", events)
+                raise
+            box.ack(last_id)
+            _count("sent", events)
+            _count("batches")
+            total += events
+
+
+def _sender_loop() -> None:
+    backoff = FIREBASE_BATCH_INTERVAL
+    while True:
+        _wake.wait(backoff)
+        _wake.clear()
+        if not _ensure_firebase():
+            backoff = min(backoff * 2, FIREBASE_RETRY_MAX_SECONDS)
+            continue
+        try:
+            drain()
+            backoff = FIREBASE_BATCH_INTERVAL
+        except Exception as e:
+            backoff = min(max(backoff, 0.5) * 2, FIREBASE_RETRY_MAX_SECONDS)
+            print(
+                f"❌ Firebase write failed, retrying in {backoff:.1f}s "
+                f"({get_outbox().pending()} events kept): {str(e)}"
+            )
+
+
+def flush(timeout: Optional[float] = None) -> bool:
+    """Try to send everything in the outbox. Returns True once it is empty."""
+    if not _firebase_configured:
+        return True
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        if _ensure_firebase():
+            try:
+                drain()
+            except Exception as e:
+                print(f"❌ Firebase flush failed: {str(e)}")
+        if get_outbox().pending() == 0:
+            return True
+        if deadline is not None and time.monotonic() >= deadline:
+            return False
+        time.sleep(0.5)
+
+
+def pipeline_stats() -> Dict[str, int]:
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["queued"] = get_outbox().pending() if _outbox is not None else 0
+    return stats
+
+
+atexit.register(flush, 5.0)
+
+
 def log_chat_message(
     user_id: str,
     session_id: str,
@@ -169,12 +420,10 @@ def log_chat_message(
         segment_index: Current segment index (optional)
         metadata: Additional metadata (optional)
     """
-    if not _firebase_enabled:
+    if not _firebase_configured:
         return
 
     try:
-        ref = db.reference(f"chat_logs/{user_id}/{session_id}")
-
         message_data = {
             "timestamp": get_timestamp(),
             "type": message_type,
@@ -184,7 +433,7 @@ def log_chat_message(
             "metadata": metadata or {},
         }
 
-        ref.push(message_data)
+        _push(f"chat_logs/{user_id}/{session_id}", message_data)
 
     except Exception as e:
         print(f"❌ Failed to log chat message: {str(e)}")
@@ -217,12 +466,10 @@ def log_code_execution(
         video_id: YouTube video ID (optional)
         segment_index: Current segment index (optional)
     """
-    if not _firebase_enabled:
+    if not _firebase_configured:
         return
 
     try:
-        ref = db.reference(f"code_executions/{user_id}/{session_id}")
-
         execution_data = {
             "timestamp": get_timestamp(),
             "code": code,
@@ -235,7 +482,7 @@ def log_code_execution(
             "segment_index": segment_index,
         }
 
-        ref.push(execution_data)
+        _push(f"code_executions/{user_id}/{session_id}", execution_data)
 
     except Exception as e:
         print(f"❌ Failed to log code execution: {str(e)}")
@@ -279,13 +526,10 @@ def log_bkt_update(
             produce is_correct).
         slip, guess, transit: the BKT noise parameters used for this update.
     """
-    if not _firebase_enabled:
+    if not _firebase_configured:
         return
 
     try:
-        # Log to BKT updates timeline
-        ref = db.reference(f"bkt_updates/{user_id}/{session_id}")
-
         update_data = {
             "timestamp": get_timestamp(),
             "skill": skill,
@@ -311,8 +555,6 @@ def log_bkt_update(
         if transit is not None:
             update_data["transit"] = transit
 
-        ref.push(update_data)
-
         # Also update the current BKT state. Include n_observations and the
         # most recent rubric so a single read of `bkt_state/{uid}/{skill}`
         # gives an analyst the full live picture.
@@ -327,8 +569,14 @@ def log_bkt_update(
         if rubric is not None:
             state_payload["last_rubric"] = rubric
             state_payload["last_rubric_mean"] = rubric_mean
-        state_ref = db.reference(f"bkt_state/{user_id}")
-        state_ref.child(skill).set(state_payload)
+        # Timeline entry and snapshot travel as one event (one update()).
+        _enqueue(
+            {
+                f"bkt_updates/{user_id}/{session_id}/{generate_push_id()}": update_data,
+                f"bkt_state/{user_id}/{skill}": state_payload,
+            },
+            critical=True,
+        )
 
     except Exception as e:
         print(f"❌ Failed to log BKT update: {str(e)}")
@@ -353,12 +601,10 @@ def log_interaction(
         video_id: YouTube video ID (optional)
         segment_index: Current segment index (optional)
     """
-    if not _firebase_enabled:
+    if not _firebase_configured:
         return
 
     try:
-        ref = db.reference(f"interactions/{user_id}/{session_id}")
-
         event_data = {
             "timestamp": get_timestamp(),
             "type": interaction_type,
@@ -367,7 +613,7 @@ def log_interaction(
             "segment_index": segment_index,
         }
 
-        ref.push(event_data)
+        _push(f"interactions/{user_id}/{session_id}", event_data)
 
     except Exception as e:
         print(f"❌ Failed to log interaction: {str(e)}")
@@ -384,19 +630,17 @@ def log_session_start(
         session_id: Unique identifier for the session
         user_metadata: Additional user metadata (optional)
     """
-    if not _firebase_enabled:
+    if not _firebase_configured:
         return
 
     try:
-        ref = db.reference(f"sessions/{user_id}/{session_id}")
-
         session_data = {
             "start_time": get_timestamp(),
             "status": "active",
             "user_metadata": user_metadata or {},
         }
 
-        ref.set(session_data)
+        _enqueue({f"sessions/{user_id}/{session_id}": session_data}, critical=True)
 
     except Exception as e:
         print(f"❌ Failed to log session start: {str(e)}")
@@ -413,18 +657,18 @@ def log_session_end(
         session_id: Unique identifier for the session
         session_summary: Summary statistics for the session (optional)
     """
-    if not _firebase_enabled:
+    if not _firebase_configured:
         return
 
     try:
-        ref = db.reference(f"sessions/{user_id}/{session_id}")
-
-        ref.update(
+        path = f"sessions/{user_id}/{session_id}"
+        _enqueue(
             {
-                "end_time": get_timestamp(),
-                "status": "completed",
-                "summary": session_summary or {},
-            }
+                f"{path}/end_time": get_timestamp(),
+                f"{path}/status": "completed",
+                f"{path}/summary": session_summary or {},
+            },
+            critical=True,
         )
 
     except Exception as e:
@@ -441,11 +685,11 @@ def get_user_bkt_state(user_id: str) -> Optional[Dict[str, Any]]:
     Returns:
         Dictionary of skills and their mastery levels, or None if not found
     """
-    if not _firebase_enabled:
+    if not _ensure_firebase():
         return None
 
     try:
-        ref = db.reference(f"bkt_state/{user_id}")
+        ref = _rtdb.reference(f"bkt_state/{user_id}")
         return ref.get()
 
     except Exception as e:
@@ -472,12 +716,10 @@ def log_teaching_method(
         segment_index: Current segment index (optional)
         context: Additional context about why this method was chosen (optional)
     """
-    if not _firebase_enabled:
+    if not _firebase_configured:
         return
 
     try:
-        ref = db.reference(f"teaching_methods/{user_id}/{session_id}")
-
         method_data = {
             "timestamp": get_timestamp(),
             "method": method,
@@ -486,11 +728,17 @@ def log_teaching_method(
             "context": context or {},
         }
 
-        ref.push(method_data)
+        _push(f"teaching_methods/{user_id}/{session_id}", method_data)
 
     except Exception as e:
         print(f"❌ Failed to log teaching method: {str(e)}")
 
 
-# Initialize Firebase when module is imported
-initialize_firebase()
+# Only the fake initializes at import; the real SDK waits for first use.
+if os.environ.get("TUTORLY_FIREBASE_BACKEND") == "fake":
+    initialize_firebase()
+else:
+    _firebase_configured = _credentials_configured()
+if _firebase_configured and get_outbox().pending():
+    # Events a previous server left unsent.
+    _start_sender()
@@ -1,29 +1,44 @@
 # handler.py
 import os
 import re
+import sys
 import ast
+import time
 import json
 import math
+import atexit
 import random
-import isodate
+import sqlite3
+import asyncio
 import hashlib
 import datetime
+import functools
+import threading
 import requests
-from google import genai
-from google.genai import types as genai_types
-import sqlite3
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from io import StringIO
-from jupyter_server.base.handlers import APIHandler
+from jupyter_server.base.handlers import APIHandler, JupyterHandler
 from jupyter_server.utils import url_path_join
 import tornado
-from googleapiclient.discovery import build
-from youtube_transcript_api import YouTubeTranscriptApi
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from langchain.memory import ConversationBufferMemory
+# google.genai, pandas, sklearn, isodate and youtube_transcript_api are
+# imported where they are used: together they took seconds to import, and
+# this module loads on every JupyterLab spawn
+# (tests/test_import_time.py keeps them out).
 # from BCEmbedding import RerankerModel
 from jlab_ext_example import firebase_logger
+from jlab_ext_example import (
+    chat_memory,
+    code_index,
+    content_bundle,
+    db,
+    llm_cache,
+    metrics,
+    prefetch,
+    session_store,
+    singleflight,
+    tracing,
+    write_behind,
+)
 
 # init reranker model
 # model = RerankerModel(model_name_or_path="maidalun1020/bce-reranker-base_v1")
@@ -49,13 +64,44 @@ YOUTUBE_API_KEY = os.environ.get("YOUTUBE_API_KEY")
 
 
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY") or os.environ.get("OPENAI_API_KEY")
-# google-genai's Client picks up GEMINI_API_KEY (or GOOGLE_API_KEY) from the
-# environment automatically, but we pass it explicitly so the missing-key
-# error path is in our hands.
-_gemini_client = genai.Client(api_key=GEMINI_API_KEY) if GEMINI_API_KEY else None
-if not GEMINI_API_KEY:
+
+
+def _make_gemini_client():
+    # TUTORLY_LLM_BACKEND=fake swaps in canned, offline replies (fakes.py)
+    # for load tests and benchmarks.
+    if os.environ.get("TUTORLY_LLM_BACKEND") == "fake":
+        from jlab_ext_example import fakes
+
+        print("🧪 TUTORLY_LLM_BACKEND=fake: LLM replies are canned")
+        return fakes.FakeGenaiClient.from_env()
+    # google-genai's Client picks up GEMINI_API_KEY (or GOOGLE_API_KEY) from
+    # the environment automatically, but we pass it explicitly so the
+    # missing-key error path is in our hands.
+    if not GEMINI_API_KEY:
+        return None
+    from google import genai
+
+    return genai.Client(api_key=GEMINI_API_KEY)
+
+
+if not GEMINI_API_KEY and os.environ.get("TUTORLY_LLM_BACKEND") != "fake":
     print("⚠️  GEMINI_API_KEY is not set. LLM features will not work.")
 
+# Built by the first LLM call (_get_gemini_client), not at import.
+_gemini_client = None
+_gemini_client_made = False
+_gemini_client_lock = threading.Lock()
+
+
+def _get_gemini_client():
+    global _gemini_client, _gemini_client_made
+    if _gemini_client is None and not _gemini_client_made:
+        with _gemini_client_lock:
+            if not _gemini_client_made:
+                _gemini_client = _make_gemini_client()
+                _gemini_client_made = True
+    return _gemini_client
+
 # All LLM call sites flow through llm_chat() so we have one place to swap
 # models, tweak defaults, or add retries.
 DEFAULT_GEMINI_MODEL = "gemini-3.5-flash"
@@ -84,43 +130,194 @@ def _parse_llm_list(raw: str):
         return json.loads(list_str)
 
 
+def _llm_config(system_prompt, temperature, response_mime_type):
+    from google.genai import types as genai_types
+
+    if _get_gemini_client() is None:
+        raise RuntimeError(
+            "GEMINI_API_KEY is not set; cannot call the LLM. "
+            "Get a key at https://aistudio.google.com/apikey."
+        )
+    config_kwargs = {
+        "system_instruction": system_prompt,
+        "temperature": temperature,
+    }
+    if response_mime_type:
+        config_kwargs["response_mime_type"] = response_mime_type
+    return genai_types.GenerateContentConfig(**config_kwargs)
+
+
+def _clean_llm_text(text) -> str:
+    text = (text or "").strip()
+    # Strip stray ```json fences if the model added them anyway.
+    if text.startswith("```"):
+        text = re.sub(r"^```(?:json)?\s*", "", text)
+        text = re.sub(r"\s*```$", "", text)
+    return text
+
+
+def _record_llm_call(site: str, started: float, resp) -> None:
+    """Latency and token usage of one Gemini call, labelled by call site."""
+    metrics.observe("tutorly_llm_seconds", time.perf_counter() - started, site=site)
+    tracing.record("llm", started, site=site)
+    usage = getattr(resp, "usage_metadata", None)
+    if usage is None:
+        return
+    metrics.inc(
+        "tutorly_llm_tokens_total", usage.prompt_token_count or 0, site=site, kind="prompt"
+    )
+    metrics.inc(
+        "tutorly_llm_tokens_total",
+        usage.candidates_token_count or 0,
+        site=site,
+        kind="output",
+    )
+
+
 def llm_chat(
     system_prompt: str,
     user_message: str,
     model: str = DEFAULT_GEMINI_MODEL,
     temperature: float = 0.7,
     response_mime_type: str = None,
+    cache_site: str = None,
+    cache_refresh: bool = False,
+    site: str = None,
 ) -> str:
     """Single-turn Gemini call. Returns the model's text output, stripped.
 
     `response_mime_type="application/json"` asks Gemini to emit valid JSON;
     pass it for the call sites whose downstream code does `json.loads` so
     we don't get fenced ```json ... ``` blocks.
+
+    `cache_site` names a user-independent call site (see
+    llm_cache.CALL_SITE_TTLS); when the response cache is enabled, identical
+    requests from that site are answered from disk. `cache_refresh=True`
+    skips the lookup but stores the new reply, for callers retrying after a
+    cached reply turned out to be unusable.
+
+    Latency and tokens are recorded per call site: `site` when given, else
+    `cache_site`, else the name of the calling function. Callers that are
+    not cached (the chat bot) pass `site` so that one function serving many
+    kinds of request is not a single series.
     """
-    if _gemini_client is None:
-        raise RuntimeError(
-            "GEMINI_API_KEY is not set; cannot call the LLM. "
-            "Get a key at https://aistudio.google.com/apikey."
+    site = site or cache_site or sys._getframe(1).f_code.co_name
+    cache = llm_cache.get_cache() if cache_site else None
+    if cache is not None:
+        cache_key = llm_cache.make_key(
+            model, system_prompt, user_message, temperature, response_mime_type
         )
-    config_kwargs = {
-        "system_instruction": system_prompt,
-        "temperature": temperature,
-    }
-    if response_mime_type:
-        config_kwargs["response_mime_type"] = response_mime_type
-    resp = _gemini_client.models.generate_content(
+        if not cache_refresh:
+            cached = cache.get(cache_key, cache_site)
+            if cached is not None:
+                return cached
+    config = _llm_config(system_prompt, temperature, response_mime_type)
+    started = time.perf_counter()
+    resp = _get_gemini_client().models.generate_content(
         model=model,
         contents=user_message,
-        config=genai_types.GenerateContentConfig(**config_kwargs),
+        config=config,
     )
-    text = (resp.text or "").strip()
-    # Strip stray ```json fences if the model added them anyway.
-    if text.startswith("```"):
-        text = re.sub(r"^```(?:json)?\s*", "", text)
-        text = re.sub(r"\s*```$", "", text)
+    _record_llm_call(site, started, resp)
+    text = _clean_llm_text(resp.text)
+    if cache is not None:
+        cache.put(cache_key, cache_site, text)
     return text
 
 
+async def llm_chat_async(
+    system_prompt: str,
+    user_message: str,
+    model: str = DEFAULT_GEMINI_MODEL,
+    temperature: float = 0.7,
+    response_mime_type: str = None,
+    site: str = "chat-bot",
+) -> str:
+    """Native-async twin of llm_chat() for coroutine handlers.
+
+    Goes through the SDK's aio client, so a slow generation only suspends
+    the calling handler instead of holding an executor thread. `site`
+    labels the call's metrics, like llm_chat()'s.
+    """
+    config = _llm_config(system_prompt, temperature, response_mime_type)
+    started = time.perf_counter()
+    resp = await _get_gemini_client().aio.models.generate_content(
+        model=model,
+        contents=user_message,
+        config=config,
+    )
+    _record_llm_call(site, started, resp)
+    return _clean_llm_text(resp.text)
+
+
+async def llm_chat_stream(
+    system_prompt: str,
+    user_message: str,
+    model: str = DEFAULT_GEMINI_MODEL,
+    temperature: float = 0.7,
+    site: str = "chat-bot",
+):
+    """Async generator over the text deltas of one Gemini reply.
+
+    The deltas are raw; callers that need the final string should join them
+    and pass the result through _clean_llm_text like llm_chat() does.
+    """
+    config = _llm_config(system_prompt, temperature, None)
+    started = time.perf_counter()
+    stream = await _get_gemini_client().aio.models.generate_content_stream(
+        model=model,
+        contents=user_message,
+        config=config,
+    )
+    chunk = None
+    async for chunk in stream:
+        if chunk.text:
+            yield chunk.text
+    # Usage metadata arrives with the final chunk.
+    _record_llm_call(site, started, chunk)
+
+
+# Handlers are coroutines; anything that blocks (sqlite3, requests, the
+# firebase_admin SDK, the synchronous LLM chains behind get_knowledge /
+# get_segments) is pushed onto one of two bounded pools so it never runs on
+# the Tornado IOLoop. LLM chains get their own pool: they hold a thread for
+# seconds, and must not starve the millisecond-scale DB/logging work that
+# every other participant's request needs.
+_IO_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("TUTORLY_IO_WORKERS", "8")),
+    thread_name_prefix="tutorly-io",
+)
+_LLM_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("TUTORLY_LLM_WORKERS", "16")),
+    thread_name_prefix="tutorly-llm",
+)
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run short blocking work (DB, HTTP, Firebase) off the IOLoop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_IO_EXECUTOR, tracing.bind(fn, *args, **kwargs))
+
+
+async def run_llm(fn, *args, **kwargs):
+    """Run a blocking LLM chain (one or more llm_chat calls) off the IOLoop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_LLM_EXECUTOR, tracing.bind(fn, *args, **kwargs))
+
+
+# Turns for the SAME participant are serialized: a turn reads and rewrites
+# that user's session buffers (cur_seq, skill_id_buffer, ...), which the old
+# synchronous handlers got for free. Different participants run concurrently.
+_USER_LOCKS: dict = {}
+
+
+def _user_lock(uid: str) -> asyncio.Lock:
+    lock = _USER_LOCKS.get(uid)
+    if lock is None:
+        lock = _USER_LOCKS[uid] = asyncio.Lock()
+    return lock
+
+
 def _repair_json(text):
     """Best-effort parse of an LLM JSON reply. Returns a dict/list or None.
 
@@ -184,19 +381,31 @@ def _repair_json(text):
     return None
 
 
-def llm_json(system_prompt, user_message, required_keys=(), model=None, retries=1):
+def llm_json(
+    system_prompt,
+    user_message,
+    required_keys=(),
+    model=None,
+    retries=1,
+    cache_site=None,
+):
     """Call the LLM and return parsed JSON, repairing/retrying as needed.
 
     Returns a dict (possibly missing keys) or None if nothing usable came
     back. Callers render a card from the result, so returning valid JSON
     matters more than returning the first response verbatim.
     """
-    kwargs = {"response_mime_type": "application/json"}
+    kwargs = {"response_mime_type": "application/json", "cache_site": cache_site}
     if model:
         kwargs["model"] = model
     for attempt in range(retries + 1):
+        # A retry means the previous (possibly cached) reply was unusable, so
+        # bypass the cache lookup and overwrite the entry with the new reply.
         raw = llm_chat(
-            system_prompt=system_prompt, user_message=user_message, **kwargs
+            system_prompt=system_prompt,
+            user_message=user_message,
+            cache_refresh=attempt > 0,
+            **kwargs,
         )
         parsed = _repair_json(raw)
         if isinstance(parsed, dict) and (
@@ -254,9 +463,6 @@ def _normalize_mc(parsed):
 YOUTUBE_API_KEY = os.environ.get("YOUTUBE_API_KEY") or YOUTUBE_API_KEY
 if not YOUTUBE_API_KEY:
     print("⚠️  YOUTUBE_API_KEY is not set. YouTube API features may not work.")
-youtube = (
-    build("youtube", "v3", developerKey=YOUTUBE_API_KEY) if YOUTUBE_API_KEY else None
-)
 DATA_URL = "https://api.github.com/repos/rfordatascience/tidytuesday/contents/data/"
 CODE_URL = "https://api.github.com/repos/dgrtwo/data-screencasts/contents/"
 STUDY_VIDEO_IDS = ["EF4A4OtQprg", "1xsbTs9-a50", "-1x8Kpyndss"]
@@ -295,19 +501,35 @@ _CODE_FILE_BY_VIDEO = {
     "8jazNUpO3lQ": "ml_code.json",
 }
 _all_code_cache: dict = {}
+# video_id -> {segment_index (str): CodeSegmentIndex}, built with the code.
+_code_index_cache: dict = {}
 
 
 def get_all_code(video_id: str) -> dict:
     """Return the code-blocks dict for a specific video (cached per video)."""
     if video_id not in _all_code_cache:
         fname = _CODE_FILE_BY_VIDEO.get(video_id)
+        code = {}
         if fname:
             with open(_package_data_path(fname), "r") as f:
-                _all_code_cache[video_id] = json.load(f)
-        else:
-            _all_code_cache[video_id] = {}
+                code = json.load(f)
+        _code_index_cache[video_id] = {
+            segment: code_index.CodeSegmentIndex(block)
+            for segment, block in code.items()
+        }
+        _all_code_cache[video_id] = code
     return _all_code_cache[video_id]
 
+
+def get_code_index(video_id, segment_index, code_json):
+    """The CodeSegmentIndex of `code_json`'s block for this segment."""
+    block = code_json[str(segment_index)]
+    index = _code_index_cache.get(video_id, {}).get(str(segment_index))
+    if index is None or index.source != block:
+        # Not a block get_all_code() loaded (e.g. a caller's own code_json).
+        index = code_index.CodeSegmentIndex(block)
+    return index
+
 # T1.5: per-user session state. Each entry holds the state that used to be
 # scattered across module globals. Keyed by the user_id sent in each request
 # so that two browser tabs / two concurrent requests for the same user can't
@@ -325,34 +547,109 @@ def get_all_code(video_id: str) -> dict:
 #   code_line_blanks_buffer: the same line with ___ placeholders, used to
 #                            align per-blank correctness at update time
 #   correct_answer_buffer: canonical correct choice for multiple-choice
-USER_SESSIONS: dict = {}
+#
+# Sessions live in a bounded SessionStore: idle and least recently used
+# sessions are spilled to cache.db and loaded back on the user's next
+# request (see session_store.py).
+SESSION_MAX = int(os.environ.get("TUTORLY_SESSION_MAX", "200"))
+SESSION_MAX_MB = float(os.environ.get("TUTORLY_SESSION_MAX_MB", "256"))
+SESSION_IDLE_MINUTES = float(os.environ.get("TUTORLY_SESSION_IDLE_MINUTES", "60"))
+
+
+def _new_session() -> dict:
+    return {
+        "bkt_params": {},
+        "cur_seq": [],
+        "skill_id_buffer": "",
+        "interaction_buffer": "",
+        "code_line_buffer": "",
+        "code_line_blanks_buffer": "",
+        "correct_answer_buffer": "",
+        # The LLM chat wrapper, which carries this user's conversation
+        # memory. Per-user rather than a module global: under TLJH each
+        # participant already gets their own process, but a shared global
+        # would silently cross-contaminate conversations the moment two
+        # participants were ever served by one process (as happens when
+        # testing two accounts against a single local server).
+        "chat_bot": None,
+        # Lines already taught in the current segment, so two knowledge
+        # items don't drill the student on the same line twice. Reset
+        # whenever taught_lines_key changes (see _segment_taught_lines).
+        "taught_lines_key": None,
+        "taught_lines": set(),
+    }
+
+
+def _create_session(uid: str) -> dict:
+    # A user with no live or spilled session may still have a teaching
+    # sequence checkpointed before a restart (see checkpoint_teaching_state).
+    session = _new_session()
+    try:
+        state = load_teaching_state(uid)
+    except (sqlite3.Error, ValueError) as e:
+        print(f"⚠️  Could not restore teaching state for {uid}: {str(e)}")
+        return session
+    if state:
+        session.update({f: state[f] for f in TEACHING_STATE_FIELDS if f in state})
+        if state.get("taught_lines_key") is not None:
+            session["taught_lines_key"] = tuple(state["taught_lines_key"])
+        session["taught_lines"] = set(state.get("taught_lines", []))
+    return session
+
+
+def _dump_session(session: dict) -> dict:
+    record = dict(session)
+    record["taught_lines"] = sorted(session["taught_lines"])
+    chat_bot = session["chat_bot"]
+    record["chat_bot"] = chat_bot.to_dict() if chat_bot is not None else None
+    return record
+
+
+def _load_session(record: dict) -> dict:
+    session = _new_session()
+    session.update(record)
+    # bkt_params is only in the record so the session's size counts it;
+    # the handlers reload it from bkt_skill_state plus the write-behind
+    # buffer (init_bkt_params), which are authoritative.
+    session["bkt_params"] = {}
+    if record.get("taught_lines_key") is not None:
+        session["taught_lines_key"] = tuple(record["taught_lines_key"])
+    session["taught_lines"] = set(record.get("taught_lines", []))
+    if record.get("chat_bot"):
+        session["chat_bot"] = CustomChatBotWithMemory.from_dict(record["chat_bot"])
+    return session
+
+
+def _session_busy(uid: str) -> bool:
+    # A turn holds the user's lock, and a reference to the session dict. A
+    # turn woken by release() has not taken the lock yet, but is waiting.
+    lock = _USER_LOCKS.get(uid)
+    return lock is not None and (lock.locked() or bool(lock._waiters))
+
+
+def _session_evicted(uid: str) -> None:
+    MOVE_PREFETCHER.reset(uid)
+    # Only idle sessions are spilled, so nobody holds or waits on the lock;
+    # the next turn creates a new one.
+    if not _session_busy(uid):
+        _USER_LOCKS.pop(uid, None)
+
+
+USER_SESSIONS = session_store.SessionStore(
+    create=_create_session,
+    dump=_dump_session,
+    load=_load_session,
+    max_sessions=SESSION_MAX,
+    max_bytes=int(SESSION_MAX_MB * 1024 * 1024),
+    idle_seconds=SESSION_IDLE_MINUTES * 60,
+    is_busy=_session_busy,
+    on_evict=_session_evicted,
+)
 
 
 def get_user_session(uid: str) -> dict:
-    """Return (creating if needed) the per-user state dict."""
-    if uid not in USER_SESSIONS:
-        USER_SESSIONS[uid] = {
-            "bkt_params": {},
-            "cur_seq": [],
-            "skill_id_buffer": "",
-            "interaction_buffer": "",
-            "code_line_buffer": "",
-            "code_line_blanks_buffer": "",
-            "correct_answer_buffer": "",
-            # The LLM chat wrapper, which carries this user's conversation
-            # memory. Per-user rather than a module global: under TLJH each
-            # participant already gets their own process, but a shared global
-            # would silently cross-contaminate conversations the moment two
-            # participants were ever served by one process (as happens when
-            # testing two accounts against a single local server).
-            "chat_bot": None,
-            # Lines already taught in the current segment, so two knowledge
-            # items don't drill the student on the same line twice. Reset
-            # whenever taught_lines_key changes (see _segment_taught_lines).
-            "taught_lines_key": None,
-            "taught_lines": set(),
-        }
-    return USER_SESSIONS[uid]
+    """Return the per-user state dict, loading or creating it if needed."""
+    return USER_SESSIONS.get(uid)
 
 
 def _segment_taught_lines(session, video_id, segment_index):
@@ -364,6 +661,139 @@ def _segment_taught_lines(session, video_id, segment_index):
     return session["taught_lines"]
 
 
+def base_move_input(move_detail, selected_choice="", articulation_answer=""):
+    """Chat-bot input shared by every teaching move.
+
+    Returns (input_data, pedagogy); pedagogy has {student-answer}
+    substituted with the student's articulation text (preferred) or choice.
+    """
+    parameters = move_detail.get("parameters", {})
+    input_data = {}
+    if "knowledge" in parameters:
+        input_data["knowledge"] = move_detail["knowledge"]
+    pedagogy = move_detail["prompt"]
+    if "student-answer" in parameters:
+        student_answer_value = (
+            articulation_answer or selected_choice or "(no answer provided)"
+        )
+        pedagogy = pedagogy.replace("{student-answer}", student_answer_value)
+    input_data["pedagogy"] = "Use the following structure to respond: " + pedagogy
+    if selected_choice != "":
+        # If the student selects a choice, the response is the choice
+        input_data["student's choice"] = selected_choice
+    if "student-answer" in parameters:
+        input_data["student's answer"] = student_answer_value
+    return input_data, pedagogy
+
+
+def add_move_input(
+    input_data, move_detail, video_id, segment_index, all_code, used_lines
+):
+    """Add the fields of the PREFETCH_INTERACTIONS moves to input_data.
+
+    Returns (code_line, code_line_with_blanks), "" where unused, and marks
+    the chosen lines in `used_lines`. May call the LLM (blanked code), so run
+    it off the IOLoop.
+    """
+    interaction = move_detail["interaction"]
+    code_line = code_line_with_blanks = ""
+    if interaction == "multiple-choice":
+        input_data["pedagogy"] = (
+            input_data["pedagogy"] + _MC_DESIGN_GUIDANCE + _MC_SCHEMA_INSTRUCTION
+        )
+    elif interaction == "annotated-code":
+        # Scaffolding only needs the plain line to explain — no
+        # blanked version, so use the lighter line-only helper.
+        code_line = get_code_line_by_step(
+            video_id, segment_index, all_code, move_detail["knowledge"], used_lines
+        )
+        input_data["code-line"] = code_line
+        input_data["requirement"] = (
+            "Don't include the 'code-line' in the response; explain it in one sentence."
+        )
+    elif interaction == "fill-in-blanks":
+        code_line, code_line_with_blanks = get_code_with_blank_by_step(
+            video_id, segment_index, all_code, move_detail["knowledge"], used_lines
+        )
+        input_data["code-line-with-blanks"] = code_line_with_blanks
+        input_data["requirement"] = (
+            "Don't include the 'code-line-with-blanks' in the response"
+        )
+    return code_line, code_line_with_blanks
+
+
+# Moves whose chat-bot reply can be generated before the student clicks
+# "Next message": their input depends only on the move and the code, never
+# on an answer the student hasn't given yet (compare-with-expert, every
+# {student-answer} move and the move after a multiple-choice question, whose
+# input carries the student's choice, are excluded). Generated two moves
+# ahead at most.
+PREFETCH_INTERACTIONS = ("multiple-choice", "annotated-code", "fill-in-blanks")
+PREFETCH_DEPTH = int(os.environ.get("TUTORLY_PREFETCH_DEPTH", "2"))
+_PREFETCH_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("TUTORLY_PREFETCH_WORKERS", "4")),
+    thread_name_prefix="tutorly-prefetch",
+)
+MOVE_PREFETCHER = prefetch.MovePrefetcher(
+    _PREFETCH_EXECUTOR,
+    max_pending=int(os.environ.get("TUTORLY_PREFETCH_MAX_PENDING", "32")),
+    per_user=2 * PREFETCH_DEPTH,
+)
+
+
+def schedule_move_prefetch(
+    uid, session, video_id, segment_index, previous_interaction=None
+):
+    """Start generating the next PREFETCH_DEPTH moves of `uid`'s sequence.
+
+    `previous_interaction` is the move the student is looking at now. The
+    prefetched reply is generated against the conversation history as it
+    stands now, i.e. without the one or two exchanges the student has
+    before reaching that move; the move's own input is identical. Planning
+    stops at a move that follows a multiple-choice question: the student's
+    choice goes into its input, and its reply has to react to it.
+    """
+    chat_bot = session.get("chat_bot")
+    if PREFETCH_DEPTH <= 0 or chat_bot is None or not session["cur_seq"]:
+        return
+    # Snapshot on the IOLoop: the plan runs in another thread while the
+    # handlers keep consuming the session.
+    upcoming = [dict(m) for m in session["cur_seq"][:PREFETCH_DEPTH]]
+    used_lines = set(_segment_taught_lines(session, video_id, segment_index))
+    all_code = get_all_code(video_id)
+
+    def plan():
+        previous = previous_interaction
+        for move in upcoming:
+            parameters = move.get("parameters", {})
+            if (
+                "student-answer" in parameters
+                or move["interaction"] == "compare-with-expert"
+                or previous == "multiple-choice"
+            ):
+                return
+            previous = move["interaction"]
+            if move["interaction"] not in PREFETCH_INTERACTIONS:
+                if "code-line" in parameters:
+                    # Picks code lines we can't replay here; later moves'
+                    # lines (and so their inputs) would not match.
+                    return
+                continue
+            input_data, _ = base_move_input(move)
+            add_move_input(
+                input_data, move, video_id, segment_index, all_code, used_lines
+            )
+            user_input = str({"input": str(input_data)})
+            yield user_input, functools.partial(
+                llm_chat,
+                system_prompt=chat_bot._generate_prompt(record_stats=False),
+                user_message=user_input,
+                site=f"chat-{move['interaction']}-prefetch",
+            )
+
+    MOVE_PREFETCHER.schedule(uid, plan)
+
+
 # T1.2: per-interaction noise parameters. slip/guess/transit are properties of
 # the question type, not of the skill, so they live in this lookup rather than
 # in per-skill state. probGuess for a 4-option MC is 0.25 (a random click is
@@ -711,7 +1141,7 @@ def score_articulation(
     """
     if not articulation_answer or not articulation_answer.strip():
         return None
-    if not GEMINI_API_KEY:
+    if _get_gemini_client() is None:
         return None
     user_payload = (
         f"Knowledge the student is articulating about:\n{knowledge}\n\n"
@@ -724,6 +1154,7 @@ def score_articulation(
             model=model,
             temperature=0,
             response_mime_type="application/json",
+            cache_site="articulation-score",
         )
         scores = json.loads(raw)
     except Exception as exc:
@@ -743,6 +1174,26 @@ def score_articulation(
     }
 
 
+_MODELING_CARD_KEYS = {
+    "task-intent": ("task_goal", "approach", "rationale"),
+    "expert-reading": ("where_to_look", "what_to_compare", "what_to_notice"),
+}
+
+
+def generate_modeling_card(interaction, pedagogy):
+    """Generate a Modeling card's JSON payload, or None if unusable.
+
+    Cards depend only on the segment's opening knowledge item, so they are
+    also precomputed into the content bundle (tools/precompute_content.py).
+    """
+    return llm_json(
+        "You are a tutoring system. Respond with valid JSON only.",
+        pedagogy,
+        required_keys=_MODELING_CARD_KEYS[interaction],
+        cache_site="modeling-card",
+    )
+
+
 prog_action = {
     "Modeling": [
         {
@@ -916,36 +1367,41 @@ concept_action = {
 
 class DataHandler(APIHandler):
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         data = self.get_json_body()
         video_id = data["videoId"]
         if not video_id:
             self.set_status(400)
             self.finish(json.dumps({"error": "Missing video_id"}))
             return
-        csv_data = get_csv_from_youtube_video(video_id)
+        csv_data = await run_blocking(get_csv_from_youtube_video, video_id)
         self.finish(json.dumps(csv_data))
 
 
+def _download_code_file(video_id):
+    code_file = get_code_file(video_id)
+    # Download the file if not exists.
+    if not os.path.exists(code_file["name"]):
+        # Download the file
+        response = requests.get(code_file["download_url"])
+
+        if response.status_code == 200:
+            # Save the file
+            with open(code_file["name"], "wb") as f:
+                f.write(response.content)
+    return code_file
+
+
 class CodeHandler(APIHandler):
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         data = self.get_json_body()
         video_id = data["videoId"]
         if not video_id:
             self.set_status(400)
             self.finish(json.dumps({"error": "Missing video_id"}))
             return
-        code_file = get_code_file(video_id)
-        # Download the file if not exists.
-        if not os.path.exists(code_file["name"]):
-            # Download the file
-            response = requests.get(code_file["download_url"])
-
-            if response.status_code == 200:
-                # Save the file
-                with open(code_file["name"], "wb") as f:
-                    f.write(response.content)
+        code_file = await run_blocking(_download_code_file, video_id)
         self.finish(json.dumps(code_file))
 
 
@@ -957,29 +1413,83 @@ class SegmentHandler(APIHandler):
         )
 
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         global user_id
         data = self.get_json_body()
         video_id = data["videoId"]
         user_id = data["userId"]
         # OPENAI_API_KEY = data["apiKey"]
         # openai.api_key = OPENAI_API_KEY
-        segments = get_segments(video_id)
+        # Cached for the study videos; an uncached video is segmented by a
+        # background run (start_segmentation) that no request thread waits
+        # in. A client that sends allowPartial gets the windows segmented so
+        # far and re-requests while X-Segments-Complete is "false".
+        segments, complete = await run_blocking(get_segments_progress, video_id)
+        if not complete and not data.get("allowPartial"):
+            segments = await asyncio.wrap_future(start_segmentation(video_id))
+            complete = True
+        self.set_header("X-Segments-Complete", "true" if complete else "false")
         self.finish(json.dumps(segments))
 
 
 class ChatHandler(APIHandler):
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
+        data = self.get_json_body()
+        uid = data.get("userId", "unknown")
+        with tracing.trace(
+            type(self).__name__,
+            user_id=uid,
+            video_id=data.get("videoId"),
+            segment_index=data.get("segmentIndex"),
+        ):
+            lock = _user_lock(uid)
+            with tracing.span("user_lock"):
+                await lock.acquire()
+            try:
+                await self._chat_turn(data)
+            finally:
+                lock.release()
+
+    @tracing.traced("chat_bot")
+    async def _ask(self, chat_bot, user_input, site, stream=False, prefetch_uid=None):
+        """One chat-bot call, labelled `site` in the LLM metrics.
+
+        `prefetch_uid` marks moves the prefetcher may already have generated
+        for that participant (see schedule_move_prefetch); a ready or
+        in-flight result is used instead of a new call. `stream` marks
+        plain-text replies that ChatStreamHandler forwards token by token.
+        """
+        if prefetch_uid is not None:
+            future = MOVE_PREFETCHER.claim(prefetch_uid, str(user_input))
+            if future is not None:
+                try:
+                    bot_response = await asyncio.wrap_future(future)
+                except Exception as exc:
+                    print(f"Prefetched move failed, regenerating: {exc}")
+                else:
+                    if bot_response:
+                        chat_bot.memory.save_context(
+                            {"input": str(user_input)}, {"output": bot_response}
+                        )
+                        return bot_response
+        return await self._generate(chat_bot, user_input, site, stream)
+
+    async def _generate(self, chat_bot, user_input, site, stream):
+        return await chat_bot.ask_async(user_input, site=site)
+
+    def _reply(self, response_data):
+        self.finish(json.dumps(response_data))
+
+    async def _chat_turn(self, data):
         global video_type
 
         # Existing video_id logic
-        data = self.get_json_body()
         notebook = data["notebook"]
         question = data["question"]
         video_id = data["videoId"]
         # Per-video code blocks (cached per video_id) — never a shared global.
-        all_code = get_all_code(video_id)
+        all_code = await run_blocking(get_all_code, video_id)
         segment_index = data["segmentIndex"]
         kernelType = data["kernelType"]
         selected_choice = data["selectedChoice"]
@@ -988,11 +1498,13 @@ class ChatHandler(APIHandler):
         session_id = data.get("sessionId", "unknown")
 
         # Get user's experimental condition
-        user_condition = get_user_condition(user_id_req)
+        user_condition = await run_blocking(get_user_condition, user_id_req)
+        tracing.annotate(condition=user_condition)
 
         # Log user question to Firebase
         if question:
-            firebase_logger.log_chat_message(
+            await run_blocking(
+                firebase_logger.log_chat_message,
                 user_id=user_id_req,
                 session_id=session_id,
                 message_type="user_question",
@@ -1011,16 +1523,13 @@ class ChatHandler(APIHandler):
         elif kernelType == "python3":
             kernelType = "Python"
 
-        conn = sqlite3.connect("cache.db")
-        c = conn.cursor()
-
         # T1.5: per-user state lives in a session dict, not module globals.
         session = get_user_session(user_id_req)
         # Hydrate BKT from disk on first contact for this user this process.
         if not session["bkt_params"]:
-            session["bkt_params"] = init_bkt_params(user_id_req)
+            session["bkt_params"] = await run_blocking(init_bkt_params, user_id_req)
 
-        # Per-user chat bot: its ConversationBufferMemory holds this
+        # Per-user chat bot: its conversation memory holds this
         # participant's dialogue history, so it must not be a module global.
         if session["chat_bot"] is None:
             session["chat_bot"] = initialize_chat_server(kernelType)
@@ -1043,7 +1552,9 @@ class ChatHandler(APIHandler):
             knowledge_for_rubric = ""
             if session["cur_seq"]:
                 knowledge_for_rubric = session["cur_seq"][0].get("knowledge", "")
-            rubric = score_articulation(articulation_answer, knowledge_for_rubric)
+            rubric = await run_llm(
+                score_articulation, articulation_answer, knowledge_for_rubric
+            )
             if rubric is not None:
                 mean_score = (
                     rubric["notices_pattern"]
@@ -1062,8 +1573,6 @@ class ChatHandler(APIHandler):
                 new_mastery = session["bkt_params"][artic_skill_id]["probMastery"]
                 # Persist the raw rubric scores alongside mastery so the
                 # study analysis can audit per-articulation grading later.
-                # The rubric history lives inside the per-skill JSON value so
-                # it travels with the existing bkt_params_cache row.
                 rubric_record = {
                     "timestamp": datetime.datetime.utcnow().isoformat(),
                     "video_id": video_id,
@@ -1075,13 +1584,10 @@ class ChatHandler(APIHandler):
                     "is_correct": is_correct,
                     "mastery_before": old_mastery,
                     "mastery_after": new_mastery,
-                    # Cap the stored answer so the JSON row doesn't bloat if
-                    # a participant writes a paragraph.
+                    # Cap the stored answer so the event row doesn't bloat
+                    # if a participant writes a paragraph.
                     "answer_excerpt": articulation_answer[:500],
                 }
-                session["bkt_params"][artic_skill_id].setdefault(
-                    "rubric_history", []
-                ).append(rubric_record)
                 print(
                     f"T2.1 articulation: skill={artic_skill_id} "
                     f"rubric={rubric} mean={mean_score:.2f} "
@@ -1089,11 +1595,15 @@ class ChatHandler(APIHandler):
                     f"{old_mastery:.3f} -> {new_mastery:.3f}"
                 )
                 try:
-                    bkt_params_to_database(user_id_req, session["bkt_params"])
+                    mark_bkt_dirty(user_id_req, session["bkt_params"], [artic_skill_id])
+                    await run_blocking(
+                        record_rubric_event, user_id_req, artic_skill_id, rubric_record
+                    )
                 except Exception as exc:
                     print(f"Warning: BKT persistence failed (articulation): {exc}")
                 p = get_interaction_params("structured-text")
-                firebase_logger.log_bkt_update(
+                await run_blocking(
+                    firebase_logger.log_bkt_update,
                     user_id=user_id_req,
                     session_id=session_id,
                     skill=artic_skill_id,
@@ -1117,6 +1627,7 @@ class ChatHandler(APIHandler):
             # articulation. The skill_id buffer will be overwritten naturally
             # when the next move (Reflection) is processed below.
             session["interaction_buffer"] = ""
+            checkpoint_teaching_state(user_id_req, session)
 
         # ========== CONDITION 1: CONTROL (No Directed Learning) ==========
         if user_condition == "control":
@@ -1137,12 +1648,15 @@ class ChatHandler(APIHandler):
                 prompt = f"{context_info}\n\nStudent question: {question}\n\nProvide a helpful response to guide their learning."
 
                 # Get response from chatbot
-                results = chat_bot.ask({"input": prompt})
+                results = await self._ask(
+                    chat_bot, {"input": prompt}, "chat-control", stream=True
+                )
                 interaction = "plain-text"
                 need_response = True
 
                 # Log AI response
-                firebase_logger.log_chat_message(
+                await run_blocking(
+                    firebase_logger.log_chat_message,
                     user_id=user_id_req,
                     session_id=session_id,
                     message_type="ai_response",
@@ -1161,7 +1675,7 @@ class ChatHandler(APIHandler):
                     "need_response": need_response,
                     "interaction": interaction,
                 }
-                self.finish(json.dumps(response_data))
+                self._reply(response_data)
                 return
             else:
                 # No question asked, just acknowledge
@@ -1174,7 +1688,7 @@ class ChatHandler(APIHandler):
                     "need_response": need_response,
                     "interaction": interaction,
                 }
-                self.finish(json.dumps(response_data))
+                self._reply(response_data)
                 return
         # ========== END CONDITION 1 ==========
 
@@ -1185,46 +1699,22 @@ class ChatHandler(APIHandler):
             if session["cur_seq"] and question == "":
                 # If the student does not ask a question, get the pedagogy, parameters, etc
                 move_detail = session["cur_seq"][0]
-
-                # Get whatever parameters when current segment needs
-                parameters = move_detail.get(
-                    "parameters", {}
-                )  # Safely get parameters with a default
-
-                if "knowledge" in parameters:
-                    input_data["knowledge"] = move_detail["knowledge"]
-
-                pedagogy = move_detail["prompt"]
-                input_data["pedagogy"] = (
-                    "Use the following structure to respond: " + pedagogy
+                input_data, pedagogy = base_move_input(
+                    move_detail, selected_choice, articulation_answer
                 )
                 need_response = move_detail.get("need-response", True)
                 interaction = move_detail["interaction"]
-
-                if selected_choice != "":
-                    # If the student selects a choice, the response is the choice
-                    input_data["student's choice"] = selected_choice
-
-                # Substitute {student-answer} placeholder with the student's
-                # actual articulation text (preferred) or MC choice fallback.
-                if "student-answer" in parameters:
-                    student_answer_value = (
-                        articulation_answer or selected_choice or "(no answer provided)"
-                    )
-                    pedagogy = pedagogy.replace(
-                        "{student-answer}", student_answer_value
-                    )
-                    input_data["pedagogy"] = (
-                        "Use the following structure to respond: " + pedagogy
-                    )
-                    input_data["student's answer"] = student_answer_value
+                tracing.annotate(interaction=interaction)
+                site = f"chat-{interaction}"
 
                 # Handle interaction logic
                 if interaction == "show-code":
                     input_data["requirement"] = (
                         "Don't include the 'code-block' in the response"
                     )
-                    results = chat_bot.ask({"input": str(input_data)})
+                    results = await self._ask(
+                        chat_bot, {"input": str(input_data)}, site, stream=True
+                    )
                     # Some segments (e.g., "Understand the dataset") have no
                     # code block. Skip the append rather than KeyError-ing.
                     code_block_text = all_code.get(str(segment_index))
@@ -1233,13 +1723,22 @@ class ChatHandler(APIHandler):
                 elif interaction == "drop-down":
                     results = pedagogy
                 elif interaction == "multiple-choice":
-                    input_data["pedagogy"] = (
-                        input_data["pedagogy"]
-                        + _MC_DESIGN_GUIDANCE
-                        + _MC_SCHEMA_INSTRUCTION
+                    await run_llm(
+                        add_move_input,
+                        input_data,
+                        move_detail,
+                        video_id,
+                        segment_index,
+                        all_code,
+                        _segment_taught_lines(session, video_id, segment_index),
                     )
                     # results = conversation({"input": str(input_data)})["text"]
-                    raw = chat_bot.ask({"input": str(input_data)})
+                    raw = await self._ask(
+                        chat_bot,
+                        {"input": str(input_data)},
+                        site,
+                        prefetch_uid=user_id_req,
+                    )
                     # Same repair as the Modeling cards: a truncated reply
                     # would otherwise render as raw JSON in the transcript.
                     parsed = _repair_json(raw)
@@ -1264,20 +1763,17 @@ class ChatHandler(APIHandler):
                     # repaired here. The frontend falls back to dumping the raw
                     # body as a chat message when JSON.parse fails, which is how
                     # a half-finished object ends up visible to the student.
-                    card_keys = (
-                        ("task_goal", "approach", "rationale")
-                        if interaction == "task-intent"
-                        else ("where_to_look", "what_to_compare", "what_to_notice")
-                    )
-                    payload = llm_json(
-                        "You are a tutoring system. Respond with valid JSON only.",
-                        pedagogy,
-                        required_keys=card_keys,
+                    payload = content_bundle.get_modeling_card(
+                        video_id, segment_index, pedagogy
                     )
+                    if payload is None:
+                        payload = await run_llm(
+                            generate_modeling_card, interaction, pedagogy
+                        )
                     if payload is None:
                         # Never emit unparseable text: render an empty card
                         # rather than leaking JSON into the transcript.
-                        payload = {k: "" for k in card_keys}
+                        payload = {k: "" for k in _MODELING_CARD_KEYS[interaction]}
                         print(
                             f"{interaction}: no usable JSON from the LLM; "
                             "sending an empty card."
@@ -1288,7 +1784,7 @@ class ChatHandler(APIHandler):
                     # The full JSON is returned as the message body and parsed by
                     # the frontend renderer — repair it first so a truncated
                     # reply doesn't surface as raw JSON.
-                    raw = chat_bot.ask({"input": str(input_data)})
+                    raw = await self._ask(chat_bot, {"input": str(input_data)}, site)
                     parsed = _repair_json(raw)
                     results = (
                         json.dumps(parsed) if isinstance(parsed, dict) else raw
@@ -1298,7 +1794,7 @@ class ChatHandler(APIHandler):
                     # also echo the student's answer into the JSON so the
                     # frontend can render the side-by-side without separate
                     # lookups.
-                    raw = chat_bot.ask({"input": str(input_data)})
+                    raw = await self._ask(chat_bot, {"input": str(input_data)}, site)
                     try:
                         payload = json.loads(raw)
                     except Exception:
@@ -1308,20 +1804,22 @@ class ChatHandler(APIHandler):
                     )
                     results = json.dumps(payload)
                 elif interaction == "annotated-code":
-                    # Scaffolding only needs the plain line to explain — no
-                    # blanked version, so use the lighter line-only helper.
-                    code_line = get_code_line_by_step(
+                    code_line, _ = await run_llm(
+                        add_move_input,
+                        input_data,
+                        move_detail,
                         video_id,
                         segment_index,
                         all_code,
-                        move_detail["knowledge"],
                         _segment_taught_lines(session, video_id, segment_index),
                     )
-                    input_data["code-line"] = code_line
-                    input_data["requirement"] = (
-                        "Don't include the 'code-line' in the response; explain it in one sentence."
+                    results = await self._ask(
+                        chat_bot,
+                        {"input": str(input_data)},
+                        site,
+                        stream=True,
+                        prefetch_uid=user_id_req,
                     )
-                    results = chat_bot.ask({"input": str(input_data)})
                     results = (
                         results
                         + "\n"
@@ -1331,20 +1829,23 @@ class ChatHandler(APIHandler):
                     )
                 elif interaction == "fill-in-blanks":
                     # results = conversation({"input": str(input_data)})["text"]
-                    code_line, code_line_with_blanks = get_code_with_blank_by_step(
+                    code_line, code_line_with_blanks = await run_llm(
+                        add_move_input,
+                        input_data,
+                        move_detail,
                         video_id,
                         segment_index,
                         all_code,
-                        move_detail["knowledge"],
                         _segment_taught_lines(session, video_id, segment_index),
                     )
                     session["code_line_buffer"] = code_line
                     session["code_line_blanks_buffer"] = code_line_with_blanks
-                    input_data["code-line-with-blanks"] = code_line_with_blanks
-                    input_data["requirement"] = (
-                        "Don't include the 'code-line-with-blanks' in the response"
+                    results = await self._ask(
+                        chat_bot,
+                        {"input": str(input_data)},
+                        site,
+                        prefetch_uid=user_id_req,
                     )
-                    results = chat_bot.ask({"input": str(input_data)})
                     results = (
                         results
                         # + " Please fill in the blanks in the code below"
@@ -1356,7 +1857,9 @@ class ChatHandler(APIHandler):
                     )
                 else:
                     # results = conversation({"input": str(input_data)})["text"]
-                    results = chat_bot.ask({"input": str(input_data)})
+                    results = await self._ask(
+                        chat_bot, {"input": str(input_data)}, site, stream=True
+                    )
                     if "code-line" in move_detail["parameters"]:
                         code_line = get_code_line_by_step(
                             video_id,
@@ -1375,8 +1878,8 @@ class ChatHandler(APIHandler):
                         )
 
                 if "code-with-blanks" in move_detail["parameters"]:
-                    code_with_blanks = get_code_with_blank(
-                        video_id, segment_index, all_code
+                    code_with_blanks = await run_llm(
+                        get_code_with_blank, video_id, segment_index, all_code
                     )
                     results = (
                         results
@@ -1424,11 +1927,15 @@ class ChatHandler(APIHandler):
                         f"(mastery unchanged at {bkt_dict[sid]['probMastery']:.3f})"
                     )
                     try:
-                        bkt_params_to_database(user_id_req, bkt_dict)
+                        mark_bkt_dirty(user_id_req, bkt_dict, [sid])
                     except Exception as exc:
                         print(f"Warning: BKT persistence failed after Scaffolding: {exc}")
 
                 session["cur_seq"].pop(0)  # After using this move, remove it
+                checkpoint_teaching_state(user_id_req, session)
+                schedule_move_prefetch(
+                    user_id_req, session, video_id, segment_index, interaction
+                )
 
             elif question != "":
                 # Logic for when there's a question
@@ -1442,7 +1949,9 @@ class ChatHandler(APIHandler):
                     need_response = False
                 interaction = "plain text"
                 # results = conversation({"input": str(input_data)})["text"]
-                results = chat_bot.ask({"input": str(input_data)})
+                results = await self._ask(
+                    chat_bot, {"input": str(input_data)}, "chat-question", stream=True
+                )
             else:
                 # Default case when there's no question or CUR_SEQ
                 interaction = "auto-reply"
@@ -1454,7 +1963,8 @@ class ChatHandler(APIHandler):
                 "need_response": need_response,
                 "interaction": interaction,
             }
-            firebase_logger.log_chat_message(
+            await run_blocking(
+                firebase_logger.log_chat_message,
                 user_id=user_id_req,
                 session_id=session_id,
                 message_type="ai_response",
@@ -1471,15 +1981,77 @@ class ChatHandler(APIHandler):
                     "skill": move_detail.get("skill_id") if move_detail else None,
                 },
             )
-            self.finish(json.dumps(response_data))
+            self._reply(response_data)
         else:
             self.set_status(400)
             self.finish(json.dumps({"error": "No notebook file active"}))
 
 
+class ChatStreamHandler(ChatHandler):
+    """Server-sent-events variant of ChatHandler.
+
+    Same request body and turn logic. The response is text/event-stream:
+
+        event: token   data: {"text": "..."}
+        event: done    data: {"message", "need_response", "interaction"}
+
+    `token` events carry the LLM deltas of plain-text, show-code and
+    annotated-code replies as they arrive; JSON moves (multiple-choice,
+    Modeling cards, ...) are repaired server-side and only arrive in `done`.
+    `done` holds exactly what ChatHandler would have returned, including any
+    code appended after the reply, and is sent after the turn's Firebase
+    logging, i.e. once the stream has completed. A turn that fails after the
+    stream has started ends with
+
+        event: error   data: {"message": "..."}
+
+    instead, since the 200 status has already been sent.
+    """
+
+    _sse_started = False
+
+    async def _chat_turn(self, data):
+        try:
+            await super()._chat_turn(data)
+        except Exception as exc:
+            if not self._sse_started or self._finished:
+                raise
+            print(f"⚠️  Chat stream failed after it started: {str(exc)}")
+            self._write_event("error", {"message": "The reply could not be completed."})
+            self.finish(set_content_type="text/event-stream")
+
+    def _write_event(self, event, payload):
+        if not self._sse_started:
+            self.set_header("Content-Type", "text/event-stream")
+            self.set_header("Cache-Control", "no-cache")
+            # Stop a fronting nginx from buffering the whole stream.
+            self.set_header("X-Accel-Buffering", "no")
+            self._sse_started = True
+        self.write(f"event: {event}\ndata: {json.dumps(payload)}\n\n")
+
+    async def _send_event(self, event, payload):
+        self._write_event(event, payload)
+        await self.flush()
+
+    async def _generate(self, chat_bot, user_input, site, stream):
+        if not stream:
+            return await chat_bot.ask_async(user_input, site=site)
+        return await chat_bot.ask_stream(
+            user_input,
+            lambda text: self._send_event("token", {"text": text}),
+            site=site,
+        )
+
+    def _reply(self, response_data):
+        self._write_event("done", response_data)
+        # APIHandler.finish() would otherwise relabel a turn that streamed
+        # no tokens (so had not flushed its headers yet) as JSON.
+        self.finish(set_content_type="text/event-stream")
+
+
 class GoOnHandler(APIHandler):
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         """Evaluate if the user is ready to go on to the next segment."""
         data = self.get_json_body() or {}
         uid = data.get("userId", "unknown")
@@ -1494,9 +2066,25 @@ class GoOnHandler(APIHandler):
 
 class UpdateSeqHandler(APIHandler):
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         """Update the sequence of moves and step index depending on the mastery of the skill and category."""
         data = self.get_json_body()
+        uid = data.get("userId", "unknown")
+        with tracing.trace(
+            "UpdateSeqHandler",
+            user_id=uid,
+            video_id=data.get("videoId"),
+            segment_index=data.get("segmentIndex"),
+        ):
+            lock = _user_lock(uid)
+            with tracing.span("user_lock"):
+                await lock.acquire()
+            try:
+                await self._update_seq(data)
+            finally:
+                lock.release()
+
+    async def _update_seq(self, data):
         video_id = data["videoId"]
         segment_index = data["segmentIndex"]
         learning_obj = data["category"]
@@ -1505,11 +2093,11 @@ class UpdateSeqHandler(APIHandler):
         session = get_user_session(user_id)
         # Hydrate BKT once per process for this user; cheap if already loaded.
         if not session["bkt_params"]:
-            session["bkt_params"] = init_bkt_params(user_id)
+            session["bkt_params"] = await run_blocking(init_bkt_params, user_id)
         bkt_params = session["bkt_params"]
 
         # Check user's condition
-        user_condition = get_user_condition(user_id)
+        user_condition = await run_blocking(get_user_condition, user_id)
 
         # For control condition, don't generate teaching sequences
         if user_condition == "control":
@@ -1518,7 +2106,7 @@ class UpdateSeqHandler(APIHandler):
 
         # Per-video code blocks (cached per video_id), so switching videos
         # always uses the correct code.
-        all_code = get_all_code(video_id)
+        all_code = await run_blocking(get_all_code, video_id)
 
         if learning_obj == "Load packages/data":
             sections = [
@@ -1589,8 +2177,13 @@ class UpdateSeqHandler(APIHandler):
             ]
         else:
             code_block = all_code.get(str(segment_index), "")
-            knowledge = get_knowledge(
-                video_id, video_type, learning_obj, segment_index, code_block
+            knowledge = await run_llm(
+                get_knowledge,
+                video_id,
+                video_type,
+                learning_obj,
+                segment_index,
+                code_block,
             )
             # For quiz condition: ONE CONTENT-AWARE multiple-choice question
             # PER KNOWLEDGE ITEM (code-focused for programming segments,
@@ -1808,6 +2401,7 @@ class UpdateSeqHandler(APIHandler):
                     )
                 )
         session["cur_seq"] = new_cur_seq
+        checkpoint_teaching_state(user_id, session)
 
         # Gap 1: log the teaching MOVE chosen for each item, with the mastery
         # the planner saw at decision time. This is what RQ2.1 / Measure 3.2
@@ -1817,42 +2411,49 @@ class UpdateSeqHandler(APIHandler):
         # Articulation). Mastery is read BEFORE any teaching this segment, so
         # it reflects the state the decision was based on, not the post-answer
         # value that bkt_updates records.
-        for entry in new_cur_seq:
-            skill_id = entry["skill_id"]
-            skill_state = bkt_params.get(skill_id, {})
-            firebase_logger.log_teaching_method(
-                user_id=user_id,
-                session_id=session_id,
-                method=entry.get("method"),
-                video_id=video_id,
-                segment_index=segment_index,
-                context={
-                    "condition": user_condition,
-                    "skill": skill_id,
-                    "interaction": entry.get("interaction"),
-                    "knowledge": entry.get("knowledge"),
-                    "mastery_at_decision": skill_state.get("probMastery", 0.1),
-                    "n_observations_at_decision": skill_state.get(
-                        "n_observations", 0
-                    ),
-                },
-            )
+        def _log_teaching_methods():
+            for entry in new_cur_seq:
+                skill_id = entry["skill_id"]
+                skill_state = bkt_params.get(skill_id, {})
+                firebase_logger.log_teaching_method(
+                    user_id=user_id,
+                    session_id=session_id,
+                    method=entry.get("method"),
+                    video_id=video_id,
+                    segment_index=segment_index,
+                    context={
+                        "condition": user_condition,
+                        "skill": skill_id,
+                        "interaction": entry.get("interaction"),
+                        "knowledge": entry.get("knowledge"),
+                        "mastery_at_decision": skill_state.get("probMastery", 0.1),
+                        "n_observations_at_decision": skill_state.get(
+                            "n_observations", 0
+                        ),
+                    },
+                )
+
+        await run_blocking(_log_teaching_methods)
         # Fresh teaching sequence for this segment — forget which code lines
         # the previous sequence used, so a rebuild (e.g. after a refresh)
         # starts from the best-matching lines again.
         session["taught_lines_key"] = None
         session["taught_lines"] = set()
+        MOVE_PREFETCHER.reset(user_id)
+        schedule_move_prefetch(user_id, session, video_id, segment_index)
         print("CUR_SEQ after update:", session["cur_seq"])
 
 
 class FillInBlanksHandler(APIHandler):
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         """Get all choices for the fill-in-blanks action."""
         data = self.get_json_body()
         video_id = data["videoId"]
         segment_index = data["segmentIndex"]
-        functions_attributes_to_learn = get_function_attribute_by_segment(
+        # May have to generate the segment's knowledge first (LLM).
+        functions_attributes_to_learn = await run_llm(
+            get_function_attribute_by_segment,
             video_id=video_id,
             segment_index=segment_index,
             code_json=get_all_code(video_id),
@@ -1864,8 +2465,12 @@ class FillInBlanksHandler(APIHandler):
 
 class UpdateBKTHandler(APIHandler):
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         data = self.get_json_body()
+        async with _user_lock(data.get("userId", "unknown")):
+            await self._update_bkt(data)
+
+    async def _update_bkt(self, data):
         video_id = data["videoId"]
         filled_code = data["filledCode"]
         selected_choice = data["selectedChoice"]
@@ -1873,21 +2478,23 @@ class UpdateBKTHandler(APIHandler):
         user_id_req = data.get("userId", "unknown")
         session_id = data.get("sessionId", "unknown")
         # Check user's condition - skip BKT for control, quiz, and fixed_cogapp conditions
-        user_condition = get_user_condition(user_id_req)
+        user_condition = await run_blocking(get_user_condition, user_id_req)
         if user_condition in ["control", "quiz", "fixed_cogapp"]:
             self.finish(json.dumps({"status": "skipped", "condition": user_condition}))
             return
 
         session = get_user_session(user_id_req)
         if not session["bkt_params"]:
-            session["bkt_params"] = init_bkt_params(user_id_req)
+            session["bkt_params"] = await run_blocking(init_bkt_params, user_id_req)
 
         # T1.1: skill_id was buffered by ChatHandler when the practice item
         # was sent out, so we use it directly instead of re-extracting from
         # a fragile natural-language knowledge string.
         skill_id = session.get("skill_id_buffer", "")
         if video_id != "" and skill_id:
-            update_bkt_params(
+            # update_bkt_params logs to Firebase, so it runs off the IOLoop.
+            await run_blocking(
+                update_bkt_params,
                 session,
                 skill_id,
                 filled_code,
@@ -1900,428 +2507,90 @@ class UpdateBKTHandler(APIHandler):
             # T1.4: persist after each update so the on-disk state stays in
             # sync with memory (also survives process restarts mid-study).
             try:
-                bkt_params_to_database(user_id_req, session["bkt_params"])
-            except Exception as exc:
-                print(f"Warning: BKT persistence failed: {exc}")
-            self.finish(json.dumps("update bkt successfully"))
-        else:
-            print(
-                f"UpdateBKTHandler skipped: video_id={video_id!r} "
-                f"skill_id_buffer={skill_id!r}"
-            )
-            self.finish(json.dumps({"status": "skipped"}))
-
-
-def initialze_database():
-    """Initialize the database that has the transcript and segments for videos."""
-    global user_id
-    conn = sqlite3.connect("cache.db")
-    c = conn.cursor()
-    c.execute(
-        """
-    CREATE TABLE IF NOT EXISTS segments_cache (
-        video_id TEXT PRIMARY KEY,
-        segments TEXT NOT NULL
-    );"""
-    )
-    c.execute(
-        """
-    CREATE TABLE IF NOT EXISTS code_cache (
-        video_id TEXT PRIMARY KEY,
-        file_name TEXT NOT NULL,
-        download_url TEXT NOT NULL
-    );"""
-    )
-    c.execute(
-        """
-    CREATE TABLE IF NOT EXISTS data_cache (
-        video_id TEXT,
-        name TEXT NOT NULL,
-        download_url TEXT NOT NULL,
-        attributes_info TEXT NOT NULL,
-        PRIMARY KEY (video_id, name)
-    );"""
-    )
-    c.execute(
-        """
-    CREATE TABLE IF NOT EXISTS bkt_params_cache (
-        user_id TEXT PRIMARY KEY,
-        skills_probMastery TEXT NOT NULL
-    );"""
-    )
-    c.execute(
-        """
-    CREATE TABLE IF NOT EXISTS knowledge_cache (
-        video_id TEXT,
-        segment_index NUMBER NOT NULL,
-        knowledge TEXT NOT NULL,
-        PRIMARY KEY (video_id, segment_index)
-    );"""
-    )
-    c.execute(
-        """
-    CREATE TABLE IF NOT EXISTS code_block_cache (
-        video_id TEXT,
-        segment_index NUMBER NOT NULL,
-        code_with_blanks TEXT,
-        PRIMARY KEY (video_id, segment_index)
-    );"""
-    )
-
-    video_id = "nx5yhXAQLxw"
-    segments_set = [
-        {"category": "Introduction", "start": 1, "end": 86},  # 0
-        {"category": "Load packages/data", "start": 86, "end": 212},  # 1
-        {"category": "Understand the dataset", "start": 212, "end": 418},  # 2
-        {"category": "Visualize the data", "start": 418, "end": 463},  # 3
-        {"category": "Interpret the chart", "start": 463, "end": 509},  # 4
-        {"category": "Visualize the data", "start": 509, "end": 602},  # 5
-        {"category": "Interpret the chart", "start": 602, "end": 638},  # 6
-        {"category": "Visualize the data", "start": 638, "end": 720},  # 7
-        {"category": "Interpret the chart", "start": 720, "end": 848},  # 8
-        {"category": "Visualize the data", "start": 848, "end": 971},  # 9
-        {"category": "Interpret the chart", "start": 971, "end": 1101},  # 10
-        {"category": "Preprocess the data", "start": 1101, "end": 1145},  # 11
-        {"category": "Interpret the chart", "start": 1145, "end": 1177},  # 12
-        {"category": "Visualize the data", "start": 1177, "end": 1371},  # 13
-    ]
-    segments_json = json.dumps(segments_set)
-    c.execute("SELECT * FROM segments_cache WHERE video_id = ?", (video_id,))
-    if c.fetchone() is None:
-        # Insert new data if video_id doesn't exist
-        c.execute(
-            "INSERT INTO segments_cache (video_id, segments) VALUES (?, ?)",
-            (video_id, segments_json),
-        )
-
-    video_id = "Kd9BNI6QMmQ"
-    segments_set = [
-        {"category": "Introduction", "start": 1, "end": 102},  # 0
-        {"category": "Load packages/data", "start": 102, "end": 137},  # 1
-        {"category": "Understand the dataset", "start": 137, "end": 220},  # 2
-        {"category": "Preprocess the data", "start": 220, "end": 568},  # 3
-        {"category": "Visualize the data", "start": 568, "end": 580},  # 4
-        {"category": "Interpret the chart", "start": 580, "end": 596},  # 5
-        {"category": "Visualize the data", "start": 596, "end": 655},  # 6
-        {"category": "Interpret the chart", "start": 655, "end": 740},  # 7
-        {"category": "Visualize the data", "start": 740, "end": 900},  # 8
-        {"category": "Interpret the chart", "start": 900, "end": 968},  # 9
-        {"category": "Visualize the data", "start": 968, "end": 1027},  # 10
-    ]
-    segments_json = json.dumps(segments_set)
-    c.execute("SELECT * FROM segments_cache WHERE video_id = ?", (video_id,))
-    if c.fetchone() is None:
-        # Insert new data if video_id doesn't exist
-        c.execute(
-            "INSERT INTO segments_cache (video_id, segments) VALUES (?, ?)",
-            (video_id, segments_json),
-        )
-
-    video_id = "EF4A4OtQprg"  # pet names
-    segments_set = [
-        {
-            "category": "Understand the dataset",
-            "start": 1,
-            "end": 157,
-        },  # 0
-        {
-            "category": "Preprocess and Visualize the data",
-            "start": 157,
-            "end": 536,
-        },  # 1
-        {
-            "category": "Interpret the chart and propose hypotheses",
-            "start": 536,
-            "end": 614,
-        },  # 2
-        {
-            "category": "Preprocess and Visualize the data",
-            "start": 614,
-            "end": 1077,
-        },  # 3
-        {
-            "category": "Interpret the chart and propose hypotheses",
-            "start": 1077,
-            "end": 1178,
-        },  # 4
-        {
-            "category": "Preprocess and Visualize the data",
-            "start": 1178,
-            "end": 1497,
-        },  # 5
-        {
-            "category": "Preprocess and Visualize the data",
-            "start": 1497,
-            "end": 1787,
-        },  # 6
-        {
-            "category": "Interpret the chart and propose hypotheses",
-            "start": 1787,
-            "end": 2540,
-        },  # 7
-        {
-            "category": "Preprocess and Visualize the data",
-            "start": 2540,
-            "end": 2697,
-        },  # 8
-        {
-            "category": "Interpret the chart and propose hypotheses",
-            "start": 2697,
-            "end": 2846,
-        },  # 9
-        {
-            "category": "Preprocess and Visualize the data",
-            "start": 2846,
-            "end": 3344,
-        },  # 10
-    ]
-    segments_json = json.dumps(segments_set)
-    c.execute("SELECT * FROM segments_cache WHERE video_id = ?", (video_id,))
-    if c.fetchone() is None:
-        # Insert new data if video_id doesn't exist
-        c.execute(
-            "INSERT INTO segments_cache (video_id, segments) VALUES (?, ?)",
-            (video_id, segments_json),
-        )
-
-    video_id = "1xsbTs9-a50"  # franchise revenue
-    segments_set = [
-        {
-            "category": "Understand the dataset",
-            "start": 1,
-            "end": 401,
-        },  # 0
-        {
-            "category": "Preprocess and Visualize the data",
-            "start": 401,
-            "end": 663,
-        },  # 1
-        {
-            "category": "Interpret the chart and propose hypotheses",
-            "start": 663,
-            "end": 1032,
-        },  # 2
-        {
-            "category": "Preprocess and Visualize the data",
-            "start": 1032,
-            "end": 1414,
-        },  # 3
-        {
-            "category": "Interpret the chart and propose hypotheses",
-            "start": 1414,
-            "end": 1589,
-        },  # 4
-        {
-            "category": "Preprocess and Visualize the data",
-            "start": 1589,
-            "end": 1721,
-        },  # 5
-        {
-            "category": "Interpret the chart and propose hypotheses",
-            "start": 1721,
-            "end": 1941,
-        },  # 6
-        {
-            "category": "Preprocess and Visualize the data",
-            "start": 1941,
-            "end": 2233,
-        },  # 7
-        {
-            "category": "Interpret the chart and propose hypotheses",
-            "start": 2233,
-            "end": 2441,
-        },  # 8
-        {
-            "category": "Preprocess and Visualize the data",
-            "start": 2441,
-            "end": 2700,
-        },  # 9
-        {
-            "category": "Interpret the chart and propose hypotheses",
-            "start": 2700,
-            "end": 2849,
-        },  # 10
-        {
-            "category": "Preprocess and Visualize the data",
-            "start": 2849,
-            "end": 3261,
-        },  # 11
-    ]
-    segments_json = json.dumps(segments_set)
-    c.execute("SELECT * FROM segments_cache WHERE video_id = ?", (video_id,))
-    if c.fetchone() is None:
-        # Insert new data if video_id doesn't exist
-        c.execute(
-            "INSERT INTO segments_cache (video_id, segments) VALUES (?, ?)",
-            (video_id, segments_json),
-        )
-
-    video_id = "-1x8Kpyndss"  # coffee ratings
-    segments_set = [
-        {
-            "category": "Understand the dataset",
-            "start": 1,
-            "end": 362,
-        },  # 0
-        {
-            "category": "Preprocess and Visualize the data",
-            "start": 362,
-            "end": 664,
-        },  # 1
-        {
-            "category": "Interpret the chart and propose hypotheses",
-            "start": 664,
-            "end": 743,
-        },  # 2
-        {
-            "category": "Preprocess and Visualize the data",
-            "start": 743,
-            "end": 1022,
-        },  # 3
-        {
-            "category": "Interpret the chart and propose hypotheses",
-            "start": 1022,
-            "end": 1120,
-        },  # 4
-        {
-            "category": "Preprocess and Visualize the data",
-            "start": 1120,
-            "end": 1464,
-        },  # 5
-        {
-            "category": "Interpret the chart and propose hypotheses",
-            "start": 1464,
-            "end": 1566,
-        },  # 6
-        {
-            "category": "Preprocess and Visualize the data",
-            "start": 1566,
-            "end": 1930,
-        },  # 7
-        {
-            "category": "Interpret the chart and propose hypotheses",
-            "start": 1930,
-            "end": 2257,
-        },  # 8
-        {
-            "category": "Preprocess and Visualize the data",
-            "start": 2257,
-            "end": 2487,
-        },  # 9
-        {
-            "category": "Interpret the chart and propose hypotheses",
-            "start": 2487,
-            "end": 2687,
-        },  # 10
-        {
-            "category": "Preprocess and Visualize the data",
-            "start": 2687,
-            "end": 2873,
-        },  # 11
-        {
-            "category": "Interpret the chart and propose hypotheses",
-            "start": 2873,
-            "end": 3113,
-        },  # 12
-    ]
-    segments_json = json.dumps(segments_set)
-    c.execute("SELECT * FROM segments_cache WHERE video_id = ?", (video_id,))
-    if c.fetchone() is None:
-        # Insert new data if video_id doesn't exist
-        c.execute(
-            "INSERT INTO segments_cache (video_id, segments) VALUES (?, ?)",
-            (video_id, segments_json),
-        )
-
-    video_id = "8jazNUpO3lQ"
-    segments_set = [
-        {"category": "Basic linear regression concepts", "start": 1, "end": 155},  # 0
-        {"category": "Load packages/data", "start": 155, "end": 232},  # 1
-        {
-            "category": "Plot a plot for linear regression",
-            "start": 232,
-            "end": 325,
-        },  # 2
-        {
-            "category": "Create and understand linear regression object",
-            "start": 325,
-            "end": 551,
-        },  # 3
-        {
-            "category": "Generate CSV file with list of home price predictions",
-            "start": 551,
-            "end": 712,
-        },
-    ]
-    segments_json = json.dumps(segments_set)
-    c.execute("SELECT * FROM segments_cache WHERE video_id = ?", (video_id,))
-    if c.fetchone() is None:
-        # Insert new data if video_id doesn't exist
-        c.execute(
-            "INSERT INTO segments_cache (video_id, segments) VALUES (?, ?)",
-            (video_id, segments_json),
-        )
-    all_skills = [
-        "use 'geom_boxplot' to achieve a meaningful visualization of data distributions",
-    ]
-    c.execute("SELECT * FROM bkt_params_cache WHERE user_id = ?", (user_id,))
-    if c.fetchone() is None:
-        prob_mastery = {skill: 0.1 for skill in all_skills}
-        prob_mastery_json = json.dumps(prob_mastery)
-        c.execute(
-            "INSERT INTO bkt_params_cache (user_id, skills_probMastery) VALUES (?, ?)",
-            (user_id, prob_mastery_json),
-        )
+                mark_bkt_dirty(user_id_req, session["bkt_params"], [skill_id])
+            except Exception as exc:
+                print(f"Warning: BKT persistence failed: {exc}")
+            # update_bkt_params consumed the practice-item buffers.
+            checkpoint_teaching_state(user_id_req, session)
+            self.finish(json.dumps("update bkt successfully"))
+        else:
+            print(
+                f"UpdateBKTHandler skipped: video_id={video_id!r} "
+                f"skill_id_buffer={skill_id!r}"
+            )
+            self.finish(json.dumps({"status": "skipped"}))
 
-    c.execute(
-        """
-    CREATE TABLE IF NOT EXISTS user_conditions (
-        user_id TEXT PRIMARY KEY,
-        condition TEXT NOT NULL,
-        assigned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );"""
-    )
 
-    c.execute(
-        """
-    CREATE TABLE IF NOT EXISTS questionnaire_progress (
-        user_id TEXT PRIMARY KEY,
-        pretest_completed INTEGER NOT NULL DEFAULT 0,
-        pretest_completed_at TIMESTAMP
-    );"""
+def _summarize_conversation(summary, turns):
+    """Fold older chat exchanges into the running summary (chat_memory)."""
+    return llm_chat(
+        system_prompt=(
+            "You maintain a running summary of a tutoring conversation between "
+            "a student and a teaching assistant about a data analysis video. "
+            "Merge the new exchanges into the existing summary. Keep what the "
+            "student has learned, struggled with, answered and asked, in no "
+            "more than 150 words. Respond with the summary only."
+        ),
+        user_message=(
+            f"existing summary: {summary or '(none)'}\n"
+            f"new exchanges:\n{chat_memory.format_turns(turns)}"
+        ),
+        temperature=0.2,
     )
 
-    # Migrate questionnaire_progress for post-test tracking if columns are missing.
-    c.execute("PRAGMA table_info(questionnaire_progress)")
-    existing_columns = {row[1] for row in c.fetchall()}
-    if "latin_order" not in existing_columns:
-        c.execute("ALTER TABLE questionnaire_progress ADD COLUMN latin_order TEXT")
-    if "posttest_index" not in existing_columns:
-        c.execute(
-            "ALTER TABLE questionnaire_progress ADD COLUMN posttest_index INTEGER NOT NULL DEFAULT 0"
-        )
-    if "completed_videos" not in existing_columns:
-        c.execute(
-            "ALTER TABLE questionnaire_progress ADD COLUMN completed_videos TEXT NOT NULL DEFAULT '[]'"
-        )
-    if "finished_videos" not in existing_columns:
-        c.execute(
-            "ALTER TABLE questionnaire_progress ADD COLUMN finished_videos TEXT NOT NULL DEFAULT '[]'"
-        )
-    if "assigned_video_id" not in existing_columns:
-        c.execute(
-            "ALTER TABLE questionnaire_progress ADD COLUMN assigned_video_id TEXT"
-        )
 
-    conn.commit()
-    conn.close()
+# Verbatim exchanges kept in the prompt, the token budget for the whole
+# rendered history, and how many older exchanges one summary call folds in
+# (see chat_memory.SummarizingMemory).
+CHAT_MEMORY_TURNS = int(os.environ.get("TUTORLY_CHAT_MEMORY_TURNS", "6"))
+CHAT_MEMORY_TOKENS = int(os.environ.get("TUTORLY_CHAT_MEMORY_TOKENS", "2000"))
+CHAT_MEMORY_SUMMARY_BATCH = int(
+    os.environ.get("TUTORLY_CHAT_MEMORY_SUMMARY_BATCH", "4")
+)
 
 
 class CustomChatBotWithMemory:
     def __init__(self, kernel_type):
         self.kernel_type = self._translate_kernel_type(kernel_type)
         self.video_type = "Exploratory Data Analysis (EDA)"
-        self.memory = ConversationBufferMemory()
+        self.memory = chat_memory.SummarizingMemory(
+            max_recent=CHAT_MEMORY_TURNS,
+            token_budget=CHAT_MEMORY_TOKENS,
+            summarize=_summarize_conversation,
+            executor=_LLM_EXECUTOR,
+            summary_batch=CHAT_MEMORY_SUMMARY_BATCH,
+        )
+        # System-prompt size per call, in estimated tokens.
+        self.prompt_calls = 0
+        self.prompt_tokens_total = 0
+        self.prompt_tokens_last = 0
+        self.prompt_tokens_max = 0
+
+    def to_dict(self) -> dict:
+        """State for SessionStore to spill; see from_dict()."""
+        return {
+            "kernel_type": self.kernel_type,
+            "video_type": self.video_type,
+            "memory": self.memory.to_dict(),
+            "prompt_calls": self.prompt_calls,
+            "prompt_tokens_total": self.prompt_tokens_total,
+            "prompt_tokens_last": self.prompt_tokens_last,
+            "prompt_tokens_max": self.prompt_tokens_max,
+        }
+
+    @classmethod
+    def from_dict(cls, state: dict) -> "CustomChatBotWithMemory":
+        bot = cls(kernel_type=state["kernel_type"])
+        bot.video_type = state.get("video_type", bot.video_type)
+        bot.memory.restore(state.get("memory", {}))
+        for name in (
+            "prompt_calls",
+            "prompt_tokens_total",
+            "prompt_tokens_last",
+            "prompt_tokens_max",
+        ):
+            setattr(bot, name, state.get(name, 0))
+        return bot
 
     def _translate_kernel_type(self, kernel_type):
         if kernel_type == "ir":
@@ -2330,7 +2599,7 @@ class CustomChatBotWithMemory:
             return "Python"
         return kernel_type
 
-    def _generate_prompt(self):
+    def _generate_prompt(self, record_stats=True):
         template = f"""
         You are an expert in Data Science, specializing in {self.video_type}. Your task is to use the Cognitive Apprenticeship approach to assist a student in learning {self.video_type} through David Robinson's Tidy Tuesday tutorial series.
 
@@ -2349,7 +2618,25 @@ class CustomChatBotWithMemory:
         - You can find out the full list of conversation history below.
         """
         history = self.memory.load_memory_variables({})["history"]
-        return template + "conversation history: " + history
+        prompt = template + "conversation history: " + history
+        if not record_stats:
+            return prompt
+        tokens = chat_memory.estimate_tokens(prompt)
+        self.prompt_calls += 1
+        self.prompt_tokens_total += tokens
+        self.prompt_tokens_last = tokens
+        self.prompt_tokens_max = max(self.prompt_tokens_max, tokens)
+        return prompt
+
+    def prompt_stats(self) -> dict:
+        stats = {
+            "calls": self.prompt_calls,
+            "tokens_last": self.prompt_tokens_last,
+            "tokens_max": self.prompt_tokens_max,
+            "tokens_total": self.prompt_tokens_total,
+        }
+        stats.update(self.memory.stats())
+        return stats
 
     def ask(self, user_input):
         prompt = self._generate_prompt()
@@ -2357,8 +2644,40 @@ class CustomChatBotWithMemory:
             system_prompt=prompt,
             user_message=str(user_input),
         )
-        # Update memory with the latest exchange (langchain memory works
-        # provider-agnostically; we just record the strings).
+        # Update memory with the latest exchange.
+        self.memory.save_context({"input": str(user_input)}, {"output": bot_response})
+        return bot_response
+
+    async def ask_async(self, user_input, site="chat-bot"):
+        """Coroutine version of ask(), used by the async request handlers.
+
+        `site` labels the LLM call's metrics (see llm_chat).
+        """
+        prompt = self._generate_prompt()
+        bot_response = await llm_chat_async(
+            system_prompt=prompt,
+            user_message=str(user_input),
+            site=site,
+        )
+        self.memory.save_context({"input": str(user_input)}, {"output": bot_response})
+        return bot_response
+
+    async def ask_stream(self, user_input, on_text, site="chat-bot"):
+        """Like ask_async(), awaiting `on_text(delta)` for each streamed delta.
+
+        Memory is only updated once the whole reply has arrived, so an
+        aborted stream leaves the conversation history untouched.
+        """
+        prompt = self._generate_prompt()
+        parts = []
+        async for delta in llm_chat_stream(
+            system_prompt=prompt,
+            user_message=str(user_input),
+            site=site,
+        ):
+            parts.append(delta)
+            await on_text(delta)
+        bot_response = _clean_llm_text("".join(parts))
         self.memory.save_context({"input": str(user_input)}, {"output": bot_response})
         return bot_response
 
@@ -2373,8 +2692,29 @@ def initialize_chat_server(kernelType):
     return CustomChatBotWithMemory(kernel_type=kernelType)
 
 
+def chat_prompt_stats() -> dict:
+    """System-prompt sizes over every live chat bot, as max and sum per stat.
+
+    Aggregated rather than keyed by uid, so the metrics endpoint exports a
+    fixed number of series however many participants connect.
+    """
+    per_bot = [
+        session["chat_bot"].prompt_stats()
+        for _, session in list(USER_SESSIONS.items())
+        if session.get("chat_bot") is not None
+    ]
+    stats = {"bots": len(per_bot)}
+    for bot in per_bot:
+        for stat, value in bot.items():
+            stats[f"{stat}_max"] = max(stats.get(f"{stat}_max", value), value)
+            stats[f"{stat}_sum"] = stats.get(f"{stat}_sum", 0) + value
+    return stats
+
+
 def iso8601_duration_as_seconds(duration):
     """Parse the duration of an ISO 8601 duration into seconds."""
+    import isodate
+
     duration_obj = isodate.parse_duration(duration)
     return duration_obj.total_seconds()
 
@@ -2400,6 +2740,8 @@ def is_valid_date(date_string):
 
 def get_data_info_by_url(download_url):
     """Fetch the content of the data file URL."""
+    import pandas as pd
+
     response = requests.get(download_url)
     response.raise_for_status()  # Raise an error for failed requests
 
@@ -2466,10 +2808,7 @@ def get_csv_file(folder):
 def get_csv_from_youtube_video(video_id):
     """Get all the csv files corresponding to a video to a list of dict."""
     # Step 1: Check database first
-    conn = sqlite3.connect("cache.db")
-    c = conn.cursor()
-    c.execute("SELECT * FROM data_cache WHERE video_id=?", (video_id,))
-    rows = c.fetchall()
+    rows = db.query_all("SELECT * FROM data_cache WHERE video_id=?", (video_id,))
     csv_list = []
     if rows:  # Data exists in cache
         for row in rows:
@@ -2482,18 +2821,17 @@ def get_csv_from_youtube_video(video_id):
     closest_folder = get_closest_date_folder(video_publish_date)
     csv_list = get_csv_file(closest_folder)
     # Step 2: Save to database
-    for csv_file in csv_list:
-        c.execute(
-            "INSERT INTO data_cache VALUES (?, ?, ?, ?)",
-            (
-                video_id,
-                csv_file["name"],
-                csv_file["download_url"],
-                csv_file["attributes_info"],
-            ),
-        )
-    conn.commit()
-    conn.close()
+    with db.transaction() as conn:
+        for csv_file in csv_list:
+            conn.execute(
+                "INSERT OR REPLACE INTO data_cache VALUES (?, ?, ?, ?)",
+                (
+                    video_id,
+                    csv_file["name"],
+                    csv_file["download_url"],
+                    csv_file["attributes_info"],
+                ),
+            )
     return csv_list
 
 
@@ -2524,6 +2862,8 @@ def get_transcript(video_id, start=0, end=900):
     """Get the transcript file corresponding to a video from the database."""
     data = _load_bundled_transcript(video_id)
     if data is None:
+        from youtube_transcript_api import YouTubeTranscriptApi
+
         ytt_api = YouTubeTranscriptApi()
         fetched_transcript = ytt_api.fetch(video_id)
         data = fetched_transcript.to_raw_data()  # Convert to list of dicts
@@ -2542,24 +2882,130 @@ def get_transcript(video_id, start=0, end=900):
     return transcript, paragraph
 
 
-def get_segments(video_id):
-    """Get the segments file corresponding to a video from the database."""
-    initialze_database()
-    conn = sqlite3.connect("cache.db")
-    c = conn.cursor()
-    c.execute("SELECT segments FROM segments_cache WHERE video_id = ?", (video_id,))
-    row = c.fetchone()
-    if row:
-        return json.loads(row[0])
-    else:
-        segments = get_video_segment(video_id)
-        c.execute(
-            "INSERT INTO segments_cache (video_id, segments) VALUES (?, ?)",
+def _cached_segments(video_id):
+    row = db.query_one(
+        "SELECT segments FROM segments_cache WHERE video_id = ?", (video_id,)
+    )
+    return json.loads(row[0]) if row else None
+
+
+def _store_segment_window(video_id, window_index, n_windows, end_time, items):
+    db.execute(
+        "INSERT OR REPLACE INTO segment_windows "
+        "(video_id, window_index, n_windows, end_time, segments) "
+        "VALUES (?, ?, ?, ?, ?)",
+        (video_id, window_index, n_windows, end_time, json.dumps(items)),
+    )
+
+
+def _load_segment_windows(video_id):
+    """Return {window_index: (n_windows, end_time, items)} stored so far."""
+    rows = db.query_all(
+        "SELECT window_index, n_windows, end_time, segments "
+        "FROM segment_windows WHERE video_id = ?",
+        (video_id,),
+    )
+    return {row[0]: (row[1], row[2], json.loads(row[3])) for row in rows}
+
+
+def _generate_segments(video_id):
+    # Re-check under the flight: another process may have just written it.
+    segments = _cached_segments(video_id)
+    if segments is not None:
+        return segments
+    # Windows finished by an earlier, interrupted run are reused.
+    stored = _load_segment_windows(video_id)
+    done = {i: items for i, (_, _, items) in stored.items()}
+
+    def on_window(window_index, n_windows, end_time, items):
+        _store_segment_window(video_id, window_index, n_windows, end_time, items)
+
+    segments = get_video_segment(video_id, done_windows=done, on_window=on_window)
+    with db.transaction() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO segments_cache (video_id, segments) VALUES (?, ?)",
             (video_id, json.dumps(segments)),
         )
-        conn.commit()
-        conn.close()
+        conn.execute("DELETE FROM segment_windows WHERE video_id = ?", (video_id,))
+    return segments
+
+
+def get_segments(video_id):
+    """Get the segments file corresponding to a video from the database."""
+    segments = content_bundle.get_segments(video_id)
+    if segments is not None:
+        return segments
+    segments = _cached_segments(video_id)
+    if segments is not None:
         return segments
+    return singleflight.run(("segments", video_id), lambda: _generate_segments(video_id))
+
+
+# Uncached videos are segmented by one background run per video, on a pool
+# of its own: the run waits on its windows (_SEGMENT_EXECUTOR), and requests
+# only poll what it has stored, so neither holds an _LLM_EXECUTOR worker.
+_SEGMENTATION_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("TUTORLY_SEGMENTATION_WORKERS", "2")),
+    thread_name_prefix="tutorly-segmentation",
+)
+_segmentation_runs: dict = {}
+_segmentation_runs_lock = threading.Lock()
+
+
+def start_segmentation(video_id):
+    """Future of the background run segmenting `video_id`, started if needed.
+
+    A run that failed is replaced by a new one; a finished one is dropped,
+    since its segments are in segments_cache by then.
+    """
+    with _segmentation_runs_lock:
+        future = _segmentation_runs.get(video_id)
+        if future is None or (future.done() and future.exception() is not None):
+            future = _SEGMENTATION_EXECUTOR.submit(get_segments, video_id)
+            _segmentation_runs[video_id] = future
+            future.add_done_callback(functools.partial(_segmentation_done, video_id))
+    return future
+
+
+def _segmentation_done(video_id, future):
+    if future.exception() is not None:
+        return  # Kept, so the next poll reports the failure.
+    with _segmentation_runs_lock:
+        if _segmentation_runs.get(video_id) is future:
+            del _segmentation_runs[video_id]
+
+
+def get_segments_progress(video_id):
+    """Return (segments, complete) without waiting for the video.
+
+    Cached videos return immediately. Otherwise segmentation is started in
+    the background (or left running) and this returns the segments of the
+    contiguous prefix of windows finished so far, possibly none. Segment
+    indices in a prefix are stable: later windows only append, and may
+    extend the prefix's last segment. A failed run raises here, once; the
+    next call starts a new one.
+    """
+    segments = content_bundle.get_segments(video_id)
+    if segments is None:
+        segments = _cached_segments(video_id)
+    if segments is not None:
+        return segments, True
+
+    future = start_segmentation(video_id)
+    if future.done():
+        return future.result(), True
+    stored = _load_segment_windows(video_id)
+    prefix = []
+    if 0 in stored:
+        n_windows = stored[0][0]
+        while len(prefix) < n_windows and len(prefix) in stored:
+            prefix.append(stored[len(prefix)])
+    if not prefix:
+        return [], False
+    return (
+        _assemble_segments([items for _, _, items in prefix], prefix[-1][1]),
+        False,
+    )
 
 
 def get_summary_by_LO(transcript, learning_goal):
@@ -2581,62 +3027,76 @@ def get_summary_by_LO(transcript, learning_goal):
                                 ]
                             """,
         user_message=f"transcript: {transcript}, learning goals: {learning_goal}",
+        cache_site="segment-summary",
     )
     summary = _parse_llm_list(raw)
     formatted_list = [{"category": item[0], "summary": item[1]} for item in summary]
     return formatted_list
 
 
-def get_start_sentence(summary_list, transcript):
-    """Returns the start sentence of each summary in the transcript."""
-    for i, item in enumerate(summary_list):
-        if i != 0:
-            long_string = transcript
-            short_string = summary_list[i - 1]["start sentence"]
-
-            # Find the index of the short string
-            index = long_string.find(short_string)
+# Cues per alignment window. A summary describes the start of a stretch of
+# the video, so it is scored against the text of the few cues beginning at
+# each candidate cue rather than against a single (often 3-word) cue.
+ALIGN_WINDOW_CUES = 8
 
-            # Slice the long string from the end of the short string
-            if index != -1:
-                result_string = long_string[index + len(short_string) :]
-            else:
-                result_string = long_string  # or some error handling if the short string is not found
-        else:
-            result_string = transcript
-
-        sentence = llm_chat(
-            system_prompt=(
-                "Here is a transcript of the video about exploratory data "
-                "analysis and a summary of one paragraph of the video "
-                "transcript. Find the starting sentence in the given "
-                "transcript that corresponds to the summary. Don't add "
-                "punctuation or capitalization that are not in the original "
-                "transcript. Response only the first sentence."
-            ),
-            user_message=f"transcript: {result_string}, summary: {item['summary']}",
-        )
-        item["start sentence"] = sentence
 
-    start_sentence_list = []
-    for item in summary_list:
-        start_sentence_list.append(item["start sentence"])
-    return start_sentence_list
+def align_summaries_to_transcript(transcript_with_time, summary_list):
+    """Return the integer start time of each summary in the transcript.
 
+    Local replacement for the old per-summary "find the start sentence" LLM
+    calls plus the "find its timestamp" call. Each summary is compared with
+    a sliding window of cues by TF-IDF cosine similarity, and the starting
+    cues are chosen jointly (dynamic programming) to maximize total
+    similarity subject to appearing in the same order as the summaries,
+    which get_summary_by_LO already returns in video order.
+    """
+    cues = transcript_with_time
+    n = len(summary_list)
+    if n == 0 or not cues:
+        return [int(cues[0]["start"]) if cues else 0] * n
+    m = len(cues)
+    windows = [
+        " ".join(c["text"] for c in cues[j : j + ALIGN_WINDOW_CUES])
+        for j in range(m)
+    ]
+    summaries = [item["summary"] for item in summary_list]
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.metrics.pairwise import cosine_similarity
 
-def get_timestamp(transcript_with_time, start_sentence_list):
-    """Returns the start timestamp of each sentence in the start sentence list."""
-    raw = llm_chat(
-        system_prompt=(
-            "Here is a video transcript about exploratory data analysis and a "
-            "list of sentences. Find out the start timestamp corresponding to "
-            "each sentence. Response only in a list, for example: "
-            "[start timestamp 1, start timestamp 2, start timestamp 3, ...]"
-        ),
-        user_message=f"transcript: {transcript_with_time}, sentence list: {start_sentence_list}",
-    )
-    time = _parse_llm_list(raw)
-    return time
+    try:
+        matrix = TfidfVectorizer(stop_words="english", sublinear_tf=True).fit_transform(
+            windows + summaries
+        )
+        sim = cosine_similarity(matrix[m:], matrix[:m])
+    except ValueError:
+        # Empty vocabulary (e.g. a music-only stretch): spread evenly.
+        return [int(cues[(i * m) // n]["start"]) for i in range(n)]
+
+    # best[i][j]: best total for summaries 0..i with summary i at cue j.
+    # Starts are strictly increasing when there are enough cues, so two
+    # summaries never collapse onto one cue.
+    step = 1 if m >= n else 0
+    neg = float("-inf")
+    best = [[neg] * m for _ in range(n)]
+    back = [[0] * m for _ in range(n)]
+    best[0] = list(sim[0])
+    for i in range(1, n):
+        run_best, run_arg = neg, 0
+        for j in range(m):
+            k = j - step
+            if k >= 0 and best[i - 1][k] > run_best:
+                run_best, run_arg = best[i - 1][k], k
+            if step == 0 and best[i - 1][j] > run_best:
+                run_best, run_arg = best[i - 1][j], j
+            if run_best > neg:
+                best[i][j] = run_best + sim[i][j]
+                back[i][j] = run_arg
+    j = max(range(m), key=lambda col: best[n - 1][col])
+    starts = [0] * n
+    for i in range(n - 1, -1, -1):
+        starts[i] = j
+        j = back[i][j]
+    return [int(cues[j]["start"]) for j in starts]
 
 
 def merge_and_convert_to_integers(items):
@@ -2667,11 +3127,7 @@ def merge_and_convert_to_integers(items):
 def get_code_file(video_id):
     """Store the code file wrote by David in the video into database."""
     # Step 1: Check database first
-    initialze_database()
-    conn = sqlite3.connect("cache.db")
-    c = conn.cursor()
-    c.execute("SELECT * FROM code_cache WHERE video_id=?", (video_id,))
-    row = c.fetchone()
+    row = db.query_one("SELECT * FROM code_cache WHERE video_id=?", (video_id,))
     if row:
         return {"name": row[1], "download_url": row[2]}
 
@@ -2695,6 +3151,9 @@ def get_code_file(video_id):
     titles.append(youtube_title)
 
     # Vectorize the titles
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.metrics.pairwise import cosine_similarity
+
     vectorizer = TfidfVectorizer().fit_transform(titles)
 
     # Compute cosine similarity
@@ -2713,11 +3172,10 @@ def get_code_file(video_id):
     download_url = code_file["download_url"]
 
     # Step 2: Save to database
-    c.execute(
-        "INSERT INTO code_cache VALUES (?, ?, ?)", (video_id, file_name, download_url)
+    db.execute(
+        "INSERT OR REPLACE INTO code_cache VALUES (?, ?, ?)",
+        (video_id, file_name, download_url),
     )
-    conn.commit()
-    conn.close()
 
     return code_file
 
@@ -2743,62 +3201,133 @@ def get_notebook_content():
     return all_contents
 
 
-def get_video_segment(video_id, start_time=0, end_time=600):
-    """Returns the segments of the video transcript by learning goals."""
-    length = end_time - start_time
-    periods = math.ceil(length / 600)
-    results = []
-    # Segment the given video every 10-minute periods
-    for i in range(periods):
-        if i == 0:
-            transcript_with_time, transcript = get_transcript(video_id, 0, 600)
-            learning_goals = """
-                Introduction: Identify segments where David Robinson introduces himself, the project, and the dataset's theme, emphasizing the context and purpose of the analysis.
-                Load data/packages: Look for parts where he discusses accessing, downloading, and loading the dataset into the software, as well as importing necessary libraries or packages for the analysis.
-                Understand the dataset: Focus on segments where David examines the dataset for the first time, mentions data attributes, and talks about initial findings or hypotheses.
-                Visualize the data: Recognize parts where David talks about his intent to create visualizations, the process of making these plots, and the technical details of the visualization tools or methods he uses.
-                Interpret the chart: Look for segments where David analyzes and discusses the implications of the data visualizations, drawing conclusions, and theorizing about the underlying trends or patterns in the data.
-                Preprocess the data: Identify any actions taken to modify, clean, or transform the data to facilitate better analysis, such as creating new variables or adjusting the existing dataset for analysis.
-            """
-        else:
-            end = end_time if end_time <= (i + 1) * 600 else (i + 1) * 600
-            transcript_with_time, transcript = get_transcript(video_id, i * 600, end)
-            learning_goals = """
-                Visualize the data: Recognize parts where David talks about his intent to create visualizations, the process of making these plots, and the technical details of the visualization tools or methods he uses.
-                Interpret the chart: Look for segments where David analyzes and discusses the implications of the data visualizations, drawing conclusions, and theorizing about the underlying trends or patterns in the data.
-                Preprocess the data: Identify any actions taken to modify, clean, or transform the data to facilitate better analysis, such as creating new variables or adjusting the existing dataset for analysis.
-            """
-        summary_list = get_summary_by_LO(transcript, learning_goals)
-        start_sentence_list = get_start_sentence(summary_list, transcript)
-        time = get_timestamp(transcript_with_time, start_sentence_list)
-
-        for i, item in enumerate(summary_list):
-            if i != len(summary_list) - 1:
-                results.append(
-                    {"category": item["category"], "start": time[i], "end": time[i + 1]}
-                )
-            else:
-                results.append(
-                    {"category": item["category"], "start": time[i], "end": end_time}
-                )
+SEGMENT_WINDOW_SECONDS = 600
+# Windows of one video are segmented concurrently on their own pool. It must
+# not be _LLM_EXECUTOR: the caller holding the segmentation flight usually
+# runs there and waits on these windows.
+_SEGMENT_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("TUTORLY_SEGMENT_WORKERS", "4")),
+    thread_name_prefix="tutorly-segment",
+)
+
+
+def get_video_duration(video_id):
+    """Seconds up to the end of the transcript's last cue."""
+    data = _load_bundled_transcript(video_id)
+    if data is None:
+        from youtube_transcript_api import YouTubeTranscriptApi
+
+        data = YouTubeTranscriptApi().fetch(video_id).to_raw_data()
+    if not data:
+        return SEGMENT_WINDOW_SECONDS
+    last = max(data, key=lambda cue: cue["start"])
+    return int(math.ceil(last["start"] + last.get("duration", 0)))
+
+
+def _segment_window(video_id, window_index, start, end):
+    """Segment one 10-minute window: [{"category", "start", "end"}, ...]."""
+    transcript_with_time, transcript = get_transcript(video_id, start, end)
+    if window_index == 0:
+        learning_goals = """
+            Introduction: Identify segments where David Robinson introduces himself, the project, and the dataset's theme, emphasizing the context and purpose of the analysis.
+            Load data/packages: Look for parts where he discusses accessing, downloading, and loading the dataset into the software, as well as importing necessary libraries or packages for the analysis.
+            Understand the dataset: Focus on segments where David examines the dataset for the first time, mentions data attributes, and talks about initial findings or hypotheses.
+            Visualize the data: Recognize parts where David talks about his intent to create visualizations, the process of making these plots, and the technical details of the visualization tools or methods he uses.
+            Interpret the chart: Look for segments where David analyzes and discusses the implications of the data visualizations, drawing conclusions, and theorizing about the underlying trends or patterns in the data.
+            Preprocess the data: Identify any actions taken to modify, clean, or transform the data to facilitate better analysis, such as creating new variables or adjusting the existing dataset for analysis.
+        """
+    else:
+        learning_goals = """
+            Visualize the data: Recognize parts where David talks about his intent to create visualizations, the process of making these plots, and the technical details of the visualization tools or methods he uses.
+            Interpret the chart: Look for segments where David analyzes and discusses the implications of the data visualizations, drawing conclusions, and theorizing about the underlying trends or patterns in the data.
+            Preprocess the data: Identify any actions taken to modify, clean, or transform the data to facilitate better analysis, such as creating new variables or adjusting the existing dataset for analysis.
+        """
+    summary_list = get_summary_by_LO(transcript, learning_goals)
+    if not summary_list:
+        return []
+    time = align_summaries_to_transcript(transcript_with_time, summary_list)
+    return [
+        {
+            "category": item["category"],
+            "start": time[i],
+            "end": time[i + 1] if i + 1 < len(summary_list) else end,
+        }
+        for i, item in enumerate(summary_list)
+    ]
+
+
+def _assemble_segments(window_items, end_time):
+    """Concatenate windows (in order) into the final segment list."""
+    segments = merge_and_convert_to_integers(
+        [dict(item) for items in window_items for item in items]
+    )
+    # A merged-away item's span belongs to the segment before it, so each
+    # segment runs until the next one starts.
+    for i, segment in enumerate(segments):
+        segment["end"] = (
+            segments[i + 1]["start"] if i + 1 < len(segments) else int(end_time)
+        )
+    return segments
 
-    return merge_and_convert_to_integers(results)
+
+def get_video_segment(
+    video_id, start_time=0, end_time=None, done_windows=None, on_window=None
+):
+    """Returns the segments of the video transcript by learning goals.
+
+    The video (up to the end of its transcript unless `end_time` is given)
+    is cut into SEGMENT_WINDOW_SECONDS windows that are segmented
+    concurrently. `on_window(index, n_windows, window_end, items)` is called
+    from the worker as each window finishes; windows already in
+    `done_windows` ({index: items}) are not regenerated.
+    """
+    if end_time is None:
+        end_time = get_video_duration(video_id)
+    periods = max(1, math.ceil((end_time - start_time) / SEGMENT_WINDOW_SECONDS))
+    bounds = [
+        (
+            start_time + i * SEGMENT_WINDOW_SECONDS,
+            min(end_time, start_time + (i + 1) * SEGMENT_WINDOW_SECONDS),
+        )
+        for i in range(periods)
+    ]
+    done_windows = done_windows or {}
+
+    def run_window(i):
+        if i in done_windows:
+            return done_windows[i]
+        items = _segment_window(video_id, i, *bounds[i])
+        if on_window is not None:
+            on_window(i, periods, bounds[i][1], items)
+        return items
+
+    windows = list(_SEGMENT_EXECUTOR.map(run_window, range(periods)))
+    return _assemble_segments(windows, end_time)
 
 
 def get_knowledge(video_id, video_type, learning_obj, segment_index, code_block):
     """Get the knowledge from the video transcript and code block."""
+    knowledge = content_bundle.get_knowledge(video_id, segment_index)
+    if knowledge is not None:
+        return knowledge
+    return singleflight.run(
+        ("knowledge", video_id, segment_index),
+        lambda: _get_knowledge(
+            video_id, video_type, learning_obj, segment_index, code_block
+        ),
+    )
+
+
+def _get_knowledge(video_id, video_type, learning_obj, segment_index, code_block):
     segments_set = get_segments(video_id)
     segment = segments_set[segment_index]
-    conn = sqlite3.connect("cache.db")
-    c = conn.cursor()
-    c.execute(
+    row = db.query_one(
         "SELECT knowledge FROM knowledge_cache WHERE video_id = ? AND segment_index = ?",
         (
             video_id,
             segment_index,
         ),
     )
-    row = c.fetchone()
     if row:
         # Defensively re-parse the cached value. Older runs (under OpenAI)
         # stored a pure Python list literal; newer Gemini runs may have
@@ -2815,11 +3344,10 @@ def get_knowledge(video_id, video_type, learning_obj, segment_index, code_block)
             f"knowledge_cache row for {video_id}::{segment_index} is "
             f"empty/unparseable; regenerating."
         )
-        c.execute(
+        db.execute(
             "DELETE FROM knowledge_cache WHERE video_id = ? AND segment_index = ?",
             (video_id, segment_index),
         )
-        conn.commit()
 
     start_time = segment["start"]
     end_time = segment["end"]
@@ -2831,8 +3359,7 @@ def get_knowledge(video_id, video_type, learning_obj, segment_index, code_block)
     else:
         num = 4
     if code_block != "":
-        knowledge = llm_chat(
-            system_prompt=f"""The following {video_type} video transcript and the code block taught in the video are about a learning goal: {learning_obj}. Summarize the declarative and procedural knowledge in the video transcript and code block.
+        system_prompt = f"""The following {video_type} video transcript and the code block taught in the video are about a learning goal: {learning_obj}. Summarize the declarative and procedural knowledge in the video transcript and code block.
                                 The result should be summarized in one sentence of declarative knowledge, and no more than {num - 1} sentences of procedural knowledge, in the order in which it should be learned.
                                 Each knowledge should follow this format:
                                 Declarative knowledge: "The task is + [final goal] + using + [general method/tool] + and + [additional method/technique for enhancement]".
@@ -2846,12 +3373,10 @@ def get_knowledge(video_id, video_type, learning_obj, segment_index, code_block)
                                     'knowledge_2',
                                     ...
                                 ]
-                                """,
-            user_message=f"video transcript: {segment_transcript}, code block: {code_block}",
-        )
+                                """
+        user_message = f"video transcript: {segment_transcript}, code block: {code_block}"
     else:
-        knowledge = llm_chat(
-            system_prompt=f"""The following {video_type} video transcript is about a learning goal: {learning_obj}. Summarize the declarative and procedural knowledge in the video transcript.
+        system_prompt = f"""The following {video_type} video transcript is about a learning goal: {learning_obj}. Summarize the declarative and procedural knowledge in the video transcript.
                                     The result should be summarized in one sentence of procedural knowledge, and no more than {num - 1} sentences of declarative knowledge, in the order in which it should be learned.
                                     Each knowledge MUST begin with the literal label "Procedural knowledge:" or "Declarative knowledge:" so downstream logic can detect the type. Follow this format:
                                     Procedural knowledge: "To achieve/understand + [specific goal/outcome] + one need to + [general actions/processes] + [additional details] + and consider/use + [relevant factors/tools]." The [general actions/processes] should be quoted in a && sign.
@@ -2865,9 +3390,13 @@ def get_knowledge(video_id, video_type, learning_obj, segment_index, code_block)
                                         'Declarative knowledge: ...',
                                         ...
                                     ]
-                                """,
-            user_message=f"video transcript: {segment_transcript}",
-        )
+                                """
+        user_message = f"video transcript: {segment_transcript}"
+    knowledge = llm_chat(
+        system_prompt=system_prompt,
+        user_message=user_message,
+        cache_site="knowledge",
+    )
     # Parse FIRST so we never cache a value we couldn't decode.
     try:
         parsed = _parse_llm_list(knowledge)
@@ -2879,20 +3408,19 @@ def get_knowledge(video_id, video_type, learning_obj, segment_index, code_block)
     # permanently skip the segment's teaching ("no methods, proceed to next").
     # Caching only non-empty knowledge means a refresh/re-entry regenerates it.
     if not parsed:
+        # Same for the LLM response cache, or the retry would replay it.
+        llm_cache.forget(DEFAULT_GEMINI_MODEL, system_prompt, user_message, 0.7, None)
         print(
             f"⚠️  get_knowledge produced EMPTY knowledge for "
             f"{video_id}::{segment_index} ({learning_obj}); not caching so it "
             f"will be retried on the next request."
         )
-        conn.close()
         return parsed
 
-    c.execute(
-        "INSERT INTO knowledge_cache (video_id, segment_index, knowledge) VALUES (?, ?, ?)",
+    db.execute(
+        "INSERT OR REPLACE INTO knowledge_cache (video_id, segment_index, knowledge) VALUES (?, ?, ?)",
         (video_id, segment_index, repr(parsed)),
     )
-    conn.commit()
-    conn.close()
     return parsed
 
 
@@ -2995,42 +3523,20 @@ def _default_skill_state() -> dict:
 def init_bkt_params(uid: str) -> dict:
     """Load this user's BKT state from disk into a fresh dict.
 
-    Backward-compatible with the old persistence shape ({skill: float}) — any
-    legacy entry is rehydrated into the new {probMastery, n_observations}
-    shape with n_observations=0.
+    One bkt_skill_state row per skill; rubric scores live in rubric_events
+    and are not loaded, since nothing on the request path reads them back.
     """
-    conn = sqlite3.connect("cache.db")
-    c = conn.cursor()
-    c.execute(
-        "SELECT skills_probMastery FROM bkt_params_cache WHERE user_id = ?", (uid,)
+    rows = db.query_all(
+        "SELECT skill_id, prob_mastery, n_observations FROM bkt_skill_state WHERE user_id = ?",
+        (uid,),
     )
-    row = c.fetchone()
-    conn.close()
-    if row is None or not row[0]:
-        return {}
-    try:
-        stored = json.loads(row[0])
-    except (ValueError, TypeError):
-        return {}
-
-    bkt: dict = {}
-    for skill, value in stored.items():
-        if isinstance(value, dict):
-            entry = {
-                "probMastery": float(value.get("probMastery", 0.1)),
-                "n_observations": int(value.get("n_observations", 0)),
-            }
-            # Preserve any rubric history attached to this skill so the
-            # full audit trail survives reloads.
-            if "rubric_history" in value:
-                entry["rubric_history"] = list(value["rubric_history"])
-            bkt[skill] = entry
-        else:
-            # Legacy float-only entry.
-            bkt[skill] = {
-                "probMastery": float(value),
-                "n_observations": 0,
-            }
+    bkt = {
+        skill_id: {"probMastery": float(prob), "n_observations": int(n_obs)}
+        for skill_id, prob, n_obs in rows
+    }
+    # Marks the write-behind buffer has not flushed yet are newer than disk.
+    for (_, skill_id), state in BKT_WRITER.pending(lambda key: key[0] == uid).items():
+        bkt[skill_id] = dict(state)
     return bkt
 
 
@@ -3245,57 +3751,158 @@ def get_skill_by_knowledge(knowledge):
     return skill
 
 
-def bkt_params_to_database(uid: str, bkt_params: dict) -> None:
+def _write_bkt_rows(rows) -> None:
+    if not rows:
+        return
+    with db.transaction() as conn:
+        conn.executemany(
+            """
+            INSERT INTO bkt_skill_state (user_id, skill_id, prob_mastery, n_observations)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(user_id, skill_id) DO UPDATE SET
+                prob_mastery = excluded.prob_mastery,
+                n_observations = excluded.n_observations,
+                updated_at = CURRENT_TIMESTAMP
+            """,
+            rows,
+        )
+
+
+def bkt_params_to_database(uid: str, bkt_params: dict, skill_ids=None) -> None:
     """Store the updated BKT state for a user.
 
-    T1.4: persist the full per-skill state ({probMastery, n_observations}),
-    not just probMastery. Backward compatible with the old float-only schema:
-    legacy rows are upgraded in place on first write.
+    Upserts one bkt_skill_state row per skill in `skill_ids` (default: every
+    skill in `bkt_params`). Callers pass just the skill an observation
+    touched, so a write costs O(1) rather than rewriting the whole profile.
+    Request handlers go through mark_bkt_dirty() instead.
     """
-    serialized = {}
-    for skill_id, value in bkt_params.items():
-        entry = {
-            "probMastery": float(value["probMastery"]),
-            "n_observations": int(value.get("n_observations", 0)),
-        }
-        if value.get("rubric_history"):
-            entry["rubric_history"] = list(value["rubric_history"])
-        serialized[skill_id] = entry
-    conn = sqlite3.connect("cache.db")
-    c = conn.cursor()
-    c.execute(
-        "SELECT skills_probMastery FROM bkt_params_cache WHERE user_id = ?",
-        (uid,),
+    if skill_ids is None:
+        skill_ids = list(bkt_params)
+    _write_bkt_rows(
+        [
+            (
+                uid,
+                skill_id,
+                float(bkt_params[skill_id]["probMastery"]),
+                int(bkt_params[skill_id].get("n_observations", 0)),
+            )
+            for skill_id in skill_ids
+            if skill_id in bkt_params
+        ]
     )
-    row = c.fetchone()
-    if row is None:
-        c.execute(
-            "INSERT INTO bkt_params_cache (user_id, skills_probMastery) VALUES (?, ?)",
-            (uid, json.dumps(serialized)),
+
+
+# Write-behind for BKT state: handlers mark skills dirty and a background
+# thread upserts them in one transaction every BKT_FLUSH_INTERVAL seconds
+# (sooner once BKT_FLUSH_MAX_DIRTY skills are waiting). Flushed on session
+# end and at interpreter exit; the redo log covers a crash in between.
+BKT_FLUSH_INTERVAL = float(os.environ.get("TUTORLY_BKT_FLUSH_INTERVAL", "0.3"))
+BKT_FLUSH_MAX_DIRTY = int(os.environ.get("TUTORLY_BKT_FLUSH_MAX_DIRTY", "64"))
+
+
+def _flush_bkt_entries(entries: dict) -> None:
+    _write_bkt_rows(
+        [
+            (uid, skill_id, float(state["probMastery"]), int(state["n_observations"]))
+            for (uid, skill_id), state in entries.items()
+        ]
+    )
+
+
+BKT_WRITER = write_behind.WriteBehind(
+    _flush_bkt_entries,
+    redo_path=os.environ.get("TUTORLY_BKT_REDO_LOG", "bkt_redo.log"),
+    interval=BKT_FLUSH_INTERVAL,
+    max_dirty=BKT_FLUSH_MAX_DIRTY,
+)
+atexit.register(BKT_WRITER.close)
+
+
+def mark_bkt_dirty(uid: str, bkt_params: dict, skill_ids) -> None:
+    """Queue `skill_ids` of this user's BKT state for the next flush."""
+    for skill_id in skill_ids:
+        state = bkt_params[skill_id]
+        BKT_WRITER.mark(
+            (uid, skill_id),
+            {
+                "probMastery": float(state["probMastery"]),
+                "n_observations": int(state.get("n_observations", 0)),
+            },
         )
-    else:
-        try:
-            existing = json.loads(row[0]) if row[0] else {}
-        except (ValueError, TypeError):
-            existing = {}
-        # Upgrade any legacy float entries to the new dict shape so the file
-        # is self-consistent after this write.
-        merged: dict = {}
-        for skill_id, value in existing.items():
-            if isinstance(value, dict):
-                merged[skill_id] = value
-            else:
-                merged[skill_id] = {
-                    "probMastery": float(value),
-                    "n_observations": 0,
-                }
-        merged.update(serialized)
-        c.execute(
-            "UPDATE bkt_params_cache SET skills_probMastery = ? WHERE user_id = ?",
-            (json.dumps(merged), uid),
+
+
+def recover_bkt_writes() -> int:
+    """Replay BKT writes a crashed server left in the redo log."""
+    return BKT_WRITER.recover()
+
+
+# The in-flight teaching sequence (cur_seq plus the practice-item buffers
+# the next UpdateBKT reads) is checkpointed to teaching_state, one small row
+# per user, every time it advances. A session created after a restart picks
+# it up again (see _create_session), so the student resumes at the same move
+# for one SQLite read instead of a re-plan through the LLM.
+TEACHING_STATE_FIELDS = (
+    "cur_seq",
+    "skill_id_buffer",
+    "interaction_buffer",
+    "code_line_buffer",
+    "code_line_blanks_buffer",
+    "correct_answer_buffer",
+    "taught_lines_key",
+    "taught_lines",
+)
+
+
+def _flush_teaching_states(entries: dict) -> None:
+    with db.transaction() as conn:
+        conn.executemany(
+            """
+            INSERT INTO teaching_state (user_id, state) VALUES (?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                state = excluded.state,
+                updated_at = CURRENT_TIMESTAMP
+            """,
+            [(uid, json.dumps(state)) for (uid,), state in entries.items()],
         )
-    conn.commit()
-    conn.close()
+
+
+TEACHING_WRITER = write_behind.WriteBehind(
+    _flush_teaching_states,
+    redo_path=os.environ.get("TUTORLY_TEACHING_REDO_LOG", "teaching_redo.log"),
+    interval=BKT_FLUSH_INTERVAL,
+    max_dirty=BKT_FLUSH_MAX_DIRTY,
+)
+atexit.register(TEACHING_WRITER.close)
+
+
+def checkpoint_teaching_state(uid: str, session: dict) -> None:
+    """Queue a snapshot of this user's teaching sequence for the next flush."""
+    state = {field: session[field] for field in TEACHING_STATE_FIELDS}
+    state["cur_seq"] = [dict(move) for move in session["cur_seq"]]
+    state["taught_lines"] = sorted(session["taught_lines"])
+    TEACHING_WRITER.mark((uid,), state)
+
+
+def load_teaching_state(uid: str):
+    """The last checkpointed teaching state for `uid`, or None."""
+    pending = TEACHING_WRITER.pending(lambda key: key[0] == uid)
+    if pending:
+        return pending[(uid,)]
+    row = db.query_one("SELECT state FROM teaching_state WHERE user_id = ?", (uid,))
+    return json.loads(row[0]) if row is not None else None
+
+
+def recover_teaching_writes() -> int:
+    """Replay teaching-state checkpoints a crashed server left in the redo log."""
+    return TEACHING_WRITER.recover()
+
+
+def record_rubric_event(uid: str, skill_id: str, record: dict) -> None:
+    """Append one articulation rubric result to rubric_events."""
+    db.execute(
+        "INSERT INTO rubric_events (user_id, skill_id, created_at, record) VALUES (?, ?, ?, ?)",
+        (uid, skill_id, record["timestamp"], json.dumps(record)),
+    )
 
 
 def parse_function_in_code(code_block):
@@ -3342,76 +3949,66 @@ def get_function_attribute_by_segment(video_id, segment_index, code_json):
 
 def get_code_with_blank(video_id, segment_index, code_json):
     """Get the code block with blanks for the given video segment."""
-    initialze_database()
-    conn = sqlite3.connect("cache.db")
-    c = conn.cursor()
-    c.execute(
-        "SELECT code_with_blanks FROM code_block_cache WHERE video_id = ? AND segment_index = ?",
-        (video_id, segment_index),
+    code_with_blanks = content_bundle.get_code_with_blanks(video_id, segment_index)
+    if code_with_blanks is not None:
+        return code_with_blanks
+    return singleflight.run(
+        ("code-with-blank", video_id, segment_index),
+        lambda: _get_code_with_blank(video_id, segment_index, code_json),
     )
-    row = c.fetchone()
-    if row:
-        return row[0]
-    # get the code block
+
+
+def _get_code_with_blank(video_id, segment_index, code_json):
+    # The terms are blanked locally, token by token, on the segment's code
+    # index (code_index.CodeSegmentIndex.blank), keeping the block's lines
+    # one for one. Only terms it finds nowhere in the code go to the LLM.
     function_attribute = get_function_attribute_by_segment(
         video_id, segment_index, code_json
     )
-    code_block = code_json[str(segment_index)]
-    print("functions_attributes_to_learn:", function_attribute)
-    # get the code with blank
-    code_with_blanks = llm_chat(
+    index = get_code_index(video_id, segment_index, code_json)
+    code_with_blanks, missing = index.blank(function_attribute)
+    if not missing:
+        return code_with_blanks
+    row = db.query_one(
+        "SELECT code_with_blanks FROM code_block_cache WHERE video_id = ? AND segment_index = ?",
+        (video_id, segment_index),
+    )
+    if row and row[0]:
+        return row[0]
+    print("functions_attributes_to_learn not found in the code:", missing)
+    llm_blanks = llm_chat(
         system_prompt="""Use the given code block, make all the designated functions and attributes to be blanks in the code as blanks.
+                            Some blanks '___' are already in the code block; keep them as they are.
                             You should not make code that is not in the designated functions and attributes to be blanks.
                             The code blanks should only be the items in the functions/attributes to learn so that students can use the items to fill in the blanks.
                             Adjusts the range of blanks according to the format of the items in the given functions/attributes to learn list.
                             If the item in functions/attributes to learn is a single function or attribute, such as 'geom_boxplot' or 'median', then make this function place a blank.
                             If the item in functions/attributes to learn is a function with attributes as a whole, such as 'aes(median)', then make this function with the attribute place a whole blank.
                             If the item in functions/attributes to learn is a parameter in a function, such as 'labels = dollar_format()', then make this whole as a blank.
+                            Do not add, remove, join or split lines.
                             You should not respond with any comments or explanations.
                             Each blank should be exactly an underscore consisting of three short underscores '___'.
                             Respond in the following format: ```{{r code with blanks}}```
                             """,
-        user_message=f"functions/attributes to learn: {str(function_attribute)}, code block: {str(code_block)}",
+        user_message=f"functions/attributes to learn: {str(missing)}, code block: {code_with_blanks}",
+        cache_site="code-with-blank",
     )
-    c.execute(
-        "UPDATE code_block_cache SET code_with_blanks = ? WHERE video_id = ? AND segment_index = ?",
-        (code_with_blanks, video_id, segment_index),
+    # Fill-in-blanks items pair line i of the blanked block with line i of
+    # the source, so an answer that moved lines is not used.
+    if len(llm_blanks.split("\n")) == len(code_with_blanks.split("\n")):
+        code_with_blanks = llm_blanks
+    else:
+        print(
+            f"⚠️  Blanked code for {video_id} segment {segment_index} changed "
+            "its line count; keeping the local blanks"
+        )
+    db.execute(
+        "INSERT OR REPLACE INTO code_block_cache (video_id, segment_index, code_with_blanks) VALUES (?, ?, ?)",
+        (video_id, segment_index, code_with_blanks),
     )
-    conn.commit()
-    conn.close()
     return code_with_blanks
 
 
-# Scoring one quoted term against one line:
-#  * CALL (`filter(`)        — the strongest signal the line does that action
-#  * DEFINITION (`x = ...`)  — where a variable is created (vs merely used)
-#  * MENTION (`x` anywhere)  — a weak signal; the variable is referenced
-# A single `=` after the term is a definition, but `==`, `>=`, `<=` are not,
-# so those are excluded (e.g. `species == "Dog"` mentions `species`, it does
-# not define it).
-_CALL_WEIGHT = 3
-_DEFINITION_WEIGHT = 2
-_MENTION_WEIGHT = 1
-
-
-def _term_score(term, line):
-    """Score one quoted term against one code line (call > definition > mention)."""
-    if not term:
-        return 0
-    escaped = re.escape(term)
-    if re.search(rf"\b{escaped}\s*\(", line):
-        return _CALL_WEIGHT
-    if re.search(rf"\b{escaped}\s*(?:=(?!=)|<-)", line):
-        return _DEFINITION_WEIGHT
-    if re.search(rf"\b{escaped}\b", line):
-        return _MENTION_WEIGHT
-    return 0
-
-
-def _paren_balance(line):
-    return line.count("(") - line.count(")")
-
-
 def _statement_head(code_lines, anchor):
     """Walk up from `anchor` to the line that starts its statement.
 
@@ -3430,12 +4027,14 @@ def _statement_head(code_lines, anchor):
     return i
 
 
-def _find_code_line_indices(code_lines, knowledge, used_lines=None):
+def _find_code_line_indices(index, knowledge, used_lines=None):
     """Find the code-line index/indices for a knowledge item DETERMINISTICALLY.
 
     The knowledge string names the relevant functions/attributes in single
     quotes (e.g. 'filter', 'name_breed_counts'), and those appear verbatim in
-    the code — so we match by scoring instead of making an LLM call.
+    the code — so we match by scoring instead of making an LLM call. Each
+    term is scored against the segment's lines with code_index's call >
+    definition > mention rules, looked up in its CodeSegmentIndex.
 
     Returns ONE coherent statement, never two lines from different parts of
     the code:
@@ -3450,40 +4049,32 @@ def _find_code_line_indices(code_lines, knowledge, used_lines=None):
     Falls back to [0] if nothing matches.
     """
     attrs = [a for a in get_function_attribute_by_knowledge(knowledge) if a]
-    if not code_lines:
+    if not index.lines:
         return []
     if not attrs:
         return [0]
     used = used_lines or set()
-    base = [sum(_term_score(a, line) for a in attrs) for line in code_lines]
-    if not any(base):
+    # line index -> summed score, for the lines some term scores on.
+    base = {}
+    for attr in attrs:
+        for i, score in index.term_lines(attr).items():
+            base[i] = base.get(i, 0) + score
+    if not base:
         return [0]
     # Proximity bonus: a scoring line gets credit when one of the knowledge's
     # terms sits on an immediately adjacent (piped) line — this is what pulls
     # the `filter` next to `name_breed_counts %>%` ahead of a lookalike filter.
-    total = list(base)
-    for i in range(len(code_lines)):
-        if base[i] == 0:
-            continue
-        for j in (i - 1, i + 1):
-            if 0 <= j < len(code_lines) and any(
-                _term_score(a, code_lines[j]) for a in attrs
-            ):
-                total[i] += 1
-    order = sorted(
-        (i for i in range(len(code_lines)) if base[i] > 0),
-        key=lambda i: (i in used, -total[i], i),
-    )
-    anchor = order[0]
+    total = {i: score + (i - 1 in base) + (i + 1 in base) for i, score in base.items()}
+    anchor = min(base, key=lambda i: (i in used, -total[i], i))
     # Extend downward to balance the anchor statement's parentheses.
     block = [anchor]
-    bal = _paren_balance(code_lines[anchor])
+    bal = index.paren_balance[anchor]
     j = anchor + 1
-    while bal > 0 and j < len(code_lines):
+    while bal > 0 and j < len(index.lines):
         block.append(j)
-        bal += _paren_balance(code_lines[j])
+        bal += index.paren_balance[j]
         j += 1
-    return sorted(block)
+    return block
 
 
 def get_code_line_by_step(
@@ -3496,12 +4087,11 @@ def get_code_line_by_step(
     get_code_with_blank LLM call and the line-count mismatch that the blanked
     path can hit.
     """
-    code_block = code_json[str(segment_index)]
-    code_lines = code_block.split("\\n")[1:-1]
-    line_index = _find_code_line_indices(code_lines, knowledge, used_lines)
+    index = get_code_index(video_id, segment_index, code_json)
+    line_index = _find_code_line_indices(index, knowledge, used_lines)
     if used_lines is not None:
         used_lines.update(line_index)
-    return "\n".join(code_lines[i] for i in line_index)
+    return "\n".join(index.lines[i] for i in line_index)
 
 
 def get_code_with_blank_by_step(
@@ -3517,15 +4107,16 @@ def get_code_with_blank_by_step(
     doesn't affect answer scoring.
     """
     code_with_blanks = get_code_with_blank(video_id, segment_index, code_json)
-    code_block = code_json[str(segment_index)]
-    code_lines = code_block.split("\\n")[1:-1]
+    index = get_code_index(video_id, segment_index, code_json)
+    code_lines = index.lines
     code_lines_with_blanks = code_with_blanks.split("\n")[1:-1]
-    # Clamp to indices valid for BOTH lists — the blanked version is
-    # LLM-generated and may have a different line count than the original.
+    # Clamp to indices valid for BOTH lists — blanks from the content bundle
+    # or an older cache.db may be LLM-generated, with a different line count
+    # than the original.
     max_idx = min(len(code_lines), len(code_lines_with_blanks))
     line_index = [
         i
-        for i in _find_code_line_indices(code_lines, knowledge, used_lines)
+        for i in _find_code_line_indices(index, knowledge, used_lines)
         if i < max_idx
     ]
     if not line_index and max_idx > 0:
@@ -3573,7 +4164,6 @@ def get_user_condition(user_id):
 
     Returns: condition string
     """
-    initialze_database()
     conditions = ["control", "quiz", "fixed_cogapp", "full_coggen"]
 
     # 0. Test users: pinned condition by prefix — checked BEFORE the cache so
@@ -3588,16 +4178,12 @@ def get_user_condition(user_id):
         if user_id.startswith(prefix):
             return cond
 
-    conn = sqlite3.connect("cache.db")
-    c = conn.cursor()
-
     # 1. Already assigned for this (real) user → stable, return it.
-    c.execute("SELECT condition FROM user_conditions WHERE user_id = ?", (user_id,))
-    row = c.fetchone()
+    row = db.query_one(
+        "SELECT condition FROM user_conditions WHERE user_id = ?", (user_id,)
+    )
     if row:
-        condition = row[0]
-        conn.close()
-        return condition
+        return row[0]
 
     condition = None
 
@@ -3616,17 +4202,28 @@ def get_user_condition(user_id):
         )
 
     # Cache locally so repeat lookups for this user are fast and stable.
-    c.execute(
-        "INSERT INTO user_conditions (user_id, condition) VALUES (?, ?)",
+    # OR IGNORE: a concurrent first request may have cached it already.
+    db.execute(
+        "INSERT OR IGNORE INTO user_conditions (user_id, condition) VALUES (?, ?)",
         (user_id, condition),
     )
-    conn.commit()
-    conn.close()
 
     print(f"Assigned condition '{condition}' to user '{user_id}'")
     return condition
 
 
+def set_user_condition(user_id, condition):
+    """Pin a user's condition, overriding any earlier assignment."""
+    db.execute(
+        """
+        INSERT INTO user_conditions (user_id, condition)
+        VALUES (?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET condition = ?
+    """,
+        (user_id, condition, condition),
+    )
+
+
 # ---------------------------------------------------------------------------
 # Survey completion codes.
 #
@@ -3724,19 +4321,15 @@ def verify_survey_code(stage: str, code: str, questionnaire_id=None):
 
 def get_pretest_status(user_id):
     """Get pre-test completion status for a user."""
-    initialze_database()
-    conn = sqlite3.connect("cache.db")
-    c = conn.cursor()
-
-    c.execute(
+    row = db.query_one(
         "SELECT latin_order FROM questionnaire_progress WHERE user_id = ?",
         (user_id,),
     )
-    if c.fetchone() is None:
+    if row is None:
         order = get_latin_square_order(user_id)
-        c.execute(
+        db.execute(
             """
-            INSERT INTO questionnaire_progress (
+            INSERT OR IGNORE INTO questionnaire_progress (
                 user_id,
                 pretest_completed,
                 pretest_completed_at,
@@ -3750,14 +4343,11 @@ def get_pretest_status(user_id):
             """,
             (user_id, json.dumps(order), get_video_assignment_order(user_id)[0]),
         )
-        conn.commit()
 
-    c.execute(
+    row = db.query_one(
         "SELECT pretest_completed, pretest_completed_at FROM questionnaire_progress WHERE user_id = ?",
         (user_id,),
     )
-    row = c.fetchone()
-    conn.close()
 
     if row is None:
         return {"pretestCompleted": False, "pretestCompletedAt": None}
@@ -3770,12 +4360,9 @@ def get_pretest_status(user_id):
 
 def mark_pretest_complete(user_id):
     """Mark pre-test as completed for a user."""
-    initialze_database()
-    conn = sqlite3.connect("cache.db")
-    c = conn.cursor()
     completed_at = datetime.datetime.utcnow().isoformat()
     order = get_latin_square_order(user_id)
-    c.execute(
+    db.execute(
         """
         INSERT INTO questionnaire_progress (
             user_id,
@@ -3805,8 +4392,6 @@ def mark_pretest_complete(user_id):
             get_video_assignment_order(user_id)[0],
         ),
     )
-    conn.commit()
-    conn.close()
     return {"pretestCompleted": True, "pretestCompletedAt": completed_at}
 
 
@@ -3827,10 +4412,7 @@ def get_video_assignment_order(user_id):
 
 def get_or_create_questionnaire_progress(user_id):
     """Load questionnaire progress and initialize a row if missing."""
-    initialze_database()
-    conn = sqlite3.connect("cache.db")
-    c = conn.cursor()
-    c.execute(
+    row = db.query_one(
         """
         SELECT pretest_completed, pretest_completed_at, latin_order, posttest_index, completed_videos, finished_videos, assigned_video_id
         FROM questionnaire_progress
@@ -3838,13 +4420,12 @@ def get_or_create_questionnaire_progress(user_id):
         """,
         (user_id,),
     )
-    row = c.fetchone()
 
     if row is None:
         latin_order = get_latin_square_order(user_id)
-        c.execute(
+        db.execute(
             """
-            INSERT INTO questionnaire_progress (
+            INSERT OR IGNORE INTO questionnaire_progress (
                 user_id,
                 pretest_completed,
                 pretest_completed_at,
@@ -3858,7 +4439,6 @@ def get_or_create_questionnaire_progress(user_id):
             """,
             (user_id, json.dumps(latin_order), get_video_assignment_order(user_id)[0]),
         )
-        conn.commit()
         progress = {
             "pretest_completed": False,
             "pretest_completed_at": None,
@@ -3886,7 +4466,7 @@ def get_or_create_questionnaire_progress(user_id):
             or finished_videos != raw_finished_videos
             or assigned_video_id != row[6]
         ):
-            c.execute(
+            db.execute(
                 """
                 UPDATE questionnaire_progress
                 SET completed_videos = ?, finished_videos = ?, assigned_video_id = ?
@@ -3899,7 +4479,6 @@ def get_or_create_questionnaire_progress(user_id):
                     user_id,
                 ),
             )
-            conn.commit()
 
         progress = {
             "pretest_completed": bool(row[0]),
@@ -3911,7 +4490,6 @@ def get_or_create_questionnaire_progress(user_id):
             "assigned_video_id": assigned_video_id,
         }
 
-    conn.close()
     return progress
 
 
@@ -3926,14 +4504,10 @@ def get_assigned_video_for_user(user_id):
     )
     study_completed = next_video_id is None
 
-    conn = sqlite3.connect("cache.db")
-    c = conn.cursor()
-    c.execute(
+    db.execute(
         "UPDATE questionnaire_progress SET assigned_video_id = ? WHERE user_id = ?",
         (next_video_id, user_id),
     )
-    conn.commit()
-    conn.close()
 
     return {
         "videoId": next_video_id,
@@ -3952,14 +4526,10 @@ def mark_video_finished(user_id, video_id):
     if video_id and video_id not in finished_videos:
         finished_videos.append(video_id)
 
-    conn = sqlite3.connect("cache.db")
-    c = conn.cursor()
-    c.execute(
+    db.execute(
         "UPDATE questionnaire_progress SET finished_videos = ? WHERE user_id = ?",
         (json.dumps(finished_videos), user_id),
     )
-    conn.commit()
-    conn.close()
 
     return {"finishedVideos": finished_videos}
 
@@ -4048,9 +4618,7 @@ def mark_posttest_complete(user_id, video_id):
     else:
         next_index = progress["posttest_index"]
 
-    conn = sqlite3.connect("cache.db")
-    c = conn.cursor()
-    c.execute(
+    db.execute(
         """
         UPDATE questionnaire_progress
         SET posttest_index = ?, completed_videos = ?, finished_videos = ?
@@ -4063,8 +4631,6 @@ def mark_posttest_complete(user_id, video_id):
             user_id,
         ),
     )
-    conn.commit()
-    conn.close()
 
     return {
         "posttestIndex": next_index,
@@ -4076,11 +4642,11 @@ class GetConditionHandler(APIHandler):
     """Handler to get a user's assigned condition"""
 
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         data = self.get_json_body()
         user_id = data.get("userId", "unknown")
 
-        condition = get_user_condition(user_id)
+        condition = await run_blocking(get_user_condition, user_id)
 
         self.finish(json.dumps({"userId": user_id, "condition": condition}))
 
@@ -4089,7 +4655,7 @@ class SetConditionHandler(APIHandler):
     """Handler to manually set a user's condition (for testing or manual assignment)"""
 
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         data = self.get_json_body()
         user_id = data.get("userId", "unknown")
         condition = data.get("condition", "full_coggen")
@@ -4105,21 +4671,7 @@ class SetConditionHandler(APIHandler):
             )
             return
 
-        conn = sqlite3.connect("cache.db")
-        c = conn.cursor()
-
-        # Insert or update condition
-        c.execute(
-            """
-            INSERT INTO user_conditions (user_id, condition)
-            VALUES (?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET condition = ?
-        """,
-            (user_id, condition, condition),
-        )
-
-        conn.commit()
-        conn.close()
+        await run_blocking(set_user_condition, user_id, condition)
 
         self.finish(
             json.dumps(
@@ -4136,11 +4688,11 @@ class GetPretestStatusHandler(APIHandler):
     """Handler to get a user's pre-test completion status"""
 
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         data = self.get_json_body()
         user_id = data.get("userId", "unknown")
 
-        status = get_pretest_status(user_id)
+        status = await run_blocking(get_pretest_status, user_id)
         self.finish(
             json.dumps(
                 {
@@ -4162,7 +4714,7 @@ class MarkPretestCompleteHandler(APIHandler):
     """
 
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         data = self.get_json_body()
         user_id = data.get("userId", "unknown")
         session_id = data.get("sessionId", "login")
@@ -4170,7 +4722,8 @@ class MarkPretestCompleteHandler(APIHandler):
 
         verified, message = verify_survey_code("pretest", code)
 
-        firebase_logger.log_interaction(
+        await run_blocking(
+            firebase_logger.log_interaction,
             user_id=user_id,
             session_id=session_id,
             interaction_type="survey_code_attempt",
@@ -4194,7 +4747,7 @@ class MarkPretestCompleteHandler(APIHandler):
             )
             return
 
-        status = mark_pretest_complete(user_id)
+        status = await run_blocking(mark_pretest_complete, user_id)
         self.finish(
             json.dumps(
                 {
@@ -4212,10 +4765,10 @@ class GetAssignedVideoHandler(APIHandler):
     """Handler to get user's backend-assigned video id"""
 
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         data = self.get_json_body()
         user_id = data.get("userId", "unknown")
-        assignment = get_assigned_video_for_user(user_id)
+        assignment = await run_blocking(get_assigned_video_for_user, user_id)
         self.finish(
             json.dumps(
                 {
@@ -4230,12 +4783,12 @@ class MarkVideoFinishedHandler(APIHandler):
     """Handler to mark a full video learning session as finished"""
 
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         data = self.get_json_body()
         user_id = data.get("userId", "unknown")
         video_id = data.get("videoId", "")
 
-        status = mark_video_finished(user_id, video_id)
+        status = await run_blocking(mark_video_finished, user_id, video_id)
         self.finish(
             json.dumps(
                 {
@@ -4252,10 +4805,10 @@ class GetStudyProgressHandler(APIHandler):
     """Handler to retrieve study progress for UserIDDialog"""
 
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         data = self.get_json_body()
         user_id = data.get("userId", "unknown")
-        status = get_study_progress(user_id)
+        status = await run_blocking(get_study_progress, user_id)
         self.finish(json.dumps({"userId": user_id, **status}))
 
 
@@ -4263,12 +4816,12 @@ class GetNextPosttestHandler(APIHandler):
     """Handler to get the next post-test after finishing a video session"""
 
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         data = self.get_json_body()
         user_id = data.get("userId", "unknown")
         video_id = data.get("videoId", "")
 
-        status = get_next_posttest_for_user(user_id, video_id)
+        status = await run_blocking(get_next_posttest_for_user, user_id, video_id)
         self.finish(
             json.dumps(
                 {
@@ -4291,14 +4844,14 @@ class MarkPosttestCompleteHandler(APIHandler):
     """
 
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         data = self.get_json_body()
         user_id = data.get("userId", "unknown")
         video_id = data.get("videoId", "")
         session_id = data.get("sessionId", "login")
         code = data.get("code", "")
 
-        progress = get_or_create_questionnaire_progress(user_id)
+        progress = await run_blocking(get_or_create_questionnaire_progress, user_id)
         already_completed = normalize_video_id(video_id) in progress["completed_videos"]
 
         if already_completed:
@@ -4333,7 +4886,8 @@ class MarkPosttestCompleteHandler(APIHandler):
         questionnaire_id = progress["latin_order"][progress["posttest_index"]]
         verified, message = verify_survey_code("posttest", code, questionnaire_id)
 
-        firebase_logger.log_interaction(
+        await run_blocking(
+            firebase_logger.log_interaction,
             user_id=user_id,
             session_id=session_id,
             interaction_type="survey_code_attempt",
@@ -4359,7 +4913,7 @@ class MarkPosttestCompleteHandler(APIHandler):
             )
             return
 
-        status = mark_posttest_complete(user_id, video_id)
+        status = await run_blocking(mark_posttest_complete, user_id, video_id)
         self.finish(
             json.dumps(
                 {
@@ -4377,17 +4931,18 @@ class LogSessionStartHandler(APIHandler):
     """Handler for logging session start to Firebase"""
 
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         data = self.get_json_body()
         user_id = data.get("userId", "unknown")
         session_id = data.get("sessionId", "unknown")
         video_id = data.get("videoId", None)
 
         # Get user's condition and log it
-        condition = get_user_condition(user_id)
+        condition = await run_blocking(get_user_condition, user_id)
 
         # Log session start to Firebase
-        firebase_logger.log_session_start(
+        await run_blocking(
+            firebase_logger.log_session_start,
             user_id=user_id,
             session_id=session_id,
             user_metadata={
@@ -4413,14 +4968,23 @@ class LogSessionEndHandler(APIHandler):
     """
 
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         data = self.get_json_body()
         user_id = data.get("userId", "unknown")
         session_id = data.get("sessionId", "unknown")
         video_id = data.get("videoId", None)
         reason = data.get("reason", "unload")
 
-        firebase_logger.log_session_end(
+        # Land the last BKT update and teaching checkpoint now rather than
+        # on the next timer tick; the redo logs still cover a failure.
+        for name, writer in (("BKT", BKT_WRITER), ("Teaching state", TEACHING_WRITER)):
+            try:
+                await run_blocking(writer.flush)
+            except Exception as exc:
+                print(f"Warning: {name} flush at session end failed: {exc}")
+
+        await run_blocking(
+            firebase_logger.log_session_end,
             user_id=user_id,
             session_id=session_id,
             session_summary={
@@ -4439,7 +5003,7 @@ class LogCodeExecutionHandler(APIHandler):
     """Handler for logging code execution to Firebase"""
 
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         data = self.get_json_body()
         user_id = data.get("userId", "unknown")
         session_id = data.get("sessionId", "unknown")
@@ -4453,7 +5017,8 @@ class LogCodeExecutionHandler(APIHandler):
         segment_index = data.get("segmentIndex", None)
 
         # Log code execution to Firebase
-        firebase_logger.log_code_execution(
+        await run_blocking(
+            firebase_logger.log_code_execution,
             user_id=user_id,
             session_id=session_id,
             code=code,
@@ -4471,10 +5036,61 @@ class LogCodeExecutionHandler(APIHandler):
         )
 
 
+def _llm_cache_stats() -> dict:
+    cache = llm_cache.get_cache()
+    stats = cache.stats() if cache is not None else {}
+    for counts in stats.values():
+        lookups = counts["hits"] + counts["misses"]
+        counts["hit_ratio"] = counts["hits"] / lookups if lookups else 0.0
+    return stats
+
+
+metrics.register_stats("tutorly_llm_cache", _llm_cache_stats, label="site")
+metrics.register_stats("tutorly_prefetch", MOVE_PREFETCHER.stats)
+metrics.register_stats("tutorly_bkt_writer", BKT_WRITER.stats)
+metrics.register_stats("tutorly_teaching_writer", TEACHING_WRITER.stats)
+metrics.register_stats("tutorly_firebase_pipeline", firebase_logger.pipeline_stats)
+metrics.register_stats("tutorly_chat_prompt", chat_prompt_stats)
+metrics.register_stats("tutorly_sessions", USER_SESSIONS.stats)
+
+
+# Not an APIHandler: that forces a JSON Content-Type on every response.
+class MetricsHandler(JupyterHandler):
+    @tornado.web.authenticated
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.finish(metrics.render())
+
+
+def _observe_request(handler) -> None:
+    # Only this extension's routes; the rest of jupyter_server is not ours.
+    if type(handler).__module__ != __name__:
+        return
+    name = type(handler).__name__
+    metrics.observe(
+        "tutorly_http_request_seconds", handler.request.request_time(), handler=name
+    )
+    metrics.inc(
+        "tutorly_http_requests_total", handler=name, status=str(handler.get_status())
+    )
+
+
 def setup_handlers(web_app):
     host_pattern = ".*$"
     base_url = web_app.settings["base_url"]
 
+    # Time every request through the app's per-request log hook, which
+    # jupyter_server always sets (to its access-log writer).
+    log_function = web_app.settings.get("log_function")
+    if log_function is not None and not getattr(log_function, "records_metrics", False):
+
+        def log_request(handler):
+            _observe_request(handler)
+            log_function(handler)
+
+        log_request.records_metrics = True
+        web_app.settings["log_function"] = log_request
+
     # Add route for getting csv data
     data_pattern = url_path_join(base_url, "jlab_ext_example", "data")
     handlers = [(data_pattern, DataHandler)]
@@ -4500,6 +5116,11 @@ def setup_handlers(web_app):
     handlers = [(chat_pattern, ChatHandler)]
     web_app.add_handlers(host_pattern, handlers)
 
+    # Add route for streaming the chat response as server-sent events
+    chat_stream_pattern = url_path_join(base_url, "jlab_ext_example", "chat_stream")
+    handlers = [(chat_stream_pattern, ChatStreamHandler)]
+    web_app.add_handlers(host_pattern, handlers)
+
     # Add route for getting go on or not response
     go_on_pattern = url_path_join(base_url, "jlab_ext_example", "go_on")
     handlers = [(go_on_pattern, GoOnHandler)]
@@ -4592,3 +5213,8 @@ def setup_handlers(web_app):
     )
     handlers = [(mark_posttest_complete_pattern, MarkPosttestCompleteHandler)]
     web_app.add_handlers(host_pattern, handlers)
+
+    # Add route for Prometheus metrics
+    metrics_pattern = url_path_join(base_url, "jlab_ext_example", "metrics")
+    handlers = [(metrics_pattern, MetricsHandler)]
+    web_app.add_handlers(host_pattern, handlers)
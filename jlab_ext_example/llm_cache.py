@@ -0,0 +1,215 @@
+"""
+LLM Response Cache Module
+
+A persistent, content-addressed cache in front of llm_chat() for prompts
+whose output does not depend on the participant: the Modeling cards, the
+segmentation chain, knowledge extraction, blanked code and the temperature-0
+articulation rubric. Chat-bot turns (which carry per-user memory) are never
+cached.
+
+The cache is opt-in (TUTORLY_LLM_CACHE=1) and lives in its own SQLite file so
+it can be shared by every participant on a host, e.g.
+
+    TUTORLY_LLM_CACHE=1 TUTORLY_LLM_CACHE_PATH=/srv/tutorly/llm_cache.db
+
+Entries are keyed on (model, system_prompt, user_message, temperature,
+response_mime_type), expire per call site (CALL_SITE_TTLS) and are evicted
+least-recently-used once the file grows past TUTORLY_LLM_CACHE_MAX_BYTES.
+A hit only rewrites an entry's access time when the stored one is more than
+ACCESS_RESOLUTION seconds old, so most hits are a single read and no
+commit.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+_DAY = 24 * 60 * 60
+
+# Seconds an entry stays valid, per call site. None means "until evicted".
+# Segmentation and knowledge are regenerated only when the prompt text
+# changes (which changes the key anyway); Modeling cards and rubric scores
+# get a finite lifetime so prompt-independent model drift is picked up.
+CALL_SITE_TTLS: Dict[str, Optional[int]] = {
+    "modeling-card": 30 * _DAY,
+    "segment-summary": None,
+    "knowledge": None,
+    "code-with-blank": None,
+    "articulation-score": 7 * _DAY,
+}
+DEFAULT_TTL = 7 * _DAY
+
+# Seconds of LRU precision traded for not committing on every hit.
+ACCESS_RESOLUTION = 60.0
+
+
+def is_cache_enabled() -> bool:
+    return os.environ.get("TUTORLY_LLM_CACHE", "0").lower() in ("1", "true", "yes")
+
+
+def make_key(
+    model: str,
+    system_prompt: str,
+    user_message: str,
+    temperature: float,
+    response_mime_type: Optional[str],
+) -> str:
+    """Content address of one LLM request."""
+    material = json.dumps(
+        [model, system_prompt, user_message, float(temperature), response_mime_type],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """SQLite-backed LRU cache of LLM text responses."""
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # One connection shared by all threads (guarded by _lock); the
+        # timeout covers other participants' processes writing the same file.
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                site TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )"""
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS llm_cache_lru ON llm_cache (last_access)"
+        )
+        self._conn.commit()
+        self._hits: Dict[str, int] = {}
+        self._misses: Dict[str, int] = {}
+
+    def get(self, key: str, site: str) -> Optional[str]:
+        now = time.time()
+        ttl = CALL_SITE_TTLS.get(site, DEFAULT_TTL)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at, last_access FROM llm_cache WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is not None and ttl is not None and row[1] + ttl < now:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self._misses[site] = self._misses.get(site, 0) + 1
+                return None
+            if now - row[2] >= ACCESS_RESOLUTION:
+                self._conn.execute(
+                    "UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key)
+                )
+                self._conn.commit()
+            self._hits[site] = self._hits.get(site, 0) + 1
+            return row[0]
+
+    def put(self, key: str, site: str, value: str) -> None:
+        if not value:
+            # An empty reply is a failed call, not an answer worth keeping.
+            return
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO llm_cache (key, site, value, size, created_at, last_access)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    value = excluded.value,
+                    size = excluded.size,
+                    created_at = excluded.created_at,
+                    last_access = excluded.last_access
+                """,
+                (key, site, value, size, now, now),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        total = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM llm_cache"
+        ).fetchone()[0]
+        while total > self.max_bytes:
+            row = self._conn.execute(
+                "SELECT key, size FROM llm_cache ORDER BY last_access LIMIT 1"
+            ).fetchone()
+            if row is None:
+                break
+            self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (row[0],))
+            total -= row[1]
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Hit/miss counters per call site since the process started."""
+        with self._lock:
+            sites = set(self._hits) | set(self._misses)
+            return {
+                site: {
+                    "hits": self._hits.get(site, 0),
+                    "misses": self._misses.get(site, 0),
+                }
+                for site in sorted(sites)
+            }
+
+
+_cache: Optional[LLMResponseCache] = None
+_cache_failed = False
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> Optional[LLMResponseCache]:
+    """Return the process-wide cache, or None when caching is disabled."""
+    global _cache, _cache_failed
+    if not is_cache_enabled() or _cache_failed:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                try:
+                    _cache = LLMResponseCache(
+                        os.environ.get("TUTORLY_LLM_CACHE_PATH", "llm_cache.db"),
+                        int(
+                            os.environ.get(
+                                "TUTORLY_LLM_CACHE_MAX_BYTES", str(64 * 1024 * 1024)
+                            )
+                        ),
+                    )
+                except (sqlite3.Error, ValueError) as exc:
+                    print(f"⚠️  LLM cache unavailable, continuing without it: {exc}")
+                    _cache_failed = True
+                    return None
+    return _cache
+
+
+def forget(
+    model: str,
+    system_prompt: str,
+    user_message: str,
+    temperature: float,
+    response_mime_type: Optional[str],
+) -> None:
+    """Drop one entry, e.g. a reply the caller found unusable."""
+    cache = get_cache()
+    if cache is not None:
+        cache.discard(
+            make_key(model, system_prompt, user_message, temperature, response_mime_type)
+        )
@@ -0,0 +1,198 @@
+"""
+Metrics Module
+
+In-process counters and latency histograms, served in the Prometheus text
+format at /jlab_ext_example/metrics (see MetricsHandler in handlers.py), so
+we can see where a turn's time goes instead of grepping print() lines.
+
+Recording is cheap and takes no lock: every thread writes only to its own
+shard (a pair of plain dicts reached through threading.local), and render()
+sums the shards at scrape time. A shard is registered once, under a lock, the
+first time its thread records anything, and outlives the thread so counters
+never go backwards.
+
+    inc("tutorly_llm_tokens_total", 812, site="get_knowledge", kind="prompt")
+    observe("tutorly_db_query_seconds", 0.0004, op="query_one", db="cache.db")
+    with timer("tutorly_firebase_flush_seconds"):
+        ...
+
+Component statistics that already exist (LLM cache hits, prefetcher,
+write-behind buffer, Firebase pipeline) are pulled in at scrape time with
+register_stats(); their values are exported as gauges.
+"""
+
+import bisect
+import contextlib
+import math
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+# Upper bounds (seconds) of the latency histogram buckets. Spans SQLite
+# statements (sub-millisecond) through streamed LLM replies (tens of seconds).
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+_local = threading.local()
+_shards: List["_Shard"] = []
+_shards_lock = threading.Lock()
+_stats_sources: List[tuple] = []
+
+
+class _Shard:
+    __slots__ = ("counters", "histograms")
+
+    def __init__(self):
+        # (name, labels) -> value
+        self.counters: Dict[tuple, float] = {}
+        # (name, labels) -> [count per bucket..., count above the last, sum]
+        self.histograms: Dict[tuple, list] = {}
+
+
+def _shard() -> _Shard:
+    shard = getattr(_local, "shard", None)
+    if shard is None:
+        shard = _local.shard = _Shard()
+        with _shards_lock:
+            _shards.append(shard)
+    return shard
+
+
+def inc(name: str, value: float = 1, **labels) -> None:
+    """Add `value` to a counter. Counter names should end in _total."""
+    key = (name, tuple(sorted(labels.items())))
+    counters = _shard().counters
+    counters[key] = counters.get(key, 0) + value
+
+
+def observe(name: str, seconds: float, **labels) -> None:
+    """Record one latency sample in a histogram."""
+    key = (name, tuple(sorted(labels.items())))
+    histograms = _shard().histograms
+    hist = histograms.get(key)
+    if hist is None:
+        hist = histograms[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+    hist[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+    hist[-1] += seconds
+
+
+@contextlib.contextmanager
+def timer(name: str, **labels):
+    """Observe the duration of the with-block, including when it raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+def register_stats(
+    prefix: str, fn: Callable[[], dict], label: Optional[str] = None
+) -> None:
+    """Export a component's stats() dict as gauges at every scrape.
+
+    A flat {stat: number} dict becomes `{prefix}_{stat}`. With `label`, `fn`
+    returns {label value: {stat: number}} and each inner dict is exported
+    under that label (e.g. one series per LLM cache call site).
+    """
+    _stats_sources.append((prefix, fn, label))
+
+
+def _snapshot():
+    counters: Dict[tuple, float] = {}
+    histograms: Dict[tuple, list] = {}
+    with _shards_lock:
+        shards = list(_shards)
+    for shard in shards:
+        # list() copies a dict in one step under the GIL, so a thread that
+        # is recording meanwhile cannot break the iteration.
+        for key, value in list(shard.counters.items()):
+            counters[key] = counters.get(key, 0) + value
+        for key, hist in list(shard.histograms.items()):
+            hist = list(hist)
+            total = histograms.get(key)
+            if total is None:
+                histograms[key] = hist
+            else:
+                histograms[key] = [a + b for a, b in zip(total, hist)]
+    return counters, histograms
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _series(name: str, labels, extra: tuple = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return name
+    body = ",".join(f'{key}="{_escape(value)}"' for key, value in pairs)
+    return f"{name}{{{body}}}"
+
+
+def _format(value: float) -> str:
+    if isinstance(value, float) and math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _stats_gauges() -> Dict[str, list]:
+    gauges: Dict[str, list] = {}
+    for prefix, fn, label in list(_stats_sources):
+        try:
+            stats = fn()
+        except Exception as e:
+            print(f"⚠️  Metrics source {prefix} failed: {str(e)}")
+            continue
+        groups = stats.items() if label else [(None, stats)]
+        for label_value, group in groups:
+            labels = ((label, label_value),) if label else ()
+            for stat, value in group.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                gauges.setdefault(f"{prefix}_{stat}", []).append((labels, value))
+    return gauges
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    counters, histograms = _snapshot()
+    lines = []
+    by_name: Dict[str, list] = {}
+    for (name, labels), value in counters.items():
+        by_name.setdefault(name, []).append((labels, value))
+    for name in sorted(by_name):
+        lines.append(f"# TYPE {name} counter")
+        for labels, value in sorted(by_name[name]):
+            lines.append(f"{_series(name, labels)} {_format(value)}")
+
+    by_name = {}
+    for (name, labels), hist in histograms.items():
+        by_name.setdefault(name, []).append((labels, hist))
+    for name in sorted(by_name):
+        lines.append(f"# TYPE {name} histogram")
+        for labels, hist in sorted(by_name[name]):
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + (math.inf,), hist[:-1]):
+                cumulative += count
+                series = _series(f"{name}_bucket", labels, (("le", _format(float(bound))),))
+                lines.append(f"{series} {cumulative}")
+            lines.append(f"{_series(name + '_sum', labels)} {_format(hist[-1])}")
+            lines.append(f"{_series(name + '_count', labels)} {cumulative}")
+
+    gauges = _stats_gauges()
+    for name in sorted(gauges):
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in gauges[name]:
+            lines.append(f"{_series(name, labels)} {_format(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def reset() -> None:
+    """Zero every counter and histogram (tests)."""
+    with _shards_lock:
+        for shard in _shards:
+            shard.counters.clear()
+            shard.histograms.clear()
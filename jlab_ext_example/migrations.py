@@ -0,0 +1,368 @@
+"""
+Schema Migrations Module
+
+Versioned schema for cache.db. Replaces initialze_database(), which re-ran a
+dozen CREATE TABLE IF NOT EXISTS statements, a PRAGMA and conditional
+ALTERs from inside request handlers, several times per request.
+
+run_migrations() is called once from _load_jupyter_server_extension. It
+applies, in order, every migration newer than the highest version recorded
+in `schema_version`, each in its own transaction. Request-path code assumes
+the schema exists.
+
+Adding a migration: append `(next_version, "what it does", function)` to
+MIGRATIONS. Never edit or reorder a migration that has shipped. Migrations
+must tolerate a database that already has their change (a pre-migration
+cache.db has every table but no schema_version), hence IF NOT EXISTS,
+INSERT OR IGNORE and column checks.
+"""
+
+import json
+import sqlite3
+
+from jlab_ext_example.db import DB_PATH
+
+SEEDED_SEGMENTS = {
+    "nx5yhXAQLxw": [
+        {"category": "Introduction", "start": 1, "end": 86},  # 0
+        {"category": "Load packages/data", "start": 86, "end": 212},  # 1
+        {"category": "Understand the dataset", "start": 212, "end": 418},  # 2
+        {"category": "Visualize the data", "start": 418, "end": 463},  # 3
+        {"category": "Interpret the chart", "start": 463, "end": 509},  # 4
+        {"category": "Visualize the data", "start": 509, "end": 602},  # 5
+        {"category": "Interpret the chart", "start": 602, "end": 638},  # 6
+        {"category": "Visualize the data", "start": 638, "end": 720},  # 7
+        {"category": "Interpret the chart", "start": 720, "end": 848},  # 8
+        {"category": "Visualize the data", "start": 848, "end": 971},  # 9
+        {"category": "Interpret the chart", "start": 971, "end": 1101},  # 10
+        {"category": "Preprocess the data", "start": 1101, "end": 1145},  # 11
+        {"category": "Interpret the chart", "start": 1145, "end": 1177},  # 12
+        {"category": "Visualize the data", "start": 1177, "end": 1371},  # 13
+    ],
+    "Kd9BNI6QMmQ": [
+        {"category": "Introduction", "start": 1, "end": 102},  # 0
+        {"category": "Load packages/data", "start": 102, "end": 137},  # 1
+        {"category": "Understand the dataset", "start": 137, "end": 220},  # 2
+        {"category": "Preprocess the data", "start": 220, "end": 568},  # 3
+        {"category": "Visualize the data", "start": 568, "end": 580},  # 4
+        {"category": "Interpret the chart", "start": 580, "end": 596},  # 5
+        {"category": "Visualize the data", "start": 596, "end": 655},  # 6
+        {"category": "Interpret the chart", "start": 655, "end": 740},  # 7
+        {"category": "Visualize the data", "start": 740, "end": 900},  # 8
+        {"category": "Interpret the chart", "start": 900, "end": 968},  # 9
+        {"category": "Visualize the data", "start": 968, "end": 1027},  # 10
+    ],
+    "EF4A4OtQprg": [  # pet names
+        {"category": "Understand the dataset", "start": 1, "end": 157},  # 0
+        {"category": "Preprocess and Visualize the data", "start": 157, "end": 536},  # 1
+        {"category": "Interpret the chart and propose hypotheses", "start": 536, "end": 614},  # 2
+        {"category": "Preprocess and Visualize the data", "start": 614, "end": 1077},  # 3
+        {"category": "Interpret the chart and propose hypotheses", "start": 1077, "end": 1178},  # 4
+        {"category": "Preprocess and Visualize the data", "start": 1178, "end": 1497},  # 5
+        {"category": "Preprocess and Visualize the data", "start": 1497, "end": 1787},  # 6
+        {"category": "Interpret the chart and propose hypotheses", "start": 1787, "end": 2540},  # 7
+        {"category": "Preprocess and Visualize the data", "start": 2540, "end": 2697},  # 8
+        {"category": "Interpret the chart and propose hypotheses", "start": 2697, "end": 2846},  # 9
+        {"category": "Preprocess and Visualize the data", "start": 2846, "end": 3344},  # 10
+    ],
+    "1xsbTs9-a50": [  # franchise revenue
+        {"category": "Understand the dataset", "start": 1, "end": 401},  # 0
+        {"category": "Preprocess and Visualize the data", "start": 401, "end": 663},  # 1
+        {"category": "Interpret the chart and propose hypotheses", "start": 663, "end": 1032},  # 2
+        {"category": "Preprocess and Visualize the data", "start": 1032, "end": 1414},  # 3
+        {"category": "Interpret the chart and propose hypotheses", "start": 1414, "end": 1589},  # 4
+        {"category": "Preprocess and Visualize the data", "start": 1589, "end": 1721},  # 5
+        {"category": "Interpret the chart and propose hypotheses", "start": 1721, "end": 1941},  # 6
+        {"category": "Preprocess and Visualize the data", "start": 1941, "end": 2233},  # 7
+        {"category": "Interpret the chart and propose hypotheses", "start": 2233, "end": 2441},  # 8
+        {"category": "Preprocess and Visualize the data", "start": 2441, "end": 2700},  # 9
+        {"category": "Interpret the chart and propose hypotheses", "start": 2700, "end": 2849},  # 10
+        {"category": "Preprocess and Visualize the data", "start": 2849, "end": 3261},  # 11
+    ],
+    "-1x8Kpyndss": [  # coffee ratings
+        {"category": "Understand the dataset", "start": 1, "end": 362},  # 0
+        {"category": "Preprocess and Visualize the data", "start": 362, "end": 664},  # 1
+        {"category": "Interpret the chart and propose hypotheses", "start": 664, "end": 743},  # 2
+        {"category": "Preprocess and Visualize the data", "start": 743, "end": 1022},  # 3
+        {"category": "Interpret the chart and propose hypotheses", "start": 1022, "end": 1120},  # 4
+        {"category": "Preprocess and Visualize the data", "start": 1120, "end": 1464},  # 5
+        {"category": "Interpret the chart and propose hypotheses", "start": 1464, "end": 1566},  # 6
+        {"category": "Preprocess and Visualize the data", "start": 1566, "end": 1930},  # 7
+        {"category": "Interpret the chart and propose hypotheses", "start": 1930, "end": 2257},  # 8
+        {"category": "Preprocess and Visualize the data", "start": 2257, "end": 2487},  # 9
+        {"category": "Interpret the chart and propose hypotheses", "start": 2487, "end": 2687},  # 10
+        {"category": "Preprocess and Visualize the data", "start": 2687, "end": 2873},  # 11
+        {"category": "Interpret the chart and propose hypotheses", "start": 2873, "end": 3113},  # 12
+    ],
+    "8jazNUpO3lQ": [
+        {"category": "Basic linear regression concepts", "start": 1, "end": 155},  # 0
+        {"category": "Load packages/data", "start": 155, "end": 232},  # 1
+        {"category": "Plot a plot for linear regression", "start": 232, "end": 325},  # 2
+        {"category": "Create and understand linear regression object", "start": 325, "end": 551},  # 3
+        {"category": "Generate CSV file with list of home price predictions", "start": 551, "end": 712},  # 4
+    ],
+}
+
+
+def _create_base_tables(c):
+    c.execute(
+        """
+    CREATE TABLE IF NOT EXISTS segments_cache (
+        video_id TEXT PRIMARY KEY,
+        segments TEXT NOT NULL
+    );"""
+    )
+    c.execute(
+        """
+    CREATE TABLE IF NOT EXISTS code_cache (
+        video_id TEXT PRIMARY KEY,
+        file_name TEXT NOT NULL,
+        download_url TEXT NOT NULL
+    );"""
+    )
+    c.execute(
+        """
+    CREATE TABLE IF NOT EXISTS data_cache (
+        video_id TEXT,
+        name TEXT NOT NULL,
+        download_url TEXT NOT NULL,
+        attributes_info TEXT NOT NULL,
+        PRIMARY KEY (video_id, name)
+    );"""
+    )
+    c.execute(
+        """
+    CREATE TABLE IF NOT EXISTS bkt_params_cache (
+        user_id TEXT PRIMARY KEY,
+        skills_probMastery TEXT NOT NULL
+    );"""
+    )
+    c.execute(
+        """
+    CREATE TABLE IF NOT EXISTS knowledge_cache (
+        video_id TEXT,
+        segment_index NUMBER NOT NULL,
+        knowledge TEXT NOT NULL,
+        PRIMARY KEY (video_id, segment_index)
+    );"""
+    )
+    c.execute(
+        """
+    CREATE TABLE IF NOT EXISTS code_block_cache (
+        video_id TEXT,
+        segment_index NUMBER NOT NULL,
+        code_with_blanks TEXT,
+        PRIMARY KEY (video_id, segment_index)
+    );"""
+    )
+    c.execute(
+        """
+    CREATE TABLE IF NOT EXISTS user_conditions (
+        user_id TEXT PRIMARY KEY,
+        condition TEXT NOT NULL,
+        assigned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );"""
+    )
+    c.execute(
+        """
+    CREATE TABLE IF NOT EXISTS questionnaire_progress (
+        user_id TEXT PRIMARY KEY,
+        pretest_completed INTEGER NOT NULL DEFAULT 0,
+        pretest_completed_at TIMESTAMP
+    );"""
+    )
+
+
+def _add_posttest_columns(c):
+    c.execute("PRAGMA table_info(questionnaire_progress)")
+    existing_columns = {row[1] for row in c.fetchall()}
+    if "latin_order" not in existing_columns:
+        c.execute("ALTER TABLE questionnaire_progress ADD COLUMN latin_order TEXT")
+    if "posttest_index" not in existing_columns:
+        c.execute(
+            "ALTER TABLE questionnaire_progress ADD COLUMN posttest_index INTEGER NOT NULL DEFAULT 0"
+        )
+    if "completed_videos" not in existing_columns:
+        c.execute(
+            "ALTER TABLE questionnaire_progress ADD COLUMN completed_videos TEXT NOT NULL DEFAULT '[]'"
+        )
+    if "finished_videos" not in existing_columns:
+        c.execute(
+            "ALTER TABLE questionnaire_progress ADD COLUMN finished_videos TEXT NOT NULL DEFAULT '[]'"
+        )
+    if "assigned_video_id" not in existing_columns:
+        c.execute(
+            "ALTER TABLE questionnaire_progress ADD COLUMN assigned_video_id TEXT"
+        )
+
+
+def _seed_segments(c):
+    # Hand-checked segments for the study videos. Existing rows win, so a
+    # cache.db that already holds (possibly regenerated) segments keeps them.
+    for video_id, segments in SEEDED_SEGMENTS.items():
+        c.execute(
+            "INSERT OR IGNORE INTO segments_cache (video_id, segments) VALUES (?, ?)",
+            (video_id, json.dumps(segments)),
+        )
+
+
+def _create_segment_windows(c):
+    # Per-window segmentation results while a video is still being
+    # segmented (see handlers.get_segments_progress); cleared once
+    # segments_cache has the merged list.
+    c.execute(
+        """
+    CREATE TABLE IF NOT EXISTS segment_windows (
+        video_id TEXT,
+        window_index INTEGER NOT NULL,
+        n_windows INTEGER NOT NULL,
+        end_time INTEGER NOT NULL,
+        segments TEXT NOT NULL,
+        PRIMARY KEY (video_id, window_index)
+    );"""
+    )
+
+
+def _create_bkt_skill_state(c):
+    # One row per (user, skill) and an append-only rubric log, replacing the
+    # per-user JSON blob in bkt_params_cache that was rewritten in full on
+    # every observation. Existing blobs are copied over; bkt_params_cache is
+    # left in place (no longer written) for anyone auditing old databases.
+    c.execute(
+        """
+    CREATE TABLE IF NOT EXISTS bkt_skill_state (
+        user_id TEXT NOT NULL,
+        skill_id TEXT NOT NULL,
+        prob_mastery REAL NOT NULL,
+        n_observations INTEGER NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, skill_id)
+    );"""
+    )
+    c.execute(
+        """
+    CREATE TABLE IF NOT EXISTS rubric_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        skill_id TEXT NOT NULL,
+        created_at TIMESTAMP NOT NULL,
+        record TEXT NOT NULL
+    );"""
+    )
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS rubric_events_user ON rubric_events (user_id, skill_id)"
+    )
+    c.execute("SELECT user_id, skills_probMastery FROM bkt_params_cache")
+    for user_id, blob in c.fetchall():
+        try:
+            stored = json.loads(blob) if blob else {}
+        except ValueError:
+            continue
+        for skill_id, value in stored.items():
+            if not isinstance(value, dict):
+                value = {"probMastery": value}
+            c.execute(
+                """
+                INSERT OR IGNORE INTO bkt_skill_state
+                    (user_id, skill_id, prob_mastery, n_observations)
+                VALUES (?, ?, ?, ?)
+                """,
+                (
+                    user_id,
+                    skill_id,
+                    float(value.get("probMastery", 0.1)),
+                    int(value.get("n_observations", 0)),
+                ),
+            )
+            for record in value.get("rubric_history", []):
+                c.execute(
+                    """
+                    INSERT INTO rubric_events (user_id, skill_id, created_at, record)
+                    VALUES (?, ?, ?, ?)
+                    """,
+                    (user_id, skill_id, record.get("timestamp", ""), json.dumps(record)),
+                )
+
+
+def _create_spilled_sessions(c):
+    # Per-user session state evicted from memory by session_store.SessionStore,
+    # one JSON record per user; the row is removed when it is loaded back.
+    c.execute(
+        """
+    CREATE TABLE IF NOT EXISTS spilled_sessions (
+        user_id TEXT PRIMARY KEY,
+        record TEXT NOT NULL,
+        spilled_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );"""
+    )
+
+
+def _create_teaching_state(c):
+    # The in-flight teaching sequence and practice-item buffers per user, as
+    # one JSON document, checkpointed whenever the sequence advances (see
+    # handlers.checkpoint_teaching_state).
+    c.execute(
+        """
+    CREATE TABLE IF NOT EXISTS teaching_state (
+        user_id TEXT PRIMARY KEY,
+        state TEXT NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );"""
+    )
+
+
+MIGRATIONS = [
+    (1, "base tables", _create_base_tables),
+    (2, "questionnaire_progress post-test columns", _add_posttest_columns),
+    (3, "seed study video segments", _seed_segments),
+    (4, "segment_windows", _create_segment_windows),
+    (5, "bkt_skill_state and rubric_events", _create_bkt_skill_state),
+    (6, "spilled_sessions", _create_spilled_sessions),
+    (7, "teaching_state", _create_teaching_state),
+]
+
+
+def schema_version(conn) -> int:
+    row = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'"
+    ).fetchone()
+    if row is None:
+        return 0
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def run_migrations(path: str = DB_PATH) -> int:
+    """Bring the database at `path` up to date. Returns the schema version."""
+    # Autocommit mode, so each migration's BEGIN/COMMIT is ours alone.
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    try:
+        conn.execute(
+            """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );"""
+        )
+        for version, name, migrate in MIGRATIONS:
+            # BEGIN IMMEDIATE takes the write lock before re-reading the
+            # version, so two servers starting together apply each migration
+            # exactly once.
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if schema_version(conn) >= version:
+                    conn.execute("COMMIT")
+                    continue
+                migrate(conn.cursor())
+                conn.execute(
+                    "INSERT INTO schema_version (version, name) VALUES (?, ?)",
+                    (version, name),
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            print(f"cache.db: applied migration {version} ({name})")
+        return schema_version(conn)
+    finally:
+        conn.close()
@@ -0,0 +1,94 @@
+"""
+Firebase Outbox Module
+
+Append-only local log of Firebase writes, so study data survives an RTDB
+outage or a server restart. firebase_logger appends every event here first
+(one small local commit) and a background replayer sends the events, oldest
+first, to the database.
+
+Each row is one event: a JSON object of {path: value} writes, with push()
+keys already generated, so re-sending a row writes the same paths and is
+idempotent. `outbox_watermark.sent_id` is the highest row id known to have
+reached Firebase; ack() advances it and deletes the rows at or below it in
+the same transaction. A crash between the send and the ack only means those
+rows are sent again.
+
+The outbox lives in its own SQLite file (TUTORLY_FIREBASE_OUTBOX, default
+firebase_outbox.db) so its appends never queue behind cache.db writers.
+"""
+
+import json
+import os
+import threading
+from typing import Dict, List, Tuple
+
+from jlab_ext_example import db
+
+OUTBOX_PATH = os.environ.get("TUTORLY_FIREBASE_OUTBOX", "firebase_outbox.db")
+
+
+class Outbox:
+    def __init__(self, path: str = OUTBOX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        with db.transaction(path) as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    writes TEXT NOT NULL
+                )"""
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS outbox_watermark (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    sent_id INTEGER NOT NULL
+                )"""
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO outbox_watermark (id, sent_id) VALUES (0, 0)"
+            )
+            self._sent_id = conn.execute(
+                "SELECT sent_id FROM outbox_watermark WHERE id = 0"
+            ).fetchone()[0]
+            self._last_id = conn.execute(
+                "SELECT COALESCE(MAX(id), ?) FROM outbox", (self._sent_id,)
+            ).fetchone()[0]
+
+    def append(self, writes: Dict[str, object]) -> int:
+        """Store one event. Returns its row id."""
+        with db.transaction(self.path) as conn:
+            row_id = conn.execute(
+                "INSERT INTO outbox (writes) VALUES (?)", (json.dumps(writes),)
+            ).lastrowid
+        with self._lock:
+            self._last_id = max(self._last_id, row_id)
+        return row_id
+
+    def pending(self) -> int:
+        """Events appended but not yet acknowledged."""
+        with self._lock:
+            return self._last_id - self._sent_id
+
+    def next_batch(self, limit: int) -> List[Tuple[int, Dict[str, object]]]:
+        """The oldest `limit` unacknowledged events, as (id, writes)."""
+        with self._lock:
+            sent_id = self._sent_id
+        rows = db.query_all(
+            "SELECT id, writes FROM outbox WHERE id > ? ORDER BY id LIMIT ?",
+            (sent_id, limit),
+            path=self.path,
+        )
+        return [(row_id, json.loads(writes)) for row_id, writes in rows]
+
+    def ack(self, sent_id: int) -> None:
+        """Record that every event up to `sent_id` reached Firebase."""
+        with db.transaction(self.path) as conn:
+            conn.execute(
+                "UPDATE outbox_watermark SET sent_id = MAX(sent_id, ?) WHERE id = 0",
+                (sent_id,),
+            )
+            conn.execute("DELETE FROM outbox WHERE id <= ?", (sent_id,))
+        with self._lock:
+            self._sent_id = max(self._sent_id, sent_id)
@@ -0,0 +1,102 @@
+"""
+Move Prefetch Module
+
+Speculatively generates the chat-bot replies for the next teaching moves
+while the student is still reading the current one, so clicking "Next
+message" doesn't wait 2-8 s on Gemini.
+
+The handlers describe what to prefetch with a `plan` callable. It runs on
+the prefetch executor and yields `(key, generate)` pairs, one per upcoming
+move that is safe to prefetch; `key` must be the exact chat-bot input the
+handler will build for that move, so a result is only ever used for the
+request it was generated for. ChatHandler later calls claim(uid, key); on a
+hit it gets a Future (possibly still running) instead of starting a fresh
+call, on a miss it generates as before.
+
+Bounded on both axes: at most `max_pending` plans queued process-wide
+(further schedule() calls are dropped, not queued) and at most `per_user`
+results held per participant (oldest evicted). reset(uid) discards a
+participant's results when their teaching sequence is rebuilt.
+"""
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Iterable, Optional, Tuple
+
+
+class MovePrefetcher:
+    def __init__(self, executor, max_pending: int = 32, per_user: int = 4):
+        self.executor = executor
+        self.max_pending = max_pending
+        self.per_user = per_user
+        self._lock = threading.Lock()
+        self._results: dict = {}  # uid -> OrderedDict(key -> Future)
+        self._generation: dict = {}  # uid -> int, bumped by reset()
+        self._pending = 0
+        self.hits = 0
+        self.misses = 0
+        self.dropped = 0
+
+    def schedule(
+        self,
+        uid: str,
+        plan: Callable[[], Iterable[Tuple[str, Callable[[], str]]]],
+    ) -> bool:
+        """Queue a plan for `uid`. Returns False if the queue was full."""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.dropped += 1
+                return False
+            self._pending += 1
+            generation = self._generation.get(uid, 0)
+        self.executor.submit(self._run, uid, generation, plan)
+        return True
+
+    def _run(self, uid, generation, plan) -> None:
+        try:
+            for key, generate in plan():
+                with self._lock:
+                    if self._generation.get(uid, 0) != generation:
+                        return
+                    results = self._results.setdefault(uid, OrderedDict())
+                    if key in results:
+                        continue
+                    future = Future()
+                    results[key] = future
+                    while len(results) > self.per_user:
+                        results.popitem(last=False)
+                try:
+                    future.set_result(generate())
+                except Exception as exc:
+                    future.set_exception(exc)
+        except Exception as exc:
+            print(f"⚠️  Move prefetch failed for {uid}: {exc}")
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def claim(self, uid: str, key: str) -> Optional[Future]:
+        """Take the prefetched result for `key`, if one was started."""
+        with self._lock:
+            future = self._results.get(uid, {}).pop(key, None)
+            if future is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return future
+
+    def reset(self, uid: str) -> None:
+        with self._lock:
+            self._generation[uid] = self._generation.get(uid, 0) + 1
+            self._results.pop(uid, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "dropped": self.dropped,
+                "pending": self._pending,
+                "held": sum(len(r) for r in self._results.values()),
+            }
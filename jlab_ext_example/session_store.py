@@ -0,0 +1,218 @@
+"""
+Session Store Module
+
+Bounded home for the per-user session dicts (see handlers.get_user_session).
+USER_SESSIONS used to be a plain module dict that only grew: everyone who
+ever connected kept their teaching sequence, buffers and whole chat
+conversation in memory for the life of the server.
+
+SessionStore keeps at most `max_sessions` sessions, and about `max_bytes`
+of them, in memory. get() returns the live session, else loads a spilled
+one back, else creates one with `create(uid)`. A sweep, run from get() at
+most every `sweep_interval` seconds and whenever a session is added, spills
+sessions to the spilled_sessions table of cache.db:
+
+  * every session idle for longer than `idle_seconds`, then
+  * the least recently used sessions, until both caps hold.
+
+Sessions for which `is_busy(uid)` is true are never spilled: a handler in
+the middle of a turn holds a reference to the dict, and would go on
+mutating a copy nobody reads again.
+
+Serialization is the caller's: `dump(session)` returns JSON-serializable
+data and `load(record)` rebuilds a session from it. A session's size is
+the length of its JSON record (see sizes()). Sweeps run on the IOLoop, so
+they only re-measure sessions handed out by get() since the previous sweep
+(and busy ones, which may still be changing); the other sizes are cached.
+A session is dumped again when it is spilled. The store is not thread-safe;
+like the sessions themselves, it is only touched from the IOLoop.
+"""
+
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Set
+
+from jlab_ext_example import db
+
+
+class SessionStore:
+    def __init__(
+        self,
+        create: Callable[[str], dict],
+        dump: Callable[[dict], dict],
+        load: Callable[[dict], dict],
+        path: Optional[str] = None,
+        max_sessions: int = 200,
+        max_bytes: int = 256 * 1024 * 1024,
+        idle_seconds: float = 3600.0,
+        sweep_interval: float = 30.0,
+        is_busy: Optional[Callable[[str], bool]] = None,
+        on_evict: Optional[Callable[[str], None]] = None,
+    ):
+        self.create = create
+        self.dump = dump
+        self.load = load
+        self.path = path
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self.sweep_interval = sweep_interval
+        self.is_busy = is_busy or (lambda uid: False)
+        self.on_evict = on_evict
+        # uid -> session, least recently used first.
+        self._sessions: "OrderedDict[str, dict]" = OrderedDict()
+        self._last_access: Dict[str, float] = {}
+        self._sizes: Dict[str, int] = {}
+        # Sessions to re-measure at the next sweep.
+        self._dirty: Set[str] = set()
+        self._next_sweep = 0.0
+        self.spills = 0
+        self.loads = 0
+        self.spill_failures = 0
+
+    def get(self, uid: str) -> dict:
+        """The session for `uid`: live, loaded from disk, or new."""
+        now = time.monotonic()
+        session = self._sessions.get(uid)
+        if session is None:
+            session = self._load(uid)
+            if session is None:
+                session = self.create(uid)
+            self._sessions[uid] = session
+            self._next_sweep = now
+        self._sessions.move_to_end(uid)
+        self._last_access[uid] = now
+        self._dirty.add(uid)
+        if now >= self._next_sweep:
+            self.sweep(keep=uid)
+        return session
+
+    # Read-only dict view of the live sessions, for stats and tests.
+    def __contains__(self, uid: str) -> bool:
+        return uid in self._sessions
+
+    def __getitem__(self, uid: str) -> dict:
+        return self._sessions[uid]
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def items(self):
+        return self._sessions.items()
+
+    def clear(self) -> None:
+        """Forget the live sessions without spilling them (tests)."""
+        self._sessions.clear()
+        self._last_access.clear()
+        self._sizes.clear()
+        self._dirty.clear()
+
+    def _load(self, uid: str) -> Optional[dict]:
+        try:
+            row = db.query_one(
+                "SELECT record FROM spilled_sessions WHERE user_id = ?",
+                (uid,),
+                path=self.path,
+            )
+            if row is None:
+                return None
+            session = self.load(json.loads(row[0]))
+            db.execute(
+                "DELETE FROM spilled_sessions WHERE user_id = ?", (uid,), path=self.path
+            )
+        except (sqlite3.Error, ValueError, KeyError, TypeError) as e:
+            print(f"⚠️  Could not load spilled session for {uid}: {str(e)}")
+            return None
+        self.loads += 1
+        return session
+
+    def sweep(self, keep: Optional[str] = None) -> int:
+        """Spill idle and over-cap sessions. Returns how many were spilled."""
+        now = time.monotonic()
+        self._next_sweep = now + self.sweep_interval
+        dirty, self._dirty = self._dirty, set()
+        for uid in dirty:
+            if uid in self._sessions:
+                record = self._record(uid)
+                if record is not None:
+                    self._sizes[uid] = len(record)
+                # The caller of get() and busy handlers go on changing theirs.
+                if uid == keep or self.is_busy(uid):
+                    self._dirty.add(uid)
+
+        def spillable(uid):
+            return uid != keep and not self.is_busy(uid)
+
+        victims = [
+            uid
+            for uid in self._sessions
+            if now - self._last_access[uid] > self.idle_seconds and spillable(uid)
+        ]
+        spilled = sum(self._spill(uid) for uid in victims)
+
+        total = sum(self._sizes.values())
+        for uid in list(self._sessions):
+            if len(self._sessions) <= self.max_sessions and total <= self.max_bytes:
+                break
+            size = self._sizes.get(uid, 0)
+            if spillable(uid) and self._spill(uid):
+                total -= size
+                spilled += 1
+        return spilled
+
+    def _record(self, uid: str) -> Optional[str]:
+        try:
+            return json.dumps(self.dump(self._sessions[uid]))
+        except (TypeError, ValueError) as e:
+            print(f"⚠️  Session for {uid} is not serializable: {str(e)}")
+            return None
+
+    def _spill(self, uid: str) -> bool:
+        record = self._record(uid)
+        if record is None:
+            return False
+        try:
+            db.execute(
+                "INSERT OR REPLACE INTO spilled_sessions (user_id, record) VALUES (?, ?)",
+                (uid, record),
+                path=self.path,
+            )
+        except sqlite3.Error as e:
+            print(f"⚠️  Could not spill session for {uid}: {str(e)}")
+            self.spill_failures += 1
+            return False
+        del self._sessions[uid]
+        del self._last_access[uid]
+        self._sizes.pop(uid, None)
+        self._dirty.discard(uid)
+        self.spills += 1
+        if self.on_evict is not None:
+            self.on_evict(uid)
+        return True
+
+    def sizes(self) -> Dict[str, dict]:
+        """Per live session: JSON size when last measured, and idle time."""
+        now = time.monotonic()
+        return {
+            uid: {
+                "bytes": self._sizes.get(uid, 0),
+                "idle_seconds": round(now - self._last_access[uid], 1),
+            }
+            for uid in list(self._sessions)
+        }
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "live": len(self._sessions),
+            "bytes": sum(self._sizes.values()),
+            "bytes_max": max(self._sizes.values(), default=0),
+            "idle_seconds_max": round(
+                max((now - t for t in self._last_access.values()), default=0.0), 1
+            ),
+            "spills": self.spills,
+            "loads": self.loads,
+            "spill_failures": self.spill_failures,
+        }
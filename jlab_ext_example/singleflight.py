@@ -0,0 +1,101 @@
+"""
+Single-Flight Module
+
+Coalesces concurrent generation of the same shared content. When several
+participants open a video at once, each request would otherwise run the
+segmentation / knowledge / blanked-code LLM chain for the same
+(video_id, segment_index) and then race to INSERT the result.
+
+`run(key, fn)` lets exactly one caller execute `fn` per key:
+
+  * in-process, concurrent callers for the same key block on the leader and
+    receive their own copy of its result, or its exception;
+  * across processes (one jupyter server per participant on the study VM),
+    the leader also holds an exclusive flock on a per-key lock file, so `fn`
+    should re-check the cache first; whoever waited on the lock then finds
+    the row the previous holder wrote.
+
+Lock files live in TUTORLY_LOCK_DIR (default: .tutorly_locks next to
+cache.db). On platforms without fcntl only the in-process half applies.
+"""
+
+import contextlib
+import copy
+import hashlib
+import os
+import threading
+from typing import Any, Callable, Dict, Hashable
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Per-key duplicate call suppression, in-process and via file locks."""
+
+    def __init__(self, lock_dir: str = None):
+        self.lock_dir = lock_dir
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def run(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            # Callers are free to mutate what they get back (segments are
+            # annotated in place downstream), so each follower gets its own
+            # copy of the leader's snapshot, which nobody else holds.
+            return copy.deepcopy(call.result)
+
+        try:
+            with self._process_lock(key):
+                result = fn()
+            # Snapshot before waking the followers: from here on the leader's
+            # caller owns `result` and may mutate it while they copy.
+            call.result = copy.deepcopy(result)
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return result
+
+    @contextlib.contextmanager
+    def _process_lock(self, key: Hashable):
+        if fcntl is None or not self.lock_dir:
+            yield
+            return
+        os.makedirs(self.lock_dir, exist_ok=True)
+        name = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        with open(os.path.join(self.lock_dir, f"{name}.lock"), "a") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+_flight = SingleFlight(os.environ.get("TUTORLY_LOCK_DIR", ".tutorly_locks"))
+
+
+def run(key: Hashable, fn: Callable[[], Any]) -> Any:
+    """Run `fn` once for all concurrent callers of `key`; see module docstring."""
+    return _flight.run(key, fn)
@@ -0,0 +1,175 @@
+"""Micro-benchmarks for the pure per-turn functions in handlers.py.
+
+Inputs come from the bundled *_code.json files and concept_tags.json, so the
+numbers reflect the code the study videos actually teach. Requires
+pytest-benchmark (in the `test` extra); skipped without it.
+
+Record a baseline, then compare a change against it:
+
+    pytest jlab_ext_example/tests/test_benchmarks.py --benchmark-only \
+        --benchmark-storage=benchmarks --benchmark-save=baseline
+    pytest jlab_ext_example/tests/test_benchmarks.py --benchmark-only \
+        --benchmark-storage=benchmarks --benchmark-compare \
+        --benchmark-compare-fail=mean:15%
+
+Baselines are machine-specific: compare runs from the same host only.
+"""
+import json
+import re
+
+import pytest
+
+from jlab_ext_example import code_index, fakes, handlers
+
+pytest.importorskip("pytest_benchmark")
+
+_CALL_RE = re.compile(r"\b([A-Za-z_][A-Za-z0-9_.]*)\s*\(")
+_ASSIGN_RE = re.compile(r"^\s*([A-Za-z_][A-Za-z0-9_.]*)\s*(?:<-|=(?!=))")
+
+
+def _code_blocks():
+    """Every code block of every study video, as lists of lines."""
+    blocks = []
+    for video_id in sorted(handlers._CODE_FILE_BY_VIDEO):
+        code_json = handlers.get_all_code(video_id)
+        for segment_index in sorted(code_json, key=int):
+            lines = code_json[segment_index].split("\\n")[1:-1]
+            if lines:
+                blocks.append((video_id, segment_index, lines))
+    return blocks
+
+
+@pytest.fixture(scope="module")
+def code_blocks():
+    return _code_blocks()
+
+
+@pytest.fixture(scope="module")
+def blank_pairs(code_blocks):
+    """(masked, full) lines, with every called function blanked out."""
+    pairs = []
+    for _, _, lines in code_blocks:
+        for line in lines:
+            if _CALL_RE.search(line):
+                pairs.append((_CALL_RE.sub("___(", line), line))
+    return pairs
+
+
+@pytest.fixture(scope="module")
+def knowledge_items(code_blocks):
+    """(code index, knowledge) pairs naming a block's functions and variables."""
+    items = []
+    for video_id, segment_index, lines in code_blocks:
+        index = handlers.get_code_index(
+            video_id, segment_index, handlers.get_all_code(video_id)
+        )
+        calls = sorted({m for line in lines for m in _CALL_RE.findall(line)})
+        names = sorted({m.group(1) for line in lines if (m := _ASSIGN_RE.match(line))})
+        for call in calls[:4]:
+            named = " and ".join(f"'{n}'" for n in [call] + names[:1])
+            items.append(
+                (index, f"Procedural knowledge: To shape the data, one need to use {named}.")
+            )
+    return items
+
+
+def test_canonicalize_code(benchmark, code_blocks):
+    sources = ["\n".join(lines) for _, _, lines in code_blocks]
+    benchmark(lambda: [handlers.canonicalize_code(s) for s in sources])
+
+
+def test_extract_blank_answers(benchmark, blank_pairs):
+    result = benchmark(
+        lambda: [handlers.extract_blank_answers(m, f) for m, f in blank_pairs]
+    )
+    assert sum(r is not None for r in result) == len(blank_pairs)
+
+
+def test_find_code_line_indices(benchmark, knowledge_items):
+    result = benchmark(
+        lambda: [handlers._find_code_line_indices(c, k) for c, k in knowledge_items]
+    )
+    assert all(result)
+
+
+def test_term_score(benchmark, code_blocks):
+    pairs = [
+        (term, line)
+        for _, _, lines in code_blocks
+        for line in lines
+        for term in _CALL_RE.findall(line)[:2]
+    ]
+    benchmark(lambda: [code_index.term_score(t, line) for t, line in pairs])
+
+
+def test_build_code_segment_index(benchmark):
+    blocks = [
+        block
+        for video_id in sorted(handlers._CODE_FILE_BY_VIDEO)
+        for block in handlers.get_all_code(video_id).values()
+    ]
+    benchmark(lambda: [code_index.CodeSegmentIndex(block) for block in blocks])
+
+
+def test_update_bkt_param(benchmark):
+    observations = [
+        (True, "multiple-choice"),
+        (False, "fill-in-blanks"),
+        (0.5, "fill-in-blanks"),
+        (True, "structured-text"),
+    ] * 25
+
+    def run():
+        state = handlers._default_skill_state()
+        for is_correct, interaction in observations:
+            handlers.update_bkt_param(state, is_correct, interaction)
+        return state
+
+    assert benchmark(run)["n_observations"] == len(observations)
+
+
+def test_plan_methods(benchmark):
+    knowledge = json.loads(fakes.CANNED_RESPONSES["knowledge"]) * 3
+    mastery = [0.1, 0.3, 0.5, 0.7, 0.9, 0.95]
+    n_observations = [0, 1, 2, 4, 6, 8]
+
+    def run():
+        return [
+            handlers.plan_methods(knowledge, mastery, n_observations, content_type)
+            for content_type in ("programming", "concept")
+        ]
+
+    benchmark(run)
+
+
+def test_repair_json(benchmark):
+    reply = fakes.CANNED_RESPONSES["json"]
+    replies = [
+        reply,
+        f"Here is the card:\n{reply}\nHope this helps!",
+        reply[:-1],
+        reply[: reply.rfind(",")],
+    ]
+    result = benchmark(lambda: [handlers._repair_json(r) for r in replies])
+    assert all(isinstance(r, dict) for r in result)
+
+
+def test_parse_llm_list(benchmark):
+    summary = fakes.CANNED_RESPONSES["segment-summary"]
+    knowledge = fakes.CANNED_RESPONSES["knowledge"]
+    replies = [summary, f"Here is the list:\n{summary}", knowledge, f"Sure!\n{knowledge}\n"]
+    benchmark(lambda: [handlers._parse_llm_list(r) for r in replies])
+
+
+def test_make_skill_id(benchmark):
+    tags = handlers._load_concept_tags()
+    positions = [
+        (video_id, segment_index, int(knowledge_index))
+        for video_id, segments in tags.items()
+        for segment_index, knowledge in segments.items()
+        for knowledge_index in knowledge
+    ]
+    # Untagged positions take the position-based fallback.
+    positions += [("untagged", 0, i) for i in range(10)]
+    result = benchmark(lambda: [handlers.make_skill_id(*p) for p in positions])
+    assert result[0].startswith("concept::")
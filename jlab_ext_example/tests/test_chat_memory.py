@@ -0,0 +1,112 @@
+"""Tests for the bounded, summarizing chat memory."""
+from jlab_ext_example import chat_memory
+
+
+def _exchange(memory, n, size=10):
+    memory.save_context({"input": f"q{n}" + "." * size}, {"output": f"a{n}"})
+
+
+def test_summaries_are_batched():
+    calls = []
+
+    def summarize(summary, turns):
+        calls.append([human[:2] for human, _ in turns])
+        return f"{summary}+{len(turns)}"
+
+    memory = chat_memory.SummarizingMemory(
+        max_recent=2, token_budget=10_000, summarize=summarize, summary_batch=3
+    )
+    for n in range(7):
+        _exchange(memory, n)
+    # Exchanges 0-4 have left the recent window; only full batches fold.
+    assert calls == [["q0", "q1", "q2"]]
+    assert memory.summary == "+3"
+    assert memory.stats()["pending_turns"] == 2
+
+
+def test_render_trims_pending_then_recent_then_summary():
+    memory = chat_memory.SummarizingMemory(max_recent=3, token_budget=10_000)
+    memory.restore(
+        {
+            "summary": "S" * 40,
+            "pending": [["p0", "x"], ["p1", "x"]],
+            "recent": [["r0", "x"], ["r1", "x"], ["r2", "x"]],
+        }
+    )
+    full = memory.render()
+    assert full.index("p0") < full.index("r0") < full.index("r2")
+
+    def fits_without(*dropped):
+        text = full
+        for turn in dropped:
+            text = text.replace(f"Human: {turn}\nAI: x\n", "")
+        return chat_memory.estimate_tokens(text)
+
+    memory.token_budget = fits_without("p0")
+    assert "p0" not in memory.render() and "p1" in memory.render()
+    memory.token_budget = fits_without("p0", "p1", "r0")
+    text = memory.render()
+    assert "p1" not in text and "r0" not in text and "r1" in text
+    # Down to the latest exchange, the summary is cut last.
+    memory.token_budget = 10
+    text = memory.render()
+    assert text.endswith("Human: r2\nAI: x")
+    assert "r1" not in text and "S" * 40 not in text
+
+
+def test_failed_refresh_keeps_the_batch_and_retries():
+    outcomes = [RuntimeError("LLM down"), "first summary"]
+
+    def summarize(summary, turns):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    memory = chat_memory.SummarizingMemory(
+        max_recent=1, token_budget=10_000, summarize=summarize, summary_batch=1
+    )
+    _exchange(memory, 0)
+    _exchange(memory, 1)
+    assert memory.summary == ""
+    assert memory.stats()["pending_turns"] == 1
+    assert memory.stats()["summary_failures"] == 1
+
+    _exchange(memory, 2)
+    assert memory.summary == "first summary"
+    assert memory.stats()["pending_turns"] == 0
+    assert memory.stats()["summary_refreshes"] == 1
+
+
+def test_over_budget_history_is_summarized_before_a_full_batch():
+    calls = []
+
+    def summarize(summary, turns):
+        calls.append(len(turns))
+        return "short"
+
+    memory = chat_memory.SummarizingMemory(
+        max_recent=1, token_budget=30, summarize=summarize, summary_batch=10
+    )
+    _exchange(memory, 0, size=80)
+    _exchange(memory, 1, size=80)
+    assert calls == [1]
+
+
+def test_to_dict_and_restore_round_trip():
+    memory = chat_memory.SummarizingMemory(max_recent=2, token_budget=10_000)
+    memory.restore(
+        {
+            "summary": "earlier",
+            "pending": [["p0", "a"]],
+            "recent": [["r0", "a"], ["r1", "a"]],
+            "summary_refreshes": 3,
+            "summary_failures": 1,
+        }
+    )
+    state = memory.to_dict()
+    restored = chat_memory.SummarizingMemory(max_recent=2, token_budget=10_000)
+    restored.restore(state)
+    assert restored.to_dict() == state
+    assert restored.render() == memory.render()
+    assert restored.stats() == memory.stats()
@@ -0,0 +1,63 @@
+"""Tests for the per-segment code index behind code-line selection."""
+import re
+
+from jlab_ext_example import code_index, handlers
+
+_BLOCK = "```r\\n" + "\\n".join(
+    [
+        "counts <- pets %>%",
+        "  filter(species == 'Dog') %>%",
+        "  count(name)",
+        "top <- counts %>% filter(n >= 200,",
+        "  n <= 900)",
+        "ggplot(top, aes(x = n))",
+    ]
+) + "\\n```"
+
+
+def test_index_scores_match_the_regex_rules_on_bundled_code():
+    for video_id in handlers._CODE_FILE_BY_VIDEO:
+        code_json = handlers.get_all_code(video_id)
+        for segment_index in code_json:
+            index = handlers.get_code_index(video_id, segment_index, code_json)
+            terms = {t for line in index.lines for t in re.findall(r"\w+", line)}
+            terms |= {"aes(x", "na.rm", "n >= 200"}
+            for term in terms:
+                expected = {
+                    i: score
+                    for i, line in enumerate(index.lines)
+                    if (score := code_index.term_score(term, line))
+                }
+                assert index.term_lines(term) == expected, term
+
+
+def test_lines_are_picked_by_call_definition_and_proximity():
+    index = code_index.CodeSegmentIndex(_BLOCK)
+    assert index.calls["filter"] == [1, 3]
+    assert index.definitions["counts"] == [0]
+    assert index.mentions["species"] == [1]
+    assert index.paren_balance[3] == 1
+
+    find = handlers._find_code_line_indices
+    # `filter` next to the `counts <- pets %>%` definition beats the later one.
+    assert find(index, "use 'filter' on 'pets'") == [1]
+    # A multi-line call is returned whole; lines already taught come last.
+    assert find(index, "use 'filter' on 'pets'", used_lines={1}) == [3, 4]
+    assert find(index, "use 'unknown'") == [0]
+
+
+def test_blanks_keep_the_lines_and_skip_strings_and_comments():
+    block = _BLOCK.replace("count(name)", "count(name) # filter")
+    index = code_index.CodeSegmentIndex(block)
+    blanked, missing = index.blank(
+        ["filter", "n <= 900", "aes(x = n)", "count()", "pivot"]
+    )
+    lines = blanked.split("\n")
+    assert len(lines) == len(index.block_lines)
+    assert lines[0] == "```r"
+    assert lines[2] == "  ___(species == 'Dog') %>%"
+    assert lines[3] == "  ___(name) # filter"
+    assert lines[4] == "top <- counts %>% ___(n >= 200,"
+    assert lines[5] == "  ___)"
+    assert lines[6] == "ggplot(top, ___)"
+    assert missing == ["pivot"]
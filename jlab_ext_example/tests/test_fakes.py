@@ -0,0 +1,327 @@
+"""Offline tests of the handlers and firebase_logger against fakes.py."""
+import ast
+import json
+import threading
+import time
+
+import pytest
+
+from jlab_ext_example import (
+    db,
+    fakes,
+    firebase_logger,
+    handlers,
+    metrics,
+    migrations,
+    outbox,
+)
+
+
+@pytest.fixture
+def fake_llm(tmp_path, monkeypatch):
+    # Every relative path (cache.db, redo log, lock dir) lands in tmp_path.
+    monkeypatch.chdir(tmp_path)
+    migrations.run_migrations(db.DB_PATH)
+    client = fakes.FakeGenaiClient()
+    monkeypatch.setattr(handlers, "_gemini_client", client)
+    handlers.USER_SESSIONS.clear()
+    return client
+
+
+@pytest.fixture
+def fake_rtdb(tmp_path, monkeypatch):
+    rtdb = fakes.FakeRTDB()
+    monkeypatch.setattr(firebase_logger, "_rtdb", rtdb)
+    monkeypatch.setattr(firebase_logger, "_firebase_configured", True)
+    monkeypatch.setattr(firebase_logger, "_firebase_enabled", True)
+    monkeypatch.setattr(
+        firebase_logger, "_outbox", outbox.Outbox(str(tmp_path / "outbox.db"))
+    )
+    return rtdb
+
+
+def test_fake_rtdb_follows_rtdb_semantics():
+    rtdb = fakes.FakeRTDB()
+    logs = rtdb.reference("chat_logs/u1")
+    first = logs.push({"n": 1, "video_id": None})
+    second = logs.push({"n": 2})
+    assert first.key < second.key
+    assert logs.child(first.key).get() == {"n": 1}
+
+    rtdb.reference("/").update({"sessions/u1/s/status": "done", "bkt_state/u1/k": 0.3})
+    assert rtdb.reference("sessions/u1").get() == {"s": {"status": "done"}}
+    with pytest.raises(ValueError):
+        rtdb.reference("/").update({"a": 1, "a/b": 2})
+
+    rtdb.reference("counts").transaction(lambda current: (current or 0) + 1)
+    assert rtdb.reference("counts").transaction(lambda current: current + 1) == 2
+
+    rtdb.reference("bkt_state/u1/k").delete()
+    assert rtdb.reference("bkt_state").get() is None
+
+
+def test_firebase_logger_writes_reach_the_fake_rtdb(fake_rtdb):
+    firebase_logger.log_session_start("u1", "s1", {"video_id": "v"})
+    firebase_logger.log_chat_message("u1", "s1", "user_question", "why?")
+    firebase_logger.log_bkt_update("u1", "s1", "k1", 0.1, 0.4, True, "multiple-choice")
+    firebase_logger.log_session_end("u1", "s1")
+    firebase_logger.drain()
+
+    session = fake_rtdb.reference("sessions/u1/s1").get()
+    assert session["status"] == "completed"
+    assert session["user_metadata"] == {"video_id": "v"}
+    [message] = fake_rtdb.reference("chat_logs/u1/s1").get().values()
+    assert message["content"] == "why?"
+    assert fake_rtdb.reference("bkt_state/u1/k1/mastery").get() == 0.4
+    assert firebase_logger.assign_condition_balanced("u1", ["a", "b"]) in ("a", "b")
+
+
+async def test_teaching_sequence_runs_offline(jp_fetch, fake_llm):
+    user = {"userId": "test_full_offline", "videoId": "EF4A4OtQprg"}
+    await jp_fetch(
+        "jlab_ext_example",
+        "update_seq",
+        method="POST",
+        body=json.dumps(
+            dict(user, segmentIndex=3, category="Preprocess and Visualize the data")
+        ),
+    )
+    assert handlers.USER_SESSIONS["test_full_offline"]["cur_seq"]
+    assert fake_llm.calls["knowledge"] == 1
+
+    body = dict(
+        user,
+        notebook={"cells": []},
+        question="",
+        segmentIndex=3,
+        kernelType="ir",
+        selectedChoice="",
+    )
+    response = await jp_fetch(
+        "jlab_ext_example", "chat", method="POST", body=json.dumps(body)
+    )
+    assert json.loads(response.body)["message"]
+
+
+async def test_chat_llm_metrics_are_per_move_not_per_user(jp_fetch, fake_llm):
+    metrics.reset()
+    for uid in ("test_full_metrics_1", "test_full_metrics_2"):
+        handlers.get_user_session(uid)["cur_seq"] = [
+            {
+                "knowledge": "To count the rows one need to use 'count'",
+                "interaction": "annotated-code",
+                "prompt": "Explain the code.",
+                "parameters": ["knowledge", "code-line"],
+            }
+        ]
+        body = {
+            "userId": uid,
+            "videoId": "EF4A4OtQprg",
+            "notebook": {"cells": []},
+            "question": "",
+            "segmentIndex": 3,
+            "kernelType": "ir",
+            "selectedChoice": "",
+        }
+        await jp_fetch("jlab_ext_example", "chat", method="POST", body=json.dumps(body))
+        body["question"] = "Why count?"
+        await jp_fetch("jlab_ext_example", "chat", method="POST", body=json.dumps(body))
+
+    text = metrics.render()
+    assert 'tutorly_llm_seconds_count{site="chat-annotated-code"} 2' in text
+    assert 'tutorly_llm_seconds_count{site="chat-question"} 2' in text
+    assert "ask_async" not in text and "ask_stream" not in text
+    assert "user_id" not in text
+    assert "tutorly_chat_prompt_bots 2" in text
+    assert "tutorly_sessions_bytes_max" in text
+
+
+async def test_session_end_writes_bkt_and_teaching_state(jp_fetch, fake_llm):
+    uid = "test_full_session_end"
+    session = handlers.get_user_session(uid)
+    session["cur_seq"] = [{"interaction": "annotated-code", "skill_id": "s::1"}]
+    handlers.checkpoint_teaching_state(uid, session)
+    bkt = {"s::1": {"probMastery": 0.4, "n_observations": 1}}
+    handlers.mark_bkt_dirty(uid, bkt, ["s::1"])
+
+    await jp_fetch(
+        "jlab_ext_example",
+        "log_session_end",
+        method="POST",
+        body=json.dumps({"userId": uid, "sessionId": "s1", "reason": "finished"}),
+    )
+    assert handlers.TEACHING_WRITER.pending(lambda key: key[0] == uid) == {}
+    assert handlers.BKT_WRITER.pending(lambda key: key[0] == uid) == {}
+    row = db.query_one("SELECT state FROM teaching_state WHERE user_id = ?", (uid,))
+    assert json.loads(row[0])["cur_seq"] == session["cur_seq"]
+    assert db.query_one(
+        "SELECT prob_mastery FROM bkt_skill_state WHERE user_id = ?", (uid,)
+    ) == (0.4,)
+
+
+def test_code_is_blanked_locally_unless_a_term_is_not_in_it(fake_llm, monkeypatch):
+    code_json = handlers.get_all_code("EF4A4OtQprg")
+    terms = ["filter", "n()"]
+    monkeypatch.setattr(
+        handlers, "get_function_attribute_by_segment", lambda *args: terms
+    )
+    blanked = handlers._get_code_with_blank("EF4A4OtQprg", 3, code_json)
+    assert "  ___(species == \"Dog\")" in blanked.split("\n")
+    assert fake_llm.calls["code-with-blank"] == 0
+
+    # The canned reply has fewer lines than the block, so it is not used.
+    terms.append("bar chart")
+    assert handlers._get_code_with_blank("EF4A4OtQprg", 3, code_json) == blanked
+    assert fake_llm.calls["code-with-blank"] == 1
+
+
+def _sse_events(body):
+    events = []
+    for frame in body.decode().split("\n\n"):
+        if frame:
+            event, data = frame.split("\n")
+            events.append((event[len("event: ") :], json.loads(data[len("data: ") :])))
+    return events
+
+
+async def test_chat_stream_is_an_event_stream_with_or_without_tokens(jp_fetch, fake_llm):
+    body = {
+        "userId": "test_control_stream",
+        "videoId": "EF4A4OtQprg",
+        "notebook": {"cells": []},
+        "question": "",
+        "segmentIndex": 3,
+        "kernelType": "ir",
+        "selectedChoice": "",
+    }
+    # No question: a control acknowledgement, which streams no tokens.
+    response = await jp_fetch(
+        "jlab_ext_example", "chat_stream", method="POST", body=json.dumps(body)
+    )
+    assert response.headers["Content-Type"] == "text/event-stream"
+    assert [event for event, _ in _sse_events(response.body)] == ["done"]
+
+    body["question"] = "Why count by breed?"
+    response = await jp_fetch(
+        "jlab_ext_example", "chat_stream", method="POST", body=json.dumps(body)
+    )
+    assert response.headers["Content-Type"] == "text/event-stream"
+    events = _sse_events(response.body)
+    assert {event for event, _ in events[:-1]} == {"token"}
+    assert events[-1][0] == "done"
+    streamed = "".join(data["text"] for _, data in events[:-1])
+    assert events[-1][1]["message"] == streamed.strip()
+
+
+async def test_chat_stream_ends_with_an_error_event_after_it_started(
+    jp_fetch, fake_llm, monkeypatch
+):
+    log_chat_message = firebase_logger.log_chat_message
+
+    def fail_on_reply(**kwargs):
+        # The reply is logged after it has been streamed.
+        if kwargs["message_type"] == "ai_response":
+            raise RuntimeError("logging down")
+        return log_chat_message(**kwargs)
+
+    monkeypatch.setattr(firebase_logger, "log_chat_message", fail_on_reply)
+    body = {
+        "userId": "test_control_stream_error",
+        "videoId": "EF4A4OtQprg",
+        "notebook": {"cells": []},
+        "question": "Why count by breed?",
+        "segmentIndex": 3,
+        "kernelType": "ir",
+        "selectedChoice": "",
+    }
+    response = await jp_fetch(
+        "jlab_ext_example", "chat_stream", method="POST", body=json.dumps(body)
+    )
+    assert response.code == 200
+    events = _sse_events(response.body)
+    assert events[0][0] == "token"
+    assert events[-1][0] == "error"
+
+
+def test_segment_polls_read_progress_without_holding_llm_workers(fake_llm, monkeypatch):
+    release = threading.Event()
+    window = [{"category": "Load packages/data", "start": 0, "end": 600}]
+
+    def segment(video_id, done_windows, on_window):
+        on_window(0, 2, 600, window)
+        release.wait(5)
+        return [dict(window[0], end=1200)]
+
+    monkeypatch.setattr(handlers, "get_video_segment", segment)
+    # Every poll returns at once, with whatever windows are stored so far.
+    deadline = time.monotonic() + 5
+    while True:
+        segments, complete = handlers.get_segments_progress("uncached")
+        if segments or time.monotonic() > deadline:
+            break
+        time.sleep(0.01)
+    assert (segments, complete) == (window, False)
+    assert handlers.start_segmentation("uncached") is handlers.start_segmentation(
+        "uncached"
+    )
+
+    release.set()
+    handlers.start_segmentation("uncached").result(5)
+    assert handlers.get_segments_progress("uncached") == (
+        [dict(window[0], end=1200)],
+        True,
+    )
+
+
+async def test_move_after_a_multiple_choice_answer_sees_the_choice(
+    jp_fetch, fake_llm, monkeypatch
+):
+    uid = "test_full_prefetch"
+    knowledge = "To keep the dogs one need to use 'filter' on 'seattle_pets'"
+    handlers.get_user_session(uid)["cur_seq"] = [
+        {
+            "knowledge": knowledge,
+            "skill_id": "s::1",
+            "method": "Coaching",
+            "interaction": interaction,
+            "prompt": "Ask about the code.",
+            "parameters": ["knowledge"],
+            "need-response": True,
+        }
+        for interaction in ("multiple-choice", "annotated-code")
+    ]
+    asked = []
+    generate_content = fake_llm.aio.models.generate_content
+
+    async def recording_generate_content(model, contents, config):
+        asked.append(contents)
+        return await generate_content(model, contents, config)
+
+    monkeypatch.setattr(
+        fake_llm.aio.models, "generate_content", recording_generate_content
+    )
+    body = {
+        "userId": uid,
+        "videoId": "EF4A4OtQprg",
+        "notebook": {"cells": []},
+        "question": "",
+        "segmentIndex": 3,
+        "kernelType": "ir",
+        "selectedChoice": "",
+    }
+    response = await jp_fetch(
+        "jlab_ext_example", "chat", method="POST", body=json.dumps(body)
+    )
+    assert json.loads(response.body)["interaction"] == "multiple-choice"
+    hits = handlers.MOVE_PREFETCHER.stats()["hits"]
+
+    # The answer adds the student's choice to the next move's input, so its
+    # reply is generated now rather than ahead of time.
+    body["selectedChoice"] = "arrange"
+    response = await jp_fetch(
+        "jlab_ext_example", "chat", method="POST", body=json.dumps(body)
+    )
+    assert json.loads(response.body)["interaction"] == "annotated-code"
+    assert handlers.MOVE_PREFETCHER.stats()["hits"] == hits
+    move_input = ast.literal_eval(ast.literal_eval(asked[-1])["input"])
+    assert move_input["student's choice"] == "arrange"
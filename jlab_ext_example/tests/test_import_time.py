@@ -0,0 +1,54 @@
+"""Importing the server extension must stay cheap: it runs on every spawn."""
+import json
+import os
+import re
+import subprocess
+import sys
+
+import jlab_ext_example
+
+# Loaded on first use only (see the imports at the top of handlers.py and
+# firebase_logger.initialize_firebase).
+DEFERRED_MODULES = [
+    "firebase_admin",
+    "google.genai",
+    "googleapiclient",
+    "isodate",
+    "pandas",
+    "sklearn",
+    "youtube_transcript_api",
+]
+
+# Cumulative `python -X importtime` budget for `import jlab_ext_example`,
+# with jupyter_server (which the extension cannot load without) already
+# imported. Eager heavy imports cost seconds, well past it.
+IMPORT_BUDGET_MS = float(os.environ.get("TUTORLY_IMPORT_BUDGET_MS", "1000"))
+
+_SCRIPT = """
+import json, sys
+import jupyter_server.base.handlers, jupyter_server.utils
+import jlab_ext_example
+print(json.dumps(sorted(sys.modules)))
+"""
+
+
+def test_heavy_dependencies_are_not_imported_at_load(tmp_path):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(jlab_ext_example.__file__)))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [root, env.get("PYTHONPATH")]))
+    env.pop("TUTORLY_LLM_BACKEND", None)
+    env.pop("TUTORLY_FIREBASE_BACKEND", None)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _SCRIPT],
+        cwd=tmp_path,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    loaded = set(json.loads(result.stdout.strip().splitlines()[-1]))
+    assert [m for m in DEFERRED_MODULES if m in loaded] == []
+
+    match = re.search(r"\|\s*(\d+) \| jlab_ext_example$", result.stderr, re.MULTILINE)
+    assert match, "no importtime line for jlab_ext_example"
+    assert int(match.group(1)) / 1000 < IMPORT_BUDGET_MS
@@ -0,0 +1,104 @@
+"""Tests for the opt-in persistent LLM response cache."""
+import pytest
+
+from jlab_ext_example import llm_cache
+
+REQUEST = ("gemini", "Extract the knowledge.", "transcript: ...", 0.7, None)
+
+
+@pytest.fixture
+def enable_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(llm_cache, "_cache", None)
+    monkeypatch.setattr(llm_cache, "_cache_failed", False)
+    monkeypatch.setenv("TUTORLY_LLM_CACHE_PATH", str(tmp_path / "llm_cache.db"))
+
+    def enable(value="1"):
+        monkeypatch.setenv("TUTORLY_LLM_CACHE", value)
+        return llm_cache.get_cache()
+
+    return enable
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return llm_cache.LLMResponseCache(str(tmp_path / "llm_cache.db"), 1024 * 1024)
+
+
+def _age(cache, key, column, seconds):
+    cache._conn.execute(
+        f"UPDATE llm_cache SET {column} = {column} - ? WHERE key = ?", (seconds, key)
+    )
+    cache._conn.commit()
+
+
+def _last_access(cache, key):
+    return cache._conn.execute(
+        "SELECT last_access FROM llm_cache WHERE key = ?", (key,)
+    ).fetchone()[0]
+
+
+def test_cache_is_off_unless_enabled(enable_cache, monkeypatch):
+    monkeypatch.delenv("TUTORLY_LLM_CACHE", raising=False)
+    assert llm_cache.get_cache() is None
+    assert enable_cache("0") is None
+    cache = enable_cache("true")
+    assert isinstance(cache, llm_cache.LLMResponseCache)
+    assert llm_cache.get_cache() is cache
+
+
+def test_key_covers_every_request_field():
+    key = llm_cache.make_key(*REQUEST)
+    assert key == llm_cache.make_key(*REQUEST)
+    assert key == llm_cache.make_key("gemini", REQUEST[1], REQUEST[2], 0.7, None)
+    assert llm_cache.make_key("g", "", "", 0, None) == llm_cache.make_key(
+        "g", "", "", 0.0, None
+    )
+    for i, other in enumerate(["flash", "Other.", "other", 0.0, "application/json"]):
+        changed = list(REQUEST)
+        changed[i] = other
+        assert llm_cache.make_key(*changed) != key
+
+
+def test_entries_expire_per_call_site(cache):
+    cache.put("card", "modeling-card", "card text")
+    cache.put("segments", "segment-summary", "segments")
+    _age(cache, "card", "created_at", 29 * llm_cache._DAY)
+    _age(cache, "segments", "created_at", 365 * llm_cache._DAY)
+    assert cache.get("card", "modeling-card") == "card text"
+    assert cache.get("segments", "segment-summary") == "segments"
+
+    _age(cache, "card", "created_at", 2 * llm_cache._DAY)
+    assert cache.get("card", "modeling-card") is None
+    assert cache.stats()["modeling-card"] == {"hits": 1, "misses": 1}
+    # Sites without a CALL_SITE_TTLS entry get DEFAULT_TTL.
+    cache.put("card", "unknown-site", "card text")
+    _age(cache, "card", "created_at", llm_cache.DEFAULT_TTL + 1)
+    assert cache.get("card", "unknown-site") is None
+
+
+def test_empty_replies_are_not_cached(cache):
+    cache.put("key", "knowledge", "")
+    assert cache.get("key", "knowledge") is None
+
+
+def test_hits_rewrite_the_access_time_only_once_it_is_stale(cache):
+    cache.put("key", "knowledge", "text")
+    _age(cache, "key", "last_access", llm_cache.ACCESS_RESOLUTION / 2)
+    touched = _last_access(cache, "key")
+    assert cache.get("key", "knowledge") == "text"
+    assert _last_access(cache, "key") == touched
+
+    _age(cache, "key", "last_access", llm_cache.ACCESS_RESOLUTION)
+    assert cache.get("key", "knowledge") == "text"
+    assert _last_access(cache, "key") > touched
+
+
+def test_forget_drops_one_entry(enable_cache):
+    cache = enable_cache()
+    key = llm_cache.make_key(*REQUEST)
+    other = llm_cache.make_key("gemini", "Other.", "", 0.7, None)
+    cache.put(key, "knowledge", "unusable")
+    cache.put(other, "knowledge", "fine")
+    llm_cache.forget(*REQUEST)
+    assert cache.get(key, "knowledge") is None
+    assert cache.get(other, "knowledge") == "fine"
@@ -0,0 +1,37 @@
+"""Tests for the sharded metrics registry and its Prometheus endpoint."""
+import threading
+
+from jlab_ext_example import metrics
+
+
+def test_shards_from_every_thread_are_summed():
+    metrics.reset()
+
+    def record():
+        for _ in range(1000):
+            metrics.inc("test_events_total", kind="a")
+        metrics.observe("test_latency_seconds", 0.003, kind="a")
+
+    threads = [threading.Thread(target=record) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    text = metrics.render()
+    assert 'test_events_total{kind="a"} 4000' in text
+    assert 'test_latency_seconds_bucket{kind="a",le="0.0025"} 0' in text
+    assert 'test_latency_seconds_bucket{kind="a",le="0.005"} 4' in text
+    assert 'test_latency_seconds_bucket{kind="a",le="+Inf"} 4' in text
+    assert 'test_latency_seconds_count{kind="a"} 4' in text
+
+
+async def test_metrics_endpoint_reports_request_latency(jp_fetch):
+    await jp_fetch("jlab_ext_example", "segments")
+    response = await jp_fetch("jlab_ext_example", "metrics")
+
+    assert response.headers["Content-Type"].startswith("text/plain")
+    text = response.body.decode()
+    assert "# TYPE tutorly_http_request_seconds histogram" in text
+    assert 'tutorly_http_requests_total{handler="SegmentHandler",status="200"}' in text
+    assert "tutorly_bkt_writer_dirty" in text
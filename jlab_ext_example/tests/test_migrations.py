@@ -0,0 +1,95 @@
+"""Tests for the cache.db schema migrations."""
+import json
+import sqlite3
+
+from jlab_ext_example import db, handlers, migrations
+
+RUBRIC = {"timestamp": "2025-03-01T10:00:00", "mean": 0.67, "is_correct": True}
+
+
+def _legacy_database(path, blobs):
+    # bkt_params_cache as the pre-migration initialze_database created it.
+    conn = sqlite3.connect(path)
+    conn.execute(
+        """
+    CREATE TABLE IF NOT EXISTS bkt_params_cache (
+        user_id TEXT PRIMARY KEY,
+        skills_probMastery TEXT NOT NULL
+    );"""
+    )
+    conn.executemany(
+        "INSERT INTO bkt_params_cache (user_id, skills_probMastery) VALUES (?, ?)",
+        blobs.items(),
+    )
+    conn.commit()
+    conn.close()
+
+
+def test_legacy_bkt_blobs_become_skill_rows():
+    _legacy_database(
+        db.DB_PATH,
+        {
+            # The original shape: skill -> probMastery.
+            "u_float": json.dumps({"use 'geom_boxplot'": 0.1, "use 'filter'": 0.42}),
+            # The later shape, with counts and the articulation rubric log.
+            "u_dict": json.dumps(
+                {
+                    "use 'count'": {
+                        "probMastery": 0.73,
+                        "n_observations": 4,
+                        "rubric_history": [RUBRIC],
+                    },
+                    "use 'arrange'": {"n_observations": 1},
+                }
+            ),
+            "u_broken": "{not json",
+        },
+    )
+    assert migrations.run_migrations(db.DB_PATH) == len(migrations.MIGRATIONS)
+    # Already applied: nothing is copied twice.
+    migrations.run_migrations(db.DB_PATH)
+
+    assert handlers.init_bkt_params("u_float") == {
+        "use 'geom_boxplot'": {"probMastery": 0.1, "n_observations": 0},
+        "use 'filter'": {"probMastery": 0.42, "n_observations": 0},
+    }
+    assert handlers.init_bkt_params("u_dict") == {
+        "use 'count'": {"probMastery": 0.73, "n_observations": 4},
+        "use 'arrange'": {"probMastery": 0.1, "n_observations": 1},
+    }
+    assert handlers.init_bkt_params("u_broken") == {}
+    assert db.query_all(
+        "SELECT user_id, skill_id, created_at, record FROM rubric_events"
+    ) == [("u_dict", "use 'count'", RUBRIC["timestamp"], json.dumps(RUBRIC))]
+    # The legacy table is kept for auditing.
+    assert db.query_one("SELECT COUNT(*) FROM bkt_params_cache") == (3,)
+
+
+def test_bkt_writes_upsert_only_the_touched_skill():
+    _legacy_database(
+        db.DB_PATH,
+        {"u1": json.dumps({"use 'filter'": 0.42, "use 'count'": 0.2})},
+    )
+    migrations.run_migrations(db.DB_PATH)
+    bkt = handlers.init_bkt_params("u1")
+    bkt["use 'filter'"] = {"probMastery": 0.9, "n_observations": 1}
+    bkt["use 'mutate'"] = {"probMastery": 0.3, "n_observations": 1}
+    bkt["use 'count'"]["probMastery"] = 0.99  # Not written below.
+    handlers.bkt_params_to_database("u1", bkt, ["use 'filter'", "use 'mutate'"])
+
+    assert handlers.init_bkt_params("u1") == {
+        "use 'filter'": {"probMastery": 0.9, "n_observations": 1},
+        "use 'count'": {"probMastery": 0.2, "n_observations": 0},
+        "use 'mutate'": {"probMastery": 0.3, "n_observations": 1},
+    }
+
+    # Queued marks are visible before the write-behind flush lands them.
+    bkt["use 'count'"] = {"probMastery": 0.5, "n_observations": 1}
+    handlers.mark_bkt_dirty("u1", bkt, ["use 'count'"])
+    assert handlers.init_bkt_params("u1")["use 'count'"] == bkt["use 'count'"]
+    handlers.BKT_WRITER.flush()
+    assert db.query_one(
+        "SELECT prob_mastery, n_observations FROM bkt_skill_state"
+        " WHERE user_id = ? AND skill_id = ?",
+        ("u1", "use 'count'"),
+    ) == (0.5, 1)
@@ -0,0 +1,56 @@
+"""Tests for the durable Firebase outbox and its replayer."""
+import pytest
+
+from jlab_ext_example import firebase_logger, outbox
+
+
+@pytest.fixture
+def box(tmp_path, monkeypatch):
+    box = outbox.Outbox(str(tmp_path / "outbox.db"))
+    monkeypatch.setattr(firebase_logger, "_outbox", box)
+    return box
+
+
+def test_unsent_events_survive_a_restart(tmp_path):
+    path = str(tmp_path / "outbox.db")
+    first = outbox.Outbox(path)
+    first.append({"a/1": 1})
+    first.append({"a/2": 2})
+    first.ack(first.next_batch(1)[0][0])
+
+    reopened = outbox.Outbox(path)
+    assert reopened.pending() == 1
+    assert [writes for _, writes in reopened.next_batch(10)] == [{"a/2": 2}]
+
+
+def test_drain_keeps_events_until_the_write_succeeds(box):
+    remote = {}
+    box.append({"chat_logs/u/s/k1": {"content": "hi"}})
+    box.append({"bkt_state/u/skill": {"mastery": 0.4}})
+
+    def offline(writes):
+        raise RuntimeError("unreachable")
+
+    with pytest.raises(RuntimeError):
+        firebase_logger.drain(send=offline)
+    assert box.pending() == 2
+
+    assert firebase_logger.drain(send=remote.update) == 2
+    assert box.pending() == 0
+    assert remote == {
+        "chat_logs/u/s/k1": {"content": "hi"},
+        "bkt_state/u/skill": {"mastery": 0.4},
+    }
+
+
+def test_drain_never_batches_a_path_with_its_ancestor(box):
+    batches = []
+    box.append({"sessions/u/s": {"status": "active"}})
+    box.append({"sessions/u/s/status": "completed"})
+
+    firebase_logger.drain(send=batches.append)
+
+    assert batches == [
+        {"sessions/u/s": {"status": "active"}},
+        {"sessions/u/s/status": "completed"},
+    ]
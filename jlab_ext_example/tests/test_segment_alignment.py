@@ -0,0 +1,46 @@
+"""Tests for aligning segment summaries to transcript cues."""
+from jlab_ext_example import handlers
+
+_TOPICS = [
+    "hello welcome screencast introduce tidy tuesday project",
+    "load readr package download csv dataset",
+    "glimpse columns rows species names dataset",
+    "ggplot histogram bars counts plot",
+    "interpret chart skewed distribution outliers trend",
+]
+
+
+def _transcript(cues_per_topic=12):
+    cues = []
+    for topic in _TOPICS:
+        for _ in range(cues_per_topic):
+            cues.append({"text": topic, "start": 5.0 * len(cues) + 0.7})
+    return cues
+
+
+def _summaries(topics):
+    return [{"category": "c", "summary": topic} for topic in topics]
+
+
+def test_starts_are_monotonic_and_windows_do_not_overlap():
+    cues = _transcript()
+    starts = handlers.align_summaries_to_transcript(cues, _summaries(_TOPICS))
+    assert starts == sorted(set(starts))
+    # Each summary starts inside its own topic's stretch of cues.
+    for i, start in enumerate(starts):
+        assert 12 * i <= start // 5 < 12 * (i + 1)
+
+
+def test_more_summaries_than_cues_stay_in_order():
+    cues = _transcript(cues_per_topic=1)[:3]
+    summaries = _summaries(_TOPICS + [" ".join(_TOPICS)])
+    starts = handlers.align_summaries_to_transcript(cues, summaries)
+    assert len(starts) == len(summaries)
+    assert starts == sorted(starts)
+    assert set(starts) <= {int(cue["start"]) for cue in cues}
+
+
+def test_empty_transcript_or_no_summaries():
+    summaries = _summaries(_TOPICS[:2])
+    assert handlers.align_summaries_to_transcript([], summaries) == [0, 0]
+    assert handlers.align_summaries_to_transcript(_transcript(), []) == []
@@ -0,0 +1,138 @@
+"""Tests for the bounded per-user session store."""
+import pytest
+
+from jlab_ext_example import db, handlers, migrations, session_store
+
+
+@pytest.fixture
+def make_store(tmp_path):
+    path = str(tmp_path / "cache.db")
+    migrations.run_migrations(path)
+
+    def make(**kwargs):
+        return session_store.SessionStore(
+            create=lambda uid: handlers._new_session(),
+            dump=handlers._dump_session,
+            load=handlers._load_session,
+            path=path,
+            **kwargs,
+        )
+
+    return make
+
+
+def test_evicted_session_is_restored_with_its_conversation(make_store):
+    store = make_store(max_sessions=1)
+    session = store.get("u1")
+    session["cur_seq"] = [{"interaction": "multiple-choice", "knowledge": "k"}]
+    session["correct_answer_buffer"] = "count"
+    session["bkt_params"] = {"concept::x": {"probMastery": 0.4, "n_observations": 2}}
+    handlers._segment_taught_lines(session, "EF4A4OtQprg", 3).add(7)
+    session["chat_bot"] = handlers.initialize_chat_server("ir")
+    session["chat_bot"].memory.save_context({"input": "why?"}, {"output": "because"})
+
+    store.get("u2")
+    assert "u1" not in store
+    assert store.stats()["spills"] == 1
+
+    restored = store.get("u1")
+    assert restored["cur_seq"] == session["cur_seq"]
+    assert restored["correct_answer_buffer"] == "count"
+    assert handlers._segment_taught_lines(restored, "EF4A4OtQprg", 3) == {7}
+    assert restored["chat_bot"].kernel_type == "R"
+    assert "Human: why?\nAI: because" in restored["chat_bot"].memory.render()
+    # BKT comes back from bkt_skill_state via init_bkt_params instead.
+    assert restored["bkt_params"] == {}
+    assert store.stats()["loads"] == 1
+
+
+def test_busy_sessions_are_never_spilled(make_store):
+    busy = {"u1"}
+    store = make_store(idle_seconds=0.0, is_busy=lambda uid: uid in busy)
+    store.get("u1")
+    store.get("u2")
+    store.sweep(keep="u3")
+    assert "u1" in store and "u2" not in store
+    assert set(store.sizes()) == {"u1"}
+    assert store.sizes()["u1"]["bytes"] > 0
+
+
+def test_sweeps_only_measure_sessions_used_since_the_last_one(make_store):
+    dumped = []
+
+    def dump(session):
+        dumped.append(session["uid"])
+        return handlers._dump_session(session)
+
+    store = make_store(sweep_interval=3600.0)
+    store.dump = dump
+    store.create = lambda uid: dict(handlers._new_session(), uid=uid)
+    for uid in ("u1", "u2", "u3"):
+        store.get(uid)
+    dumped.clear()
+
+    store.sweep()
+    assert dumped == ["u3"]  # Still being changed by the last get()'s caller.
+    dumped.clear()
+    store.sweep()
+    assert dumped == []
+
+    store["u1"]["correct_answer_buffer"] = "x" * 1000
+    store.get("u1")
+    store.sweep(keep="u1")
+    assert dumped == ["u1"]
+    assert store.sizes()["u1"]["bytes"] >= store.sizes()["u2"]["bytes"] + 1000
+
+    # Spilling dumps the victim once more for its record.
+    dumped.clear()
+    store.max_sessions = 2
+    assert store.sweep(keep="u1") == 1
+    assert "u2" not in store and dumped == ["u1", "u2"]
+
+
+async def test_spilling_a_session_drops_its_idle_user_lock(make_store, monkeypatch):
+    store = make_store(
+        max_sessions=1,
+        is_busy=handlers._session_busy,
+        on_evict=handlers._session_evicted,
+    )
+    monkeypatch.setattr(handlers, "_USER_LOCKS", {})
+    store.get("u1")
+    async with handlers._user_lock("u1"):
+        store.get("u2")
+    assert "u1" in store and "u1" in handlers._USER_LOCKS
+
+    handlers._user_lock("u2")
+    store.get("u3")
+    assert "u1" not in store and "u2" not in store
+    assert handlers._USER_LOCKS == {}
+
+
+def test_teaching_sequence_survives_a_restart(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    migrations.run_migrations(db.DB_PATH)
+    store = session_store.SessionStore(
+        create=handlers._create_session,
+        dump=handlers._dump_session,
+        load=handlers._load_session,
+    )
+    monkeypatch.setattr(handlers, "USER_SESSIONS", store)
+    session = handlers.get_user_session("u1")
+    session["cur_seq"] = [
+        {"interaction": "multiple-choice", "skill_id": "s::1"},
+        {"interaction": "fill-in-blanks", "skill_id": "s::1"},
+    ]
+    session["cur_seq"].pop(0)
+    session["correct_answer_buffer"] = "count"
+    handlers._segment_taught_lines(session, "EF4A4OtQprg", 3).add(7)
+    handlers.checkpoint_teaching_state("u1", session)
+    handlers.TEACHING_WRITER.flush()
+
+    # A restarted server has no sessions in memory.
+    store.clear()
+    restored = handlers.get_user_session("u1")
+    assert restored is not session
+    assert restored["cur_seq"] == [{"interaction": "fill-in-blanks", "skill_id": "s::1"}]
+    assert restored["correct_answer_buffer"] == "count"
+    assert handlers._segment_taught_lines(restored, "EF4A4OtQprg", 3) == {7}
+    assert handlers.get_user_session("u2")["cur_seq"] == []
@@ -0,0 +1,74 @@
+"""Tests for single-flight coalescing of shared content generation."""
+import threading
+import time
+
+from jlab_ext_example import singleflight
+
+FOLLOWERS = 8
+
+
+def test_followers_get_the_result_untouched_by_the_leader():
+    flight = singleflight.SingleFlight()
+    started = threading.Barrier(FOLLOWERS + 1)
+    runs = []
+    results = {}
+
+    def generate():
+        runs.append(1)
+        started.wait()
+        time.sleep(0.05)  # Let the followers block on the flight.
+        return {"segments": [{"category": "c", "start": i} for i in range(200)]}
+
+    def leader():
+        result = flight.run("video", generate)
+        # Segments are annotated in place downstream.
+        for segment in result["segments"]:
+            segment["start"] = -1
+            segment["annotated"] = True
+        result["segments"].clear()
+        results["leader"] = result
+
+    def follower(n):
+        started.wait()
+        results[n] = flight.run("video", lambda: runs.append(1))
+
+    threads = [threading.Thread(target=leader)]
+    threads += [threading.Thread(target=follower, args=(n,)) for n in range(FOLLOWERS)]
+    threads[0].start()
+    time.sleep(0.01)  # The leader must claim the key first.
+    for thread in threads[1:]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(runs) == 1
+    expected = [{"category": "c", "start": i} for i in range(200)]
+    followers = [results[n] for n in range(FOLLOWERS)]
+    assert all(result["segments"] == expected for result in followers)
+    assert len({id(result) for result in followers}) == FOLLOWERS
+    assert results["leader"]["segments"] == []
+
+
+def test_followers_get_the_leaders_exception():
+    flight = singleflight.SingleFlight()
+    release = threading.Event()
+    errors = []
+
+    def fail():
+        release.wait(5)
+        raise ValueError("LLM down")
+
+    def call():
+        try:
+            flight.run("video", fail)
+        except ValueError as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(errors) == 3
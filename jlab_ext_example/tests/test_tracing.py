@@ -0,0 +1,61 @@
+"""Tests for request tracing spans."""
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from jlab_ext_example import tracing
+
+
+def _read_spans(path):
+    with open(path) as f:
+        return {span["name"]: span for span in map(json.loads, f)}
+
+
+async def test_spans_nest_across_awaits_and_executor_threads(tmp_path, monkeypatch):
+    path = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(tracing, "TRACE_PATH", str(path))
+    monkeypatch.setattr(tracing, "TRACE_SAMPLE", 1.0)
+
+    def blocking_stage():
+        with tracing.span("inner", rows=3):
+            pass
+
+    @tracing.traced()
+    async def stage():
+        await asyncio.sleep(0)
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(1) as pool:
+            await loop.run_in_executor(pool, tracing.bind(blocking_stage))
+
+    with tracing.trace("turn", user_id="u1"):
+        await stage()
+        tracing.annotate(interaction="fill-in-blanks")
+
+    spans = _read_spans(path)
+    assert set(spans) == {"turn", "stage", "blocking_stage", "inner"}
+    root = spans["turn"]
+    assert root["parent_id"] is None
+    assert root["interaction"] == "fill-in-blanks"
+    assert spans["stage"]["parent_id"] == root["span_id"]
+    assert spans["blocking_stage"]["parent_id"] == spans["stage"]["span_id"]
+    assert spans["inner"]["parent_id"] == spans["blocking_stage"]["span_id"]
+    assert spans["inner"]["rows"] == 3
+    assert {s["trace_id"] for s in spans.values()} == {root["trace_id"]}
+
+
+def test_only_slow_traces_are_kept_when_unsampled(tmp_path, monkeypatch):
+    path = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(tracing, "TRACE_PATH", str(path))
+    monkeypatch.setattr(tracing, "TRACE_SAMPLE", 0.0)
+    monkeypatch.setattr(tracing, "TRACE_SLOW_MS", 50.0)
+
+    with tracing.trace("fast"):
+        pass
+    assert not path.exists()
+
+    with tracing.trace("slow"):
+        tracing.record("llm", time.perf_counter() - 0.1, site="get_knowledge")
+        with tracing.span("stage"):
+            time.sleep(0.06)
+    assert set(_read_spans(path)) == {"slow", "llm", "stage"}
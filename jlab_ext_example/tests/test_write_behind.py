@@ -0,0 +1,87 @@
+"""Tests for the write-behind queue and its redo log."""
+import glob
+
+import pytest
+
+from jlab_ext_example import write_behind
+
+# Long enough that the flusher thread never runs during a test.
+IDLE = 3600
+
+
+def _segments(redo_path):
+    return sorted(glob.glob(glob.escape(redo_path) + ".*"))
+
+
+def test_marks_survive_a_crash_and_are_replayed(tmp_path):
+    redo_path = str(tmp_path / "bkt_redo.log")
+    crashed = write_behind.WriteBehind(lambda entries: None, redo_path, IDLE)
+    crashed.mark(("u1", "filter"), {"mastery": 0.3})
+    crashed.mark(("u1", "filter"), {"mastery": 0.5})
+    crashed.mark(("u2", "mutate"), {"mastery": 0.1})
+    # The process dies here: no flush(), no close().
+    assert _segments(redo_path)
+
+    written = []
+    restarted = write_behind.WriteBehind(written.append, redo_path, IDLE)
+    assert restarted.recover() == 2
+    assert written == [
+        {("u1", "filter"): {"mastery": 0.5}, ("u2", "mutate"): {"mastery": 0.1}}
+    ]
+    assert _segments(redo_path) == []
+    assert restarted.recover() == 0
+    assert len(written) == 1
+
+
+def test_failed_flush_keeps_the_batch_and_newer_marks_win(tmp_path):
+    redo_path = str(tmp_path / "bkt_redo.log")
+    written = []
+    fail = [True]
+
+    def flush_fn(entries):
+        if fail[0]:
+            # A request marks the same key while the batch is in flight.
+            writer.mark(("u1", "filter"), {"mastery": 0.9})
+            raise RuntimeError("database is locked")
+        written.append(dict(entries))
+
+    writer = write_behind.WriteBehind(flush_fn, redo_path, IDLE)
+    writer.mark(("u1", "filter"), {"mastery": 0.4})
+    writer.mark(("u2", "mutate"), {"mastery": 0.2})
+
+    with pytest.raises(RuntimeError):
+        writer.flush()
+    assert writer.stats()["failures"] == 1
+    assert writer.pending(lambda key: True) == {
+        ("u1", "filter"): {"mastery": 0.9},
+        ("u2", "mutate"): {"mastery": 0.2},
+    }
+    # The failed batch's redo segment is kept for recover().
+    assert len(_segments(redo_path)) == 2
+
+    fail[0] = False
+    assert writer.flush() == 2
+    assert written == [
+        {("u1", "filter"): {"mastery": 0.9}, ("u2", "mutate"): {"mastery": 0.2}}
+    ]
+    assert writer.pending(lambda key: True) == {}
+
+
+def test_successful_flush_deletes_the_redo_segments(tmp_path):
+    redo_path = str(tmp_path / "bkt_redo.log")
+    written = []
+    writer = write_behind.WriteBehind(written.append, redo_path, IDLE)
+    writer.mark(("u1", "filter"), {"mastery": 0.4})
+    assert len(_segments(redo_path)) == 1
+
+    assert writer.flush() == 1
+    assert _segments(redo_path) == []
+
+    writer.mark(("u1", "filter"), {"mastery": 0.6})
+    writer.close()
+    assert _segments(redo_path) == []
+    assert written == [
+        {("u1", "filter"): {"mastery": 0.4}},
+        {("u1", "filter"): {"mastery": 0.6}},
+    ]
+    assert write_behind.WriteBehind(written.append, redo_path).recover() == 0
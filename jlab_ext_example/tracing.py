@@ -0,0 +1,218 @@
+"""
+Tracing Module
+
+Stage-level timing for single requests, so a slow chat turn can be broken
+down after the fact (was it the articulation rubric, get_code_with_blank,
+the chat-bot call or the Firebase logging?).
+
+    with tracing.trace("chat_turn", user_id=uid):     # root span
+        with tracing.span("plan"):                    # child span
+            ...
+        tracing.annotate(interaction="fill-in-blanks")
+
+    @tracing.traced()                                 # span per call
+    async def _ask(...): ...
+
+The open span lives in a ContextVar, so it follows awaits, and run_blocking
+/ run_llm in handlers.py run their function in a copy of the caller's
+context inside a span of its own, so blocking work (and the llm_chat calls
+inside it) is attributed to the request that scheduled it.
+
+When a root span closes, its trace is written to TUTORLY_TRACE_PATH (default
+traces.jsonl), one JSON object per span with trace/span/parent ids, if it
+was sampled (TUTORLY_TRACE_SAMPLE, a fraction of traces, default 0) or slow
+(TUTORLY_TRACE_SLOW_MS, default off). The decision is made at the end, so
+every slow turn is kept whatever the sample rate. With both unset, the
+calls above cost one ContextVar lookup.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import functools
+import itertools
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from typing import Optional
+
+TRACE_PATH = os.environ.get("TUTORLY_TRACE_PATH", "traces.jsonl")
+TRACE_SAMPLE = float(os.environ.get("TUTORLY_TRACE_SAMPLE", "0"))
+TRACE_SLOW_MS = (
+    float(os.environ["TUTORLY_TRACE_SLOW_MS"])
+    if os.environ.get("TUTORLY_TRACE_SLOW_MS")
+    else None
+)
+
+_current: contextvars.ContextVar = contextvars.ContextVar("tutorly_span", default=None)
+_span_ids = itertools.count(1)
+_write_lock = threading.Lock()
+
+
+class _Trace:
+    __slots__ = ("trace_id", "spans", "sampled")
+
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex
+        self.spans = []
+        self.sampled = random.random() < TRACE_SAMPLE
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "attrs", "start", "duration")
+
+    def __init__(self, trace: _Trace, parent_id: Optional[str], name: str, attrs: dict):
+        self.trace = trace
+        self.span_id = format(next(_span_ids), "x")
+        self.parent_id = parent_id
+        self.name = name
+        self.attrs = attrs
+        self.start = time.time()
+        self.duration = None
+
+    def to_dict(self) -> dict:
+        record = {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": round(self.start, 6),
+            "duration_ms": round(self.duration * 1000, 3),
+        }
+        record.update(self.attrs)
+        return record
+
+
+def is_enabled() -> bool:
+    return TRACE_SAMPLE > 0 or TRACE_SLOW_MS is not None
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+@contextlib.contextmanager
+def _open(trace: _Trace, parent_id: Optional[str], name: str, attrs: dict):
+    span_ = Span(trace, parent_id, name, attrs)
+    started = time.perf_counter()
+    token = _current.set(span_)
+    try:
+        yield span_
+    except BaseException as exc:
+        span_.attrs["error"] = type(exc).__name__
+        raise
+    finally:
+        span_.duration = time.perf_counter() - started
+        _current.reset(token)
+        trace.spans.append(span_)
+
+
+@contextlib.contextmanager
+def trace(name: str, **attrs):
+    """Root span of one request. Nested inside another span, a plain span."""
+    if _current.get() is not None or not is_enabled():
+        with span(name, **attrs) as span_:
+            yield span_
+        return
+    trace_ = _Trace()
+    try:
+        with _open(trace_, None, name, attrs) as root:
+            yield root
+    finally:
+        _finish(trace_, root)
+
+
+@contextlib.contextmanager
+def span(name: str, **attrs):
+    """Child span of the open span; does nothing outside a trace."""
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    with _open(parent.trace, parent.span_id, name, attrs) as span_:
+        yield span_
+
+
+def traced(name: Optional[str] = None):
+    """Decorator: run every call of the function in a span."""
+
+    def decorate(fn):
+        label = name or fn.__name__
+        if asyncio.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                with span(label):
+                    return await fn(*args, **kwargs)
+
+        else:
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with span(label):
+                    return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def annotate(**attrs) -> None:
+    """Attach attributes to the open span, if any."""
+    span_ = _current.get()
+    if span_ is not None:
+        span_.attrs.update(attrs)
+
+
+def record(name: str, started: float, **attrs) -> None:
+    """Add an already finished child span that began at perf_counter() `started`.
+
+    For code that cannot hold a with-block open, such as an async generator
+    (its body runs in whichever context iterates it).
+    """
+    parent = _current.get()
+    if parent is None:
+        return
+    duration = time.perf_counter() - started
+    span_ = Span(parent.trace, parent.span_id, name, attrs)
+    span_.start -= duration
+    span_.duration = duration
+    parent.trace.spans.append(span_)
+
+
+def bind(fn, *args, **kwargs):
+    """`fn(*args, **kwargs)` as a zero-argument callable for an executor.
+
+    Inside a trace, the callable runs in a copy of the current context and
+    in a span named after `fn`, recording how long it waited for a worker.
+    """
+    call = functools.partial(fn, *args, **kwargs)
+    if _current.get() is None:
+        return call
+    submitted = time.perf_counter()
+    name = getattr(fn, "__name__", "call")
+
+    def run():
+        queued_ms = round((time.perf_counter() - submitted) * 1000, 3)
+        with span(name, queued_ms=queued_ms):
+            return call()
+
+    return functools.partial(contextvars.copy_context().run, run)
+
+
+def _finish(trace_: _Trace, root: Span) -> None:
+    slow = TRACE_SLOW_MS is not None and root.duration * 1000 >= TRACE_SLOW_MS
+    if not (trace_.sampled or slow):
+        return
+    lines = "".join(
+        json.dumps(span_.to_dict(), default=str) + "\n"
+        for span_ in sorted(trace_.spans, key=lambda s: s.start)
+    )
+    try:
+        with _write_lock, open(TRACE_PATH, "a") as f:
+            f.write(lines)
+    except OSError as e:
+        print(f"⚠️  Could not write trace to {TRACE_PATH}: {str(e)}")
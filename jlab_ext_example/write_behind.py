@@ -0,0 +1,178 @@
+"""
+Write-Behind Module
+
+Coalesces frequent small writes (the per-observation BKT upserts) into one
+transaction every `interval` seconds, so the request that produced a write
+no longer waits on a SQLite commit.
+
+mark(key, value) records the latest value for a key in memory and appends
+it to a redo log. A background thread hands the dirty entries to
+`flush_fn(entries)` (one call, one transaction) when the interval elapses
+or when `max_dirty` keys are waiting; flush() does the same synchronously,
+for session end and server shutdown. Values are absolute states, not
+deltas, so replaying an entry twice is harmless and the last one wins.
+
+Redo log: JSON lines appended (and flushed to the OS, not fsynced) in
+numbered segments, `{redo_path}.{n}`. Each flush starts a new segment and,
+once the batch is committed, deletes the segments it covered. A failed
+batch is merged back into the dirty set and its segments are kept, so a
+later flush (or recover() on the next start) still writes it. recover()
+replays whatever segments a crashed process left behind.
+"""
+
+import glob
+import json
+import os
+import threading
+from typing import Callable, Dict, Hashable
+
+
+class WriteBehind:
+    def __init__(
+        self,
+        flush_fn: Callable[[Dict[Hashable, dict]], None],
+        redo_path: str,
+        interval: float = 0.3,
+        max_dirty: int = 64,
+    ):
+        self.flush_fn = flush_fn
+        self.redo_path = redo_path
+        self.interval = interval
+        self.max_dirty = max_dirty
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._dirty: dict = {}
+        self._segment = None  # open redo segment file
+        self._segment_no = 0
+        self._thread = None
+        self._stopping = False
+        self.flushes = 0
+        self.flushed_entries = 0
+        self.failures = 0
+
+    # -- redo log --------------------------------------------------------
+
+    def _segments(self) -> list:
+        found = []
+        for path in glob.glob(glob.escape(self.redo_path) + ".*"):
+            suffix = path.rsplit(".", 1)[1]
+            if suffix.isdigit():
+                found.append((int(suffix), path))
+        return sorted(found)
+
+    def _open_segment(self) -> None:
+        existing = self._segments()
+        if existing:
+            self._segment_no = max(self._segment_no, existing[-1][0])
+        self._segment_no += 1
+        self._segment = open(f"{self.redo_path}.{self._segment_no}", "a")
+
+    def recover(self) -> int:
+        """Replay redo segments left by a previous process. Returns entries."""
+        with self._flush_lock:
+            entries: dict = {}
+            with self._lock:
+                live = self._segment_no if self._segment is not None else None
+            segments = [(n, p) for n, p in self._segments() if n != live]
+            for _, path in segments:
+                with open(path) as f:
+                    for line in f:
+                        try:
+                            key, value = json.loads(line)
+                        except ValueError:
+                            # A torn last line from the crash; the entries
+                            # before it are intact.
+                            continue
+                        entries[tuple(key)] = value
+            if entries:
+                self.flush_fn(entries)
+            for _, path in segments:
+                os.remove(path)
+            return len(entries)
+
+    # -- writes ----------------------------------------------------------
+
+    def mark(self, key: tuple, value: dict) -> None:
+        """Record the latest `value` for `key`; it is persisted shortly."""
+        with self._lock:
+            if self._segment is None:
+                self._open_segment()
+            self._segment.write(json.dumps([list(key), value]) + "\n")
+            self._segment.flush()
+            self._dirty[key] = value
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="tutorly-write-behind", daemon=True
+                )
+                self._thread.start()
+            if len(self._dirty) >= self.max_dirty:
+                self._wake.notify()
+
+    def pending(self, match: Callable[[Hashable], bool]) -> dict:
+        """Unflushed entries whose key satisfies `match`."""
+        with self._lock:
+            return {k: v for k, v in self._dirty.items() if match(k)}
+
+    def flush(self) -> int:
+        """Write every dirty entry now. Returns the number written."""
+        with self._flush_lock:
+            with self._lock:
+                batch = self._dirty
+                if not batch:
+                    return 0
+                self._dirty = {}
+                covered = self._segment_no
+                if self._segment is not None:
+                    self._segment.close()
+                    self._segment = None
+            try:
+                self.flush_fn(batch)
+            except Exception:
+                with self._lock:
+                    # Newer marks win over the failed batch.
+                    batch.update(self._dirty)
+                    self._dirty = batch
+                    self.failures += 1
+                raise
+            for number, path in self._segments():
+                if number <= covered:
+                    os.remove(path)
+            with self._lock:
+                self.flushes += 1
+                self.flushed_entries += len(batch)
+            return len(batch)
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                if not self._stopping and len(self._dirty) < self.max_dirty:
+                    self._wake.wait(self.interval)
+                if self._stopping:
+                    return
+            try:
+                self.flush()
+            except Exception as exc:
+                print(f"⚠️  Write-behind flush failed, will retry: {exc}")
+
+    def close(self) -> None:
+        """Stop the flusher thread and write what is left."""
+        with self._lock:
+            self._stopping = True
+            self._wake.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        self.flush()
+        with self._lock:
+            self._stopping = False
+            self._thread = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "dirty": len(self._dirty),
+                "flushes": self.flushes,
+                "flushed_entries": self.flushed_entries,
+                "failures": self.failures,
+            }
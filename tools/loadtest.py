@@ -0,0 +1,334 @@
+"""Simulate concurrent study participants against a running Tutorly server.
+
+Each simulated participant walks the endpoint sequence src/Chat.tsx drives:
+log_session_start -> segments -> for each segment: update_seq, then chat
+turns (answering multiple-choice and fill-in-blanks items through
+update_bkt), go_on and log_code_execution until go_on says "yes" ->
+mark_video_finished -> log_session_end. Latency is recorded per endpoint and
+reported as JSON: p50/p95/p99/max in ms, request and error counts, plus
+overall throughput, so a TLJH host can be sized and regressions caught before
+a study wave.
+
+Point it at a server started with the offline backends (fakes.py), or let
+--spawn start one in a temporary directory:
+
+    TUTORLY_LLM_BACKEND=fake TUTORLY_FIREBASE_BACKEND=fake \
+        TUTORLY_FAKE_LLM_LATENCY_MS=1500 jupyter server --IdentityProvider.token=load
+
+Participant ids use the test_<condition> prefixes, so every participant is
+pinned to one condition (default full_coggen, the most expensive path).
+
+Usage:
+    python tools/loadtest.py --spawn --participants 20
+    python tools/loadtest.py --url http://127.0.0.1:8888 --token load \
+        --participants 40 --segments 3 --turns 6 --out load.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError, HTTPRequest
+
+CONDITION_PREFIXES = {
+    "control": "test_control",
+    "quiz": "test_quiz",
+    "fixed_cogapp": "test_fixed",
+    "full_coggen": "test_full",
+}
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def report(self, duration: float) -> dict:
+        endpoints = {}
+        for name in sorted(set(self.latencies) | set(self.errors)):
+            samples = sorted(self.latencies[name])
+            endpoints[name] = {
+                "count": len(samples) + self.errors[name],
+                "errors": self.errors[name],
+                "p50_ms": percentile(samples, 50),
+                "p95_ms": percentile(samples, 95),
+                "p99_ms": percentile(samples, 99),
+                "max_ms": round(samples[-1], 1) if samples else None,
+            }
+        requests = sum(e["count"] for e in endpoints.values())
+        return {
+            "duration_s": round(duration, 2),
+            "requests": requests,
+            "errors": sum(self.errors.values()),
+            "throughput_rps": round(requests / duration, 2) if duration else None,
+            "endpoints": endpoints,
+        }
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of sorted samples, in ms."""
+    if not samples:
+        return None
+    rank = max(1, -(-pct * len(samples) // 100))
+    return round(samples[int(rank) - 1], 1)
+
+
+class Participant:
+    def __init__(self, args, client, recorder, index):
+        self.args = args
+        self.client = client
+        self.recorder = recorder
+        self.user_id = f"{CONDITION_PREFIXES[args.condition]}_load_{args.run_id}_{index}"
+        self.session_id = str(uuid.uuid4())
+        self.rng = random.Random(index)
+
+    async def call(self, endpoint, body):
+        url = f"{self.args.url.rstrip('/')}/jlab_ext_example/{endpoint}"
+        request = HTTPRequest(
+            url,
+            method="POST",
+            body=json.dumps(body),
+            headers={"Authorization": f"token {self.args.token}"},
+            request_timeout=self.args.timeout,
+        )
+        start = time.perf_counter()
+        try:
+            response = await self.client.fetch(request)
+        except (HTTPClientError, OSError) as exc:
+            self.recorder.errors[endpoint] += 1
+            if self.args.verbose:
+                print(f"{self.user_id} {endpoint}: {exc}", file=sys.stderr)
+            return None
+        self.recorder.latencies[endpoint].append((time.perf_counter() - start) * 1000)
+        text = response.body.decode() if response.body else ""
+        try:
+            return json.loads(text) if text else None
+        except ValueError:
+            return text
+
+    async def think(self):
+        if self.args.think_ms:
+            await asyncio.sleep(self.rng.uniform(0.5, 1.5) * self.args.think_ms / 1000)
+
+    async def run(self):
+        video_id = self.args.video
+        ids = {"userId": self.user_id, "sessionId": self.session_id}
+        await self.call("log_session_start", dict(ids, videoId=video_id))
+        segments = await self.call("segments", dict(ids, videoId=video_id))
+        if not isinstance(segments, list):
+            return
+        for index, segment in enumerate(segments[: self.args.segments]):
+            await self.call(
+                "update_seq",
+                dict(
+                    ids,
+                    videoId=video_id,
+                    segmentIndex=index,
+                    category=segment["category"],
+                ),
+            )
+            await self.walk_segment(video_id, index, segment["category"])
+        await self.call("mark_video_finished", {"userId": self.user_id, "videoId": video_id})
+        await self.call(
+            "log_session_end", dict(ids, videoId=video_id, reason="finished_video")
+        )
+
+    async def walk_segment(self, video_id, index, category):
+        position = {"videoId": video_id, "segmentIndex": index, "userId": self.user_id}
+        selected_choice = ""
+        for _ in range(self.args.turns):
+            await self.think()
+            if selected_choice:
+                await self.call(
+                    "update_bkt",
+                    dict(
+                        position,
+                        sessionId=self.session_id,
+                        initialCode="",
+                        filledCode="",
+                        selectedChoice=selected_choice,
+                    ),
+                )
+            reply = await self.call(
+                "chat",
+                dict(
+                    position,
+                    sessionId=self.session_id,
+                    notebook={"cells": []},
+                    question="",
+                    category=category,
+                    kernelType="ir",
+                    selectedChoice=selected_choice,
+                    articulationAnswer="",
+                ),
+            )
+            selected_choice = ""
+            interaction = reply.get("interaction") if isinstance(reply, dict) else None
+            if interaction == "multiple-choice":
+                selected_choice = self.pick_choice(reply.get("message"))
+            elif interaction == "fill-in-blanks":
+                await self.call(
+                    "update_bkt",
+                    dict(
+                        position,
+                        sessionId=self.session_id,
+                        initialCode="___",
+                        filledCode="count(species)",
+                        selectedChoice="",
+                    ),
+                )
+            await self.call(
+                "log_code_execution",
+                dict(
+                    position,
+                    sessionId=self.session_id,
+                    code="pets %>% count(species)",
+                    cellType="code",
+                    status="success",
+                    output="",
+                    error="",
+                ),
+            )
+            if await self.call("go_on", position) == "yes":
+                return
+
+    def pick_choice(self, message):
+        try:
+            choices = json.loads(message).get("choices") or []
+        except (TypeError, ValueError, AttributeError):
+            choices = []
+        return self.rng.choice(choices) if choices else "a"
+
+
+async def run_load(args) -> dict:
+    AsyncHTTPClient.configure(None, max_clients=max(10, args.participants * 2))
+    client = AsyncHTTPClient()
+    recorder = Recorder()
+
+    async def start(i):
+        await asyncio.sleep(args.ramp * i / max(args.participants, 1))
+        await Participant(args, client, recorder, i).run()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(start(i) for i in range(args.participants)))
+    report = recorder.report(time.perf_counter() - started)
+    report["participants"] = args.participants
+    return report
+
+
+def spawn_server(args):
+    """Start jupyter_server with the fake backends in a temporary directory."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    workdir = tempfile.mkdtemp(prefix="tutorly-loadtest-")
+    # Importable from a plain checkout too, not only when pip-installed.
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    pythonpath = os.pathsep.join(filter(None, [repo, os.environ.get("PYTHONPATH")]))
+    env = dict(
+        os.environ,
+        PYTHONPATH=pythonpath,
+        TUTORLY_LLM_BACKEND="fake",
+        TUTORLY_FIREBASE_BACKEND="fake",
+        TUTORLY_FAKE_LLM_LATENCY_MS=str(args.llm_latency_ms),
+    )
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "jupyter_server",
+            "--no-browser",
+            f"--port={port}",
+            f"--IdentityProvider.token={args.token}",
+            "--ServerApp.allow_root=True",
+            "--ServerApp.jpserver_extensions={'jlab_ext_example': True}",
+            f"--ServerApp.root_dir={workdir}",
+        ],
+        cwd=workdir,
+        env=env,
+        stdout=subprocess.DEVNULL if not args.verbose else None,
+        stderr=subprocess.DEVNULL if not args.verbose else None,
+    )
+    args.url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return server
+        except OSError:
+            if server.poll() is not None:
+                sys.exit("jupyter_server exited during startup (rerun with --verbose).")
+            time.sleep(0.5)
+    server.terminate()
+    sys.exit("jupyter_server did not start within 60 s.")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--url", default="http://127.0.0.1:8888", help="Server base URL.")
+    parser.add_argument(
+        "--token",
+        default=os.environ.get("JUPYTER_TOKEN", "load"),
+        help="Jupyter server token (default: $JUPYTER_TOKEN or 'load').",
+    )
+    parser.add_argument(
+        "--spawn",
+        action="store_true",
+        help="Start a jupyter_server with the fake backends instead of using --url.",
+    )
+    parser.add_argument(
+        "--llm-latency-ms",
+        type=int,
+        default=1500,
+        help="Fake LLM latency for --spawn (default: 1500).",
+    )
+    parser.add_argument("--participants", type=int, default=10)
+    parser.add_argument("--video", default="EF4A4OtQprg", help="Study video to walk.")
+    parser.add_argument("--segments", type=int, default=3, help="Segments per participant.")
+    parser.add_argument("--turns", type=int, default=8, help="Max chat turns per segment.")
+    parser.add_argument(
+        "--condition", choices=sorted(CONDITION_PREFIXES), default="full_coggen"
+    )
+    parser.add_argument(
+        "--think-ms", type=int, default=0, help="Mean pause between a participant's turns."
+    )
+    parser.add_argument(
+        "--ramp", type=float, default=0.0, help="Seconds over which participants start."
+    )
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout.")
+    parser.add_argument("--out", help="Write the JSON report here instead of stdout.")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    args.run_id = uuid.uuid4().hex[:6]
+
+    server = spawn_server(args) if args.spawn else None
+    try:
+        report = asyncio.run(run_load(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if report["errors"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""Precompute the per-video content bundle shipped inside the package.
+
+Segments, knowledge, blanked code and the Modeling cards depend only on the
+video, never on the participant, yet the runtime generates them lazily on
+first request, in each participant's own cache.db. This build step generates
+them once, in parallel, and writes one read-only bundle per video to
+jlab_ext_example/content_bundle/{video_id}.json (see content_bundle.py for
+the format). The server then loads from the bundle first, so no participant
+waits on the knowledge LLM chain. Commit the files so they deploy with the
+package; rerun after changing a prompt, the model or the seeded segments.
+
+Generation runs in a fresh temporary working directory, so a stale cache.db
+in the current directory is never copied into the bundle, and with the
+bundle itself bypassed (TUTORLY_CONTENT_BUNDLE=0).
+
+Usage:
+    GEMINI_API_KEY=... python tools/precompute_content.py
+    GEMINI_API_KEY=... python tools/precompute_content.py --videos ID ID
+    GEMINI_API_KEY=... python tools/precompute_content.py --workers 4 \
+        --version pilot-2
+"""
+
+import argparse
+import datetime
+import json
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+STUDY_VIDEO_IDS = ["EF4A4OtQprg", "1xsbTs9-a50", "-1x8Kpyndss"]
+OUT_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "jlab_ext_example",
+    "content_bundle",
+)
+
+# Categories UpdateSeqHandler teaches from a fixed script, without knowledge.
+SCRIPTED_CATEGORIES = ("Load packages/data", "Understand the dataset")
+
+
+def build_segment(handlers, video_id, segment_index, segment):
+    """Knowledge, blanked code and Modeling card for one segment."""
+    all_code = handlers.get_all_code(video_id)
+    code_block = all_code.get(str(segment_index), "")
+    knowledge = handlers.get_knowledge(
+        video_id,
+        handlers.video_type,
+        segment["category"],
+        segment_index,
+        code_block,
+    )
+    out = {"knowledge": knowledge}
+    if code_block:
+        out["code_with_blanks"] = handlers.get_code_with_blank(
+            video_id, segment_index, all_code
+        )
+    if knowledge:
+        # Same prompt UpdateSeqHandler/get_dsl build for the segment opener.
+        action_set = handlers.prog_action if code_block else handlers.concept_action
+        modeling = action_set["Modeling"][0]
+        prompt = modeling["prompt"].replace("{knowledge}", knowledge[0])
+        card = handlers.generate_modeling_card(modeling["interaction"], prompt)
+        if card is not None:
+            out["modeling_card"] = {
+                "interaction": modeling["interaction"],
+                "prompt": prompt,
+                "card": card,
+            }
+    return out
+
+
+def build_video(handlers, video_id, pool, version):
+    segments = handlers.get_segments(video_id)
+    futures = {
+        i: pool.submit(build_segment, handlers, video_id, i, seg)
+        for i, seg in enumerate(segments)
+        if seg.get("category") not in SCRIPTED_CATEGORIES
+    }
+    bundle = {
+        "format": handlers.content_bundle.BUNDLE_FORMAT,
+        "version": version,
+        "video_id": video_id,
+        "model": handlers.DEFAULT_GEMINI_MODEL,
+        "segments": segments,
+        "knowledge": {},
+        "code_with_blanks": {},
+        "modeling_cards": {},
+    }
+    failed = []
+    for i, fut in futures.items():
+        try:
+            out = fut.result()
+        except Exception as exc:  # noqa: BLE001 - report and continue
+            print(f"{video_id}[{i}]: FAILED {type(exc).__name__}: {str(exc)[:200]}")
+            failed.append(i)
+            continue
+        if out["knowledge"]:
+            bundle["knowledge"][str(i)] = out["knowledge"]
+        else:
+            failed.append(i)
+        if out.get("code_with_blanks"):
+            bundle["code_with_blanks"][str(i)] = out["code_with_blanks"]
+        if out.get("modeling_card"):
+            bundle["modeling_cards"][str(i)] = out["modeling_card"]
+    return bundle, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--videos",
+        nargs="+",
+        default=STUDY_VIDEO_IDS,
+        help="Video IDs to build (default: the three study videos).",
+    )
+    parser.add_argument("--out", default=OUT_DIR, help="Output directory.")
+    parser.add_argument(
+        "--workers", type=int, default=8, help="Segments generated concurrently."
+    )
+    parser.add_argument(
+        "--version",
+        default=datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+        help="Build label recorded in each bundle (default: UTC timestamp).",
+    )
+    args = parser.parse_args()
+
+    if not (os.environ.get("GEMINI_API_KEY") or os.environ.get("OPENAI_API_KEY")):
+        sys.exit("Set GEMINI_API_KEY.")
+    out_dir = os.path.abspath(args.out)
+    os.environ["TUTORLY_CONTENT_BUNDLE"] = "0"
+    os.chdir(tempfile.mkdtemp(prefix="tutorly-precompute-"))
+
+    from jlab_ext_example import handlers, migrations
+
+    migrations.run_migrations()
+
+    os.makedirs(out_dir, exist_ok=True)
+    incomplete = []
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        for vid in args.videos:
+            bundle, failed = build_video(handlers, vid, pool, args.version)
+            path = os.path.join(out_dir, f"{vid}.json")
+            with open(path, "w") as f:
+                json.dump(bundle, f, ensure_ascii=False, indent=1)
+            print(
+                f"{vid}: {len(bundle['segments'])} segments, "
+                f"{len(bundle['knowledge'])} with knowledge, "
+                f"{len(bundle['modeling_cards'])} Modeling cards -> {path}"
+            )
+            if failed:
+                incomplete.append(f"{vid} {failed}")
+
+    if incomplete:
+        # Missing entries simply fall back to lazy generation at runtime.
+        sys.exit(f"\nIncomplete (rerun to fill in): {'; '.join(incomplete)}")
+    print("\nDone. Commit the files in jlab_ext_example/content_bundle/.")
+
+
+if __name__ == "__main__":
+    main()